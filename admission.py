@@ -0,0 +1,210 @@
+"""
+admission.py
+
+Admission control in front of Cryptiq bot's handlers.
+Every update first passes a token bucket for its user and command class, so one user (or script)
+spamming /portfolio or free text cannot burn upstream quotas meant for everyone; over-limit
+requests get one short "slow down" reply and are otherwise dropped. Expensive paths (AI chat and
+/portfolio, which fetches prices and renders charts) also need a slot from a global concurrency
+budget: a request waits briefly for a slot, and if the bot is saturated it is shed with a cheap
+reply (the user's last recorded portfolio value, or "busy") instead of queueing without limit.
+"""
+import os
+import time
+import asyncio
+import functools
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import database
+import keyboards
+import metrics
+from messages import catalog, user_language
+from notifier import TokenBucket
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+# Requests per minute per user, by command class (bursts allow a few back-to-back requests)
+ADMISSION_AI_PER_MINUTE = float(os.environ.get("ADMISSION_AI_PER_MINUTE", "6"))
+ADMISSION_PORTFOLIO_PER_MINUTE = float(os.environ.get("ADMISSION_PORTFOLIO_PER_MINUTE", "6"))
+ADMISSION_COMMANDS_PER_MINUTE = float(os.environ.get("ADMISSION_COMMANDS_PER_MINUTE", "60"))
+# Expensive requests running at once across all users, and how long one may wait for a slot
+ADMISSION_EXPENSIVE_SLOTS = int(os.environ.get("ADMISSION_EXPENSIVE_SLOTS", "32"))
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "2"))
+ADMISSION_MAX_WAITING = 256  # requests waiting for a slot before new ones are shed at once
+
+# Command class -> (requests per minute, burst)
+LIMITS: Dict[str, Tuple[float, float]] = {
+    "ai": (ADMISSION_AI_PER_MINUTE, 3),
+    "portfolio": (ADMISSION_PORTFOLIO_PER_MINUTE, 3),
+    "command": (ADMISSION_COMMANDS_PER_MINUTE, 20),
+}
+EXPENSIVE = {"ai", "portfolio"}
+# Handlers never limited (admin tools)
+EXEMPT = {"stats"}
+
+
+def classify(callback_name: str, update: Any, context: Any) -> Optional[str]:
+    """Command class of an update for the handler named callback_name, or None if exempt."""
+    if callback_name in EXEMPT:
+        return None
+    if callback_name == "show_portfolio":
+        return "portfolio"
+    if callback_name == "button_handler":
+        query = getattr(update, "callback_query", None)
+        return "portfolio" if getattr(query, "data", None) == keyboards.MENU_PREFIX + "portfolio" else "command"
+    if callback_name == "handle_message":
+        user_data = getattr(context, "user_data", None) or {}
+        # Onboarding and language answers are plain commands; anything else goes to the AI
+        if user_data.get("awaiting_language") or user_data.get("setup_step") is not None:
+            return "command"
+        return "ai"
+    return "command"
+
+
+class AdmissionController:
+    """
+    Per-user, per-class rate limits plus a global concurrency budget for expensive classes.
+
+    Args:
+        limits (dict): Command class -> (requests per minute, burst).
+        expensive_slots (int): Expensive requests allowed to run at once.
+        max_wait (float): Seconds an expensive request may wait for a slot before it is shed.
+        max_waiting (int): Requests allowed to wait for a slot; beyond that they are shed at once.
+        clock (callable): Monotonic clock, injectable for tests.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]] = LIMITS, expensive_slots: int = ADMISSION_EXPENSIVE_SLOTS,
+                 max_wait: float = ADMISSION_MAX_WAIT, max_waiting: int = ADMISSION_MAX_WAITING,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limits = limits
+        self.expensive_slots = expensive_slots
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.clock = clock
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._warned_until: Dict[Tuple[int, str], float] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._running = 0
+        self._waiting = 0
+        self.counts: Dict[str, int] = {"admitted": 0, "delayed": 0, "rejected": 0, "shed": 0}
+
+    # --- Rate limits ---
+
+    def take(self, user_id: int, cls: str) -> float:
+        """Consume a token for (user, class). Returns 0 if admitted, else seconds until the next token."""
+        key = (user_id, cls)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            per_minute, burst = self.limits[cls]
+            bucket = self._buckets[key] = TokenBucket(per_minute / 60.0, capacity=burst, clock=self.clock)
+            if len(self._buckets) > 50000:
+                self._prune()
+        wait = bucket.delay()
+        if wait > 0:
+            return wait
+        bucket.consume()
+        return 0.0
+
+    def _prune(self) -> None:
+        """Forget buckets that refilled completely (their users are idle)."""
+        self._buckets = {key: b for key, b in self._buckets.items() if not b.full()}
+        now = self.clock()
+        self._warned_until = {key: t for key, t in self._warned_until.items() if t > now}
+
+    def _count(self, result: str, cls: str) -> None:
+        self.counts[result] += 1
+        metrics.registry.inc("admission_total", result=result, cls=cls)
+
+    # --- Wrapping handlers ---
+
+    def guard(self, callback: Callable) -> Callable:
+        """Wrap a handler callback with admission control."""
+        name = getattr(callback, "__name__", "handler")
+
+        @functools.wraps(callback)
+        async def guarded(update, context):
+            cls = classify(name, update, context) if ADMISSION_ENABLED else None
+            user = getattr(update, "effective_user", None)
+            if cls is None or user is None:
+                return await callback(update, context)
+            wait = self.take(user.id, cls)
+            if wait > 0:
+                self._count("rejected", cls)
+                await self._reply_rate_limited(update, user.id, cls, wait)
+                return None
+            if cls not in EXPENSIVE:
+                self._count("admitted", cls)
+                return await callback(update, context)
+            if not await self._acquire(cls):
+                self._count("shed", cls)
+                await self._reply_shed(update, user.id, cls)
+                return None
+            try:
+                return await callback(update, context)
+            finally:
+                self._running -= 1
+                self._slots.release()
+
+        return guarded
+
+    async def _acquire(self, cls: str) -> bool:
+        """Take an expensive slot, waiting up to max_wait. False if the request must be shed."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.expensive_slots)  # bound to the bot's running loop
+        if self._slots.locked():
+            if self._waiting >= self.max_waiting:
+                return False
+            self._waiting += 1
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self._waiting -= 1
+            metrics.registry.observe("admission_wait_seconds", time.perf_counter() - started, cls=cls)
+            self._count("delayed", cls)
+        else:
+            await self._slots.acquire()
+            self._count("admitted", cls)
+        self._running += 1
+        return True
+
+    # --- Cheap replies ---
+
+    async def _reply_rate_limited(self, update: Any, user_id: int, cls: str, wait: float) -> None:
+        """Tell the user to slow down, at most once until their next token is due."""
+        key = (user_id, cls)
+        now = self.clock()
+        if self._warned_until.get(key, 0.0) > now:
+            return
+        self._warned_until[key] = now + wait
+        language = user_language(database.load_user_data(user_id))
+        await _reply(update, catalog.render(language, "admission.rate_limited", seconds=max(1, round(wait))))
+
+    async def _reply_shed(self, update: Any, user_id: int, cls: str) -> None:
+        language = user_language(database.load_user_data(user_id))
+        last = database.get_last_portfolio_value(user_id) if cls == "portfolio" else None
+        if last is not None:
+            await _reply(update, catalog.render(language, "portfolio.busy_last_value", value=last))
+        else:
+            await _reply(update, catalog.render(language, "admission.busy"))
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counts, running=self._running, waiting=self._waiting, tracked_buckets=len(self._buckets))
+
+
+async def _reply(update: Any, text: str) -> None:
+    message = getattr(update, "effective_message", None)
+    if message is not None:
+        await message.reply_text(text)
+
+
+# Shared by every guarded handler
+admission = AdmissionController()
+
+
+def guard_application(app) -> None:
+    """Put admission control in front of every handler registered on a telegram.ext.Application."""
+    for group in app.handlers.values():
+        for handler in group:
+            handler.callback = admission.guard(handler.callback)
@@ -0,0 +1,257 @@
+"""
+ai_chat.py
+
+Streaming AI chat for Cryptiq bot.
+Free-text messages are answered by the OpenAI chat completions API with streaming enabled: the
+bot replies with a placeholder at once and progressively edits it as tokens arrive, with edits
+throttled to stay inside Telegram's limits. Each user's conversation window lives in an in-memory,
+LRU-evicted store capped by an estimated token budget; it is rebuilt lazily from the chat log's
+in-memory index, so assembling a prompt never reads log files. General market questions are
+answered from the shared response cache (response_cache.py) when an answer for the same question,
+prices and profile shape is still fresh.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Tuple, Union
+
+import database
+import metrics
+from coins import coin_registry
+from messages import catalog, user_language
+from response_cache import response_cache, normalize, is_cacheable, price_fingerprint, portfolio_fingerprint, cache_key
+
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None  # OpenAI-compatible endpoint (default: api.openai.com)
+AI_CONTEXT_TOKENS = int(os.environ.get("AI_CONTEXT_TOKENS", "1500"))  # history budget per user
+AI_CONTEXT_USERS = int(os.environ.get("AI_CONTEXT_USERS", "5000"))  # conversation windows kept in memory
+AI_MAX_REPLY_TOKENS = 600
+EDIT_INTERVAL = float(os.environ.get("AI_EDIT_INTERVAL", "1.0"))  # seconds between message edits
+EDIT_MIN_CHARS = 40  # new characters needed before an intermediate edit
+TELEGRAM_MAX_CHARS = 4096
+PLACEHOLDER = "…"
+
+logger = logging.getLogger("cryptiq")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token plus per-message overhead)."""
+    return len(text) // 4 + 4
+
+
+class ConversationStore:
+    """
+    Per-user conversation windows: the newest turns that fit a token budget, for at most
+    `max_users` users (least recently used users are dropped and rebuilt on their next message).
+
+    Args:
+        token_budget (int): Estimated tokens of history kept per user.
+        max_users (int): Users kept in memory.
+    """
+
+    def __init__(self, token_budget: int = AI_CONTEXT_TOKENS, max_users: int = AI_CONTEXT_USERS):
+        self.token_budget = token_budget
+        self.max_users = max_users
+        self._windows: "OrderedDict[str, Tuple[Deque[Dict[str, str]], List[int]]]" = OrderedDict()
+        self.rebuilds = 0
+
+    def _window(self, user_id: str) -> Tuple[Deque[Dict[str, str]], List[int]]:
+        window = self._windows.get(user_id)
+        if window is None:
+            window = (deque(), [0])
+            self._windows[user_id] = window
+            # Lazy rebuild from the chat log's in-memory index (no file I/O)
+            self.rebuilds += 1
+            for entry in database.get_recent_chats(user_id):
+                user_message = entry.get("user_message", "")
+                if not user_message or user_message.startswith("["):
+                    continue  # skip system entries such as "[portfolio check]"
+                self._push(window, "user", user_message)
+                self._push(window, "assistant", entry.get("bot_response", ""))
+            while len(self._windows) > self.max_users:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(user_id)
+        return window
+
+    def _push(self, window: Tuple[Deque[Dict[str, str]], List[int]], role: str, content: str) -> None:
+        messages, used = window
+        messages.append({"role": role, "content": content})
+        used[0] += estimate_tokens(content)
+        while used[0] > self.token_budget and len(messages) > 1:
+            used[0] -= estimate_tokens(messages.popleft()["content"])
+
+    def history(self, user_id: Union[str, int]) -> List[Dict[str, str]]:
+        """Return the user's window as chat messages, oldest first."""
+        return list(self._window(str(user_id))[0])
+
+    def append(self, user_id: Union[str, int], user_message: str, reply: str) -> None:
+        window = self._window(str(user_id))
+        self._push(window, "user", user_message)
+        self._push(window, "assistant", reply)
+
+    def forget(self, user_id: Union[str, int]) -> None:
+        self._windows.pop(str(user_id), None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"users": len(self._windows), "rebuilds": self.rebuilds}
+
+
+conversations = ConversationStore()
+_client = None
+
+
+def get_openai_client():
+    """Return the shared AsyncOpenAI client (openai is imported on first use)."""
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+        _client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL)
+    return _client
+
+
+def build_messages(user_data: Dict[str, Any], history: List[Dict[str, str]], user_message: str,
+                   include_amounts: bool = True) -> List[Dict[str, str]]:
+    """
+    Assemble the system prompt, the user's conversation window and the new message.
+    With include_amounts=False only the coins held are named, so the prompt can be shared.
+    """
+    holdings = ", ".join(f"{coin.upper()} {amount}" if include_amounts else coin.upper()
+                         for coin, amount in (user_data.get("holdings") or {}).items()
+                         if amount not in (None, "", "skip")) or "none"
+    system = (
+        "You are Cryptiq, a concise assistant for crypto portfolio questions inside Telegram. "
+        "You never give financial advice. "
+        f"User's strategy: {user_data.get('strategy', 'not set')}. Holdings: {holdings}. "
+        f"Reply in the language with code '{user_data.get('language', 'en')}'."
+    )
+    return [{"role": "system", "content": system}] + history + [{"role": "user", "content": user_message}]
+
+
+class _StreamingReply:
+    """A Telegram message edited in place as text streams in, at most once per EDIT_INTERVAL."""
+
+    def __init__(self, message):
+        self.message = message
+        self.shown = ""
+        self.next_edit = 0.0
+
+    async def update(self, text: str, final: bool = False) -> None:
+        from telegram.error import BadRequest, RetryAfter
+        text = text[:TELEGRAM_MAX_CHARS]
+        now = time.monotonic()
+        if text == self.shown or (not final and (now < self.next_edit or len(text) - len(self.shown) < EDIT_MIN_CHARS)):
+            return
+        try:
+            await self.message.edit_text(text)
+            self.shown = text
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            seconds = float(retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after)
+            if final:
+                await asyncio.sleep(seconds)
+                await self.update(text, final=True)
+                return
+            self.next_edit = now + seconds
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self.next_edit = now + EDIT_INTERVAL
+
+
+def shared_cache_key(user_data: Dict[str, Any], user_message: str) -> Union[str, None]:
+    """
+    Response cache key for a general market question, or None when the prompt is personal,
+    depends on the conversation, or the user opted out (user_data["ai_cache"] is False).
+    """
+    import utils  # imported here: utils imports this module
+    normalized = normalize(user_message)
+    mentioned = coin_registry.mentioned(normalized.split())
+    if user_data.get("ai_cache") is False or not is_cacheable(normalized, mentioned):
+        return None
+    held = [coin for coin, amount in (user_data.get("holdings") or {}).items() if amount not in (None, "", "skip")]
+    coin_ids = set(mentioned.values())
+    coin_ids.update(utils.coin_ids_for_symbols(held))
+    prices = {}
+    for coin_id in coin_ids:
+        entry = utils.price_cache.peek(coin_id)
+        prices[coin_id] = float(entry["usd"]) if entry and "usd" in entry else None
+    return cache_key(normalized, price_fingerprint(prices),
+                     portfolio_fingerprint(user_data.get("strategy", "not set"), held, user_data.get("language", "en")))
+
+
+async def _stream_answer(message, messages: List[Dict[str, str]], started: float, language: str) -> Union[str, None]:
+    """Stream a completion into a new reply message. Returns the answer text, or None on failure."""
+    sent = await message.reply_text(PLACEHOLDER)
+    reply = _StreamingReply(sent)
+    text = ""
+    first_token = None
+    try:
+        stream = await get_openai_client().chat.completions.create(
+            model=OPENAI_MODEL, messages=messages, max_tokens=AI_MAX_REPLY_TOKENS, stream=True
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter()
+                metrics.registry.observe("ai_first_token_seconds", first_token - started)
+            text += delta
+            await reply.update(text + " " + PLACEHOLDER)
+    except Exception as e:
+        # Replace the placeholder (or partial answer) instead of leaving it hanging
+        logger.error(f"[ERROR] ai chat: {e}", exc_info=True)
+        metrics.registry.inc("errors_total", context="ai chat")
+        await reply.update(catalog.render(language, "ai.unavailable"), final=True)
+        return None
+    text = text.strip() or catalog.render(language, "ai.no_answer")
+    final = catalog.render(language, "ai.answer", answer=text)
+    await reply.update(final, final=True)
+    for start in range(TELEGRAM_MAX_CHARS, len(final), TELEGRAM_MAX_CHARS):
+        await message.reply_text(final[start:start + TELEGRAM_MAX_CHARS])
+    return text
+
+
+async def stream_reply(update, context) -> None:
+    """
+    Answer a free-text message with a streamed AI reply (or a cached answer to the same general
+    market question), then log the exchange.
+
+    Args:
+        update (telegram.Update): The update object from Telegram.
+        context (telegram.ext.CallbackContext): The handler context.
+    """
+    message = update.message
+    user_id = update.effective_user.id
+    user_message = message.text
+    user_data = database.load_user_data(user_id)
+    language = user_language(user_data)
+    if not os.environ.get("OPENAI_API_KEY"):
+        await message.reply_text(catalog.render(language, "ai.not_configured"))
+        return
+    started = time.perf_counter()
+    key = shared_cache_key(user_data, user_message)
+    if key is None:
+        response_cache.bypassed += 1
+        messages = build_messages(user_data, conversations.history(user_id), user_message)
+        text = await _stream_answer(message, messages, started, language)
+    else:
+        # Shared answers must not depend on this user's conversation or amounts
+        messages = build_messages(user_data, [], user_message, include_amounts=False)
+        text, source = await response_cache.get_or_compute(key, lambda: _stream_answer(message, messages, started, language))
+        if text is None and source == "coalesced":
+            await message.reply_text(catalog.render(language, "ai.unavailable"))
+        elif text is not None and source != "computed":
+            final = catalog.render(language, "ai.answer", answer=text)
+            for start in range(0, len(final), TELEGRAM_MAX_CHARS):
+                await message.reply_text(final[start:start + TELEGRAM_MAX_CHARS])
+        metrics.registry.inc("ai_cache_total", result=source)
+    if text is None:
+        return
+    metrics.registry.observe("ai_reply_seconds", time.perf_counter() - started)
+    conversations.append(user_id, user_message, text)
+    database.log_chat(user_id, user_message, text)
@@ -0,0 +1,259 @@
+"""
+alerts.py
+
+Indexed price-alert engine for Cryptiq bot.
+For every coin, alerts are kept in two sorted threshold arrays: "above" alerts fire when the price
+rises to their threshold, "below" alerts fire when it falls to it. Because fired alerts leave the
+arrays, every remaining above-threshold is higher than the last seen price and every remaining
+below-threshold is lower, so a tick only needs a binary search per side to find exactly the alerts
+the move crossed. Evaluating a tick therefore costs O(coins * log n + fired), not O(alerts).
+"""
+import bisect
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+import database
+
+ABOVE = "above"
+BELOW = "below"
+
+
+class _SortedThresholds:
+    """Parallel sorted arrays of thresholds and alert ids for one coin and direction."""
+    __slots__ = ("prices", "ids")
+
+    def __init__(self) -> None:
+        self.prices: List[float] = []
+        self.ids: List[int] = []
+
+    def insert(self, price: float, alert_id: int) -> None:
+        i = bisect.bisect_right(self.prices, price)
+        self.prices.insert(i, price)
+        self.ids.insert(i, alert_id)
+
+    def remove(self, price: float, alert_id: int) -> None:
+        lo = bisect.bisect_left(self.prices, price)
+        hi = bisect.bisect_right(self.prices, price)
+        for i in range(lo, hi):
+            if self.ids[i] == alert_id:
+                del self.prices[i]
+                del self.ids[i]
+                return
+
+    def pop_at_or_below(self, price: float) -> List[int]:
+        """Remove and return ids with threshold <= price (a prefix of the array)."""
+        k = bisect.bisect_right(self.prices, price)
+        fired = self.ids[:k]
+        del self.prices[:k]
+        del self.ids[:k]
+        return fired
+
+    def pop_at_or_above(self, price: float) -> List[int]:
+        """Remove and return ids with threshold >= price (a suffix of the array)."""
+        k = bisect.bisect_left(self.prices, price)
+        fired = self.ids[k:]
+        del self.prices[k:]
+        del self.ids[k:]
+        return fired
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+
+class _CoinAlerts:
+    """All armed alerts for one coin."""
+    __slots__ = ("above", "below", "pending")
+
+    def __init__(self) -> None:
+        self.above = _SortedThresholds()
+        self.below = _SortedThresholds()
+        # Alerts whose direction is not known yet (set before any price was seen)
+        self.pending: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.above) + len(self.below) + len(self.pending)
+
+
+class AlertEngine:
+    """
+    In-memory alert index backed by the alerts table in database.py.
+
+    Alert dicts carry "id", "user_id", "coin", "price" and optionally "direction" ("above"/"below")
+    and "repeat" (re-arm in the opposite direction after firing instead of being removed).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._alerts: Dict[int, Dict[str, Any]] = {}
+        self._coins: Dict[str, _CoinAlerts] = {}
+
+    def load(self) -> None:
+        """(Re)build the index from storage."""
+        with self._lock:
+            self._alerts.clear()
+            self._coins.clear()
+            for uid, user_alerts in database.load_alerts().items():
+                for alert in user_alerts:
+                    alert["user_id"] = uid
+                    self._index(alert)
+
+    def _index(self, alert: Dict[str, Any]) -> None:
+        """Place an alert in its coin's arrays (caller holds the lock)."""
+        self._alerts[alert["id"]] = alert
+        coin = self._coins.setdefault(alert["coin"], _CoinAlerts())
+        direction = alert.get("direction")
+        if direction == ABOVE:
+            coin.above.insert(float(alert["price"]), alert["id"])
+        elif direction == BELOW:
+            coin.below.insert(float(alert["price"]), alert["id"])
+        else:
+            coin.pending.append(alert["id"])
+
+    @staticmethod
+    def direction_for(threshold: float, current_price: Optional[float]) -> Optional[str]:
+        """Return which way the price has to move to reach threshold, or None if unknown."""
+        if current_price is None:
+            return None
+        return ABOVE if threshold >= current_price else BELOW
+
+    def add(self, user_id: Union[str, int], coin: str, price: float,
+            current_price: Optional[float] = None, repeat: bool = False) -> Dict[str, Any]:
+        """
+        Create, persist and index a new alert.
+
+        Args:
+            user_id (str|int): Telegram user ID.
+            coin (str): Coin symbol as entered by the user.
+            price (float): Threshold price in USD.
+            current_price (float): Latest known price, used to decide the alert's direction.
+            repeat (bool): Re-arm the alert after it fires instead of removing it.
+
+        Returns:
+            dict: The stored alert, including its id.
+        """
+        alert: Dict[str, Any] = {"coin": coin, "price": float(price)}
+        direction = self.direction_for(float(price), current_price)
+        if direction is not None:
+            alert["direction"] = direction
+        if repeat:
+            alert["repeat"] = True
+        with self._lock:
+            alert["id"] = database.add_alert(user_id, alert)
+            alert["user_id"] = str(user_id)
+            self._index(alert)
+        return alert
+
+    def coins(self) -> List[str]:
+        """Return the distinct coins that have at least one armed alert."""
+        with self._lock:
+            return [c for c, a in self._coins.items() if len(a)]
+
+    def count(self) -> int:
+        """Return the number of armed alerts."""
+        return len(self._alerts)
+
+    def evaluate(self, prices: Dict[str, float]) -> List[Dict[str, Any]]:
+        """
+        Fire every alert crossed by the given prices.
+
+        Fired alerts are removed (or re-armed in the opposite direction when "repeat" is set)
+        in one storage transaction before they are returned, so an alert never fires twice.
+        The index is only changed once that write succeeded; if it raises, every alert stays
+        armed and the next tick evaluates them again.
+
+        Args:
+            prices (dict): {coin: current price}. Coins without a price are skipped.
+
+        Returns:
+            list: The fired alert dicts, each with "current_price" set.
+        """
+        fired: List[Dict[str, Any]] = []
+        with self._lock:
+            removed: List[int] = []
+            updated: Dict[int, Dict[str, Any]] = {}
+            # (coin, price, alerts fired on the above side, on the below side, pending ids classified)
+            plan: List[Any] = []
+            for coin_name, price in prices.items():
+                coin = self._coins.get(coin_name)
+                if coin is None or price is None:
+                    continue
+                k_above = bisect.bisect_right(coin.above.prices, price)
+                k_below = bisect.bisect_left(coin.below.prices, price)
+                fired_ids = coin.above.ids[:k_above] + coin.below.ids[k_below:]
+                # Classify alerts created before a price was known (they fire from the next tick on)
+                for alert_id in coin.pending:
+                    alert = self._alerts[alert_id]
+                    updated[alert_id] = dict(alert, direction=self.direction_for(float(alert["price"]), price))
+                for alert_id in fired_ids:
+                    alert = self._alerts[alert_id]
+                    fired.append(dict(alert, current_price=price))
+                    if alert.get("repeat"):
+                        updated[alert_id] = dict(alert, direction=BELOW if alert["direction"] == ABOVE else ABOVE)
+                    else:
+                        removed.append(alert_id)
+                if fired_ids or coin.pending:
+                    plan.append((coin, price, list(coin.pending)))
+            if not (removed or updated):
+                return fired
+            database.apply_alert_changes(removed, updated)
+            # Stored: now apply the same changes to the index
+            for coin, price, pending in plan:
+                coin.above.pop_at_or_below(price)
+                coin.below.pop_at_or_above(price)
+                coin.pending = [i for i in coin.pending if i not in pending]
+            for alert_id in removed:
+                del self._alerts[alert_id]
+            for alert_id, alert in updated.items():
+                self._alerts[alert_id].update(alert)
+                coin = self._coins[alert["coin"]]
+                (coin.above if alert["direction"] == ABOVE else coin.below).insert(float(alert["price"]), alert_id)
+        return fired
+
+    async def evaluate_async(self, prices: Dict[str, float]) -> List[Dict[str, Any]]:
+        """evaluate() on a worker thread, so the storage write never blocks the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.evaluate, prices)
+
+    def remove_user(self, user_id: Union[str, int]) -> int:
+        """
+        Remove every alert belonging to a user. Returns how many were removed.
+        As in evaluate(), the index is only changed after the storage write succeeded.
+        """
+        uid = str(user_id)
+        with self._lock:
+            ids = [i for i, a in self._alerts.items() if a["user_id"] == uid]
+            if not ids:
+                return 0
+            database.apply_alert_changes(ids, {})
+            for alert_id in ids:
+                alert = self._alerts.pop(alert_id)
+                coin = self._coins[alert["coin"]]
+                if alert_id in coin.pending:
+                    coin.pending.remove(alert_id)
+                else:
+                    side = coin.above if alert.get("direction") == ABOVE else coin.below
+                    side.remove(float(alert["price"]), alert_id)
+        return len(ids)
+
+    def user_alerts(self, user_id: Union[str, int]) -> List[Dict[str, Any]]:
+        """Return a user's armed alerts."""
+        uid = str(user_id)
+        with self._lock:
+            return [dict(a) for a in self._alerts.values() if a["user_id"] == uid]
+
+
+_engine: Optional[AlertEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_alert_engine() -> AlertEngine:
+    """Return the process-wide alert engine, loading it from storage on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = AlertEngine()
+                engine.load()
+                _engine = engine
+    return _engine
+
@@ -0,0 +1,101 @@
+"""
+fake_telegram.py
+
+Offline stand-in for the Telegram Bot API used by the benchmarks.
+FakeTelegramRequest plugs into python-telegram-bot as its request transport and answers every
+Bot API call locally with a well-formed response, recording what the bot sent. make_update()
+builds Update objects for commands, text messages and button presses.
+"""
+import json
+import time
+import itertools
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Cryptiq", "username": "cryptiq_bot"}
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Bot API transport that never touches the network.
+
+    Args:
+        latency (float): Seconds to wait before answering each call, to mimic Telegram's RTT.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: List[Tuple[str, Dict[str, Any], float]] = []
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return 5.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            import asyncio
+            await asyncio.sleep(self.latency)
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls.append((endpoint, params, time.perf_counter()))
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode("utf-8")
+
+    def _result(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getUpdates":
+            return []
+        if endpoint in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0) or 0)
+            message = {
+                "message_id": int(params.get("message_id") or next(_message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            return message
+        return True
+
+    def sent(self, endpoint: Optional[str] = None) -> List[Tuple[str, Dict[str, Any], float]]:
+        """Return recorded calls, optionally only those to one endpoint."""
+        return [c for c in self.calls if endpoint is None or c[0] == endpoint]
+
+
+def make_update(bot, user_id: int, text: Optional[str] = None, callback_data: Optional[str] = None) -> Update:
+    """
+    Build an Update from a private chat: a command or text message, or a button press.
+
+    Args:
+        bot (telegram.Bot): The application's bot (needed so replies go through its transport).
+        user_id (int): Sender and chat ID.
+        text (str): Message text (commands start with '/').
+        callback_data (str): Inline button payload; builds a callback query instead of a message.
+    """
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "en"}
+    chat = {"id": user_id, "type": "private"}
+    message = {"message_id": next(_message_ids), "date": int(time.time()), "chat": chat, "from": user}
+    data: Dict[str, Any] = {"update_id": next(_update_ids)}
+    if callback_data is not None:
+        data["callback_query"] = {"id": str(data["update_id"]), "from": user, "chat_instance": "1",
+                                  "data": callback_data, "message": dict(message, **{"from": BOT_USER})}
+    else:
+        message["text"] = text or ""
+        if message["text"].startswith("/"):
+            command = message["text"].split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        data["message"] = message
+    return Update.de_json(data, bot)
@@ -0,0 +1,222 @@
+"""
+loadtest.py
+
+Load-test harness for the bot's handlers.
+Seeds users and alerts into a throwaway data directory, points the CoinGecko, news and OpenAI URLs
+at a local stub server (stub_upstream.py) with configurable latency and error rate, and drives
+synthetic Telegram updates through the real Application (handler dispatch included) using the
+offline Telegram transport (fake_telegram.py). alert_checker is driven directly, one call per tick,
+and revalue runs one bulk revaluation (valuation.py) of every seeded portfolio per operation.
+
+Reports p50/p95/p99 latency and throughput per scenario plus peak RSS, as JSON.
+
+Usage:
+    python benchmarks/loadtest.py --users 1000 --alerts 1000 --requests 2000 --concurrency 50
+    python benchmarks/loadtest.py --matrix            # 1k / 10k / 100k users and alerts, one process each
+    python benchmarks/loadtest.py --output run.json   # write the report to a file too
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+SCENARIOS = ("portfolio", "setalert", "message", "news", "alert_checker", "revalue")
+COINS = ["btc", "ltc", "bitcoin", "litecoin", "eth", "sol", "ada", "doge", "xrp", "dot"]
+
+
+def _use_temp_data_dir() -> str:
+    """Point every storage module at a fresh temporary directory (before they are imported)."""
+    data_dir = tempfile.mkdtemp(prefix="cryptiq-loadtest-")
+    os.environ["CRYPTIQ_DB_FILE"] = os.path.join(data_dir, "cryptiq.db")
+    os.environ["CRYPTIQ_CHAT_LOG_DIR"] = os.path.join(data_dir, "chat_logs")
+    os.environ["CRYPTIQ_TIMESERIES_DIR"] = os.path.join(data_dir, "timeseries")
+    os.environ["CRYPTIQ_CANDLE_DIR"] = os.path.join(data_dir, "candles")
+    os.environ["CRYPTIQ_BACKUP_DIR"] = os.path.join(data_dir, "backups")
+    return data_dir
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (0 where the resource module is unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def summarize(latencies, wall_s: float):
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "throughput_per_s": round(len(ordered) / wall_s, 1) if wall_s else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+def seed(users: int, alerts: int, rng: random.Random) -> None:
+    """Bulk-insert users with holdings and alerts, then load the alert index."""
+    import database
+    import alerts as alert_engine
+    with database._transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+            [(str(uid), json.dumps({"holdings": {c: round(rng.uniform(0.01, 5), 4) for c in rng.sample(COINS, 3)},
+                                    "strategy": "hodl"})) for uid in range(1, users + 1)]
+        )
+    bulk = {}
+    for _ in range(alerts):
+        uid = str(rng.randint(1, users))
+        bulk.setdefault(uid, []).append({"coin": rng.choice(COINS), "price": round(rng.uniform(10, 1100), 2),
+                                         "direction": rng.choice(["above", "below"])})
+    database.save_alerts(bulk)
+    alert_engine.get_alert_engine().load()
+
+
+async def drive(app, request, scenario: str, total: int, concurrency: int, users: int, rng: random.Random):
+    """Run `total` operations of one scenario with `concurrency` in flight; returns per-op latencies."""
+    import handlers
+    from fake_telegram import make_update
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+    if scenario == "revalue":
+        # One bulk revaluation of every seeded portfolio per operation (book built once, untimed)
+        import database
+        import utils
+        import valuation
+        book = valuation.PortfolioBook.build(database.iter_users())
+        market_data = await utils.get_market_data_for_coins_async(book.coin_ids)
+
+    def build(i: int):
+        uid = rng.randint(1, users)
+        if scenario == "portfolio":
+            return make_update(app.bot, uid, "/portfolio")
+        if scenario == "setalert":
+            return make_update(app.bot, uid, f"/setalert {rng.choice(COINS)} {rng.uniform(10, 1100):.2f}")
+        if scenario == "message":
+            return make_update(app.bot, uid, "What is the market doing today?")
+        return make_update(app.bot, uid, "/news")
+
+    async def one(i: int):
+        async with sem:
+            start = time.perf_counter()
+            if scenario == "alert_checker":
+                await handlers.alert_checker(app)
+            elif scenario == "revalue":
+                valuation.revalue(book, market_data)
+            else:
+                await app.process_update(build(i))
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies, time.perf_counter() - started
+
+
+async def run_once(args) -> dict:
+    data_dir = _use_temp_data_dir()
+    sys.path[:0] = [REPO_ROOT, BENCH_DIR]
+    from stub_upstream import start_stub_server, point_bot_at
+    from fake_telegram import FakeTelegramRequest
+    server, stub, base_url = start_stub_server(args.latency_ms, args.error_rate)
+    point_bot_at(base_url)
+
+    import main
+    import news
+    import admission
+    from response_cache import response_cache
+    rng = random.Random(args.seed)
+    t0 = time.perf_counter()
+    seed(args.users, args.alerts, rng)
+    seed_s = time.perf_counter() - t0
+
+    request = FakeTelegramRequest(latency=args.telegram_latency_ms / 1000.0)
+    app = main.build_application("123456:LOADTEST", request=request)
+    await app.initialize()
+    await news.news_cache.refresh()
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = {}
+    for scenario in scenarios:
+        total = max(1, args.requests // 20) if scenario in ("alert_checker", "revalue") else args.requests
+        latencies, wall = await drive(app, request, scenario, total, args.concurrency, args.users, rng)
+        results[scenario] = summarize(latencies, wall)
+
+    await app.shutdown()
+    await main.on_shutdown(app)
+    server.shutdown()
+    return {
+        "users": args.users,
+        "alerts": args.alerts,
+        "requests_per_scenario": args.requests,
+        "concurrency": args.concurrency,
+        "upstream": {"latency_ms": args.latency_ms, "error_rate": args.error_rate,
+                     "requests": stub.requests, "errors": stub.errors, "completions": stub.completions},
+        "telegram_calls": len(request.calls),
+        "admission": admission.admission.stats(),
+        "ai_cache": response_cache.stats(),
+        "seed_s": round(seed_s, 2),
+        "scenarios": results,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "data_dir": data_dir,
+    }
+
+
+def run_matrix(args) -> list:
+    """Run 1k/10k/100k users and alerts, each in a fresh process so peak RSS is per scale."""
+    reports = []
+    for scale in (1000, 10000, 100000):
+        cmd = [sys.executable, os.path.abspath(__file__), "--users", str(scale), "--alerts", str(scale),
+               "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+               "--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate),
+               "--telegram-latency-ms", str(args.telegram_latency_ms), "--scenario", args.scenario,
+               "--seed", str(args.seed)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"scale {scale} failed:\n{proc.stderr[-2000:]}")
+        reports.append(json.loads(proc.stdout))
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--alerts", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=2000, help="operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="stub upstream latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="stub upstream error rate (0-1)")
+    parser.add_argument("--telegram-latency-ms", type=float, default=0.0, help="fake Bot API latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--matrix", action="store_true", help="run 1k/10k/100k scales")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_matrix(args) if args.matrix else asyncio.run(run_once(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
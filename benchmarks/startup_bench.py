@@ -0,0 +1,129 @@
+"""
+startup_bench.py
+
+Cold-start benchmark for the bot entry point.
+Reports two numbers and checks them against a budget:
+  * import time of `main` from `python -X importtime` (total, plus the heaviest top-level imports,
+    and whether matplotlib or numpy was pulled in at startup);
+  * time-to-first-update: wall time from launching a fresh interpreter to the bot having built its
+    Application and answered a /news update, using the offline Telegram stand-in.
+
+Usage:
+    python benchmarks/startup_bench.py [--runs 5] [--budget-import-ms 1500] [--budget-first-update-ms 3000]
+
+Prints one JSON object; exits with status 1 if a median exceeds its budget or if matplotlib or
+numpy is imported at startup (both must load on first use only).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_TOKEN = "123456:BENCHMARK"
+
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([REPO_ROOT, os.path.join(REPO_ROOT, "benchmarks")])
+    env.setdefault("TELEGRAM_TOKEN", FAKE_TOKEN)
+    return env
+
+
+def measure_importtime():
+    """Run `python -X importtime -c "import main"` and summarize its report."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                          cwd=REPO_ROOT, env=_env(), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{proc.stderr[-2000:]}")
+    # Rows look like "import time:       123 |        456 |   name"; nesting is shown by two
+    # extra spaces of indentation per level. `main` is the depth-0 row for the bot itself and
+    # its direct imports are at depth 1.
+    main_us = 0
+    children = []
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.add(name.strip())
+        if depth == 0 and name.strip() == "main":
+            main_us = int(fields[1])
+        elif depth == 1:
+            children.append((name.strip(), int(fields[1])))
+    heaviest = sorted(children, key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "total_ms": round(main_us / 1000, 1),
+        "heaviest_ms": {name: round(us / 1000, 1) for name, us in heaviest},
+        "matplotlib_loaded": any(m == "matplotlib" or m.startswith("matplotlib.") for m in modules),
+        "numpy_loaded": any(m == "numpy" or m.startswith("numpy.") for m in modules),
+    }
+
+
+CHILD_SCRIPT = r"""
+import asyncio, json, sys, time
+t_start = float(sys.argv[1])
+import main
+from fake_telegram import FakeTelegramRequest, make_update
+
+async def run():
+    request = FakeTelegramRequest()
+    app = main.build_application(main.os.environ["TELEGRAM_TOKEN"], request=request)
+    await app.initialize()
+    await app.process_update(make_update(app.bot, 42, "/news"))
+    answered = request.sent("sendMessage")
+    await app.shutdown()
+    return answered
+
+answered = asyncio.run(run())
+print(json.dumps({"first_update_ms": (time.time() - t_start) * 1000, "answered": bool(answered)}))
+"""
+
+
+def measure_first_update():
+    """Launch a fresh interpreter and time it until the first update has been answered."""
+    t_start = time.time()
+    proc = subprocess.run([sys.executable, "-c", CHILD_SCRIPT, repr(t_start)],
+                          cwd=REPO_ROOT, env=_env(), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"first-update run failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-import-ms", type=float, default=1500.0)
+    parser.add_argument("--budget-first-update-ms", type=float, default=3000.0)
+    args = parser.parse_args()
+
+    imports = [measure_importtime() for _ in range(args.runs)]
+    updates = [measure_first_update() for _ in range(args.runs)]
+    import_ms = statistics.median(r["total_ms"] for r in imports)
+    first_update_ms = statistics.median(r["first_update_ms"] for r in updates)
+    report = {
+        "runs": args.runs,
+        "import_total_ms": import_ms,
+        "import_heaviest_ms": imports[-1]["heaviest_ms"],
+        "matplotlib_loaded_at_startup": imports[-1]["matplotlib_loaded"],
+        "numpy_loaded_at_startup": imports[-1]["numpy_loaded"],
+        "first_update_ms": round(first_update_ms, 1),
+        "first_update_answered": all(r["answered"] for r in updates),
+        "budget": {"import_ms": args.budget_import_ms, "first_update_ms": args.budget_first_update_ms},
+    }
+    report["within_budget"] = (import_ms <= args.budget_import_ms
+                               and first_update_ms <= args.budget_first_update_ms
+                               and report["first_update_answered"]
+                               and not report["matplotlib_loaded_at_startup"]
+                               and not report["numpy_loaded_at_startup"])
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["within_budget"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+stub_upstream.py
+
+Local stand-in for the CoinGecko simple-price API, the CryptoCompare news API and an
+OpenAI-compatible streaming chat completions endpoint, with configurable latency and error rate,
+for load tests. Prices follow a small random walk per coin so alerts can fire; chat answers are
+streamed as server-sent events, a few words per chunk.
+
+Run standalone:
+    python benchmarks/stub_upstream.py --port 8099 --latency-ms 80 --error-rate 0.05
+"""
+import os
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class StubState:
+    """Shared configuration and counters for the stub server."""
+
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0, seed: int = 1):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.prices = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.completions = 0
+
+    def price(self, coin_id: str) -> float:
+        with self.lock:
+            price = self.prices.get(coin_id) or 10 + self.random.random() * 1000
+            price *= 1 + self.random.uniform(-0.01, 0.01)
+            self.prices[coin_id] = price
+            return price
+
+
+# Streamed back by the chat completions stub, STUB_CHUNK_WORDS words per event
+STUB_ANSWER = ("Markets are mixed today: large caps are trading sideways while smaller coins are more volatile. "
+               "Keep an eye on overall volume and remember that short-term moves are hard to predict.")
+STUB_CHUNK_WORDS = 3
+
+
+def _make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, payload) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _admit(self) -> bool:
+            """Count the request, apply the latency and maybe fail it. Returns False if a 503 was sent."""
+            with state.lock:
+                state.requests += 1
+                fail = state.random.random() < state.error_rate
+            if state.latency_ms:
+                time.sleep(state.latency_ms / 1000.0)
+            if fail:
+                with state.lock:
+                    state.errors += 1
+                self._send(503, {"status": {"error_code": 503, "error_message": "stub failure"}})
+            return not fail
+
+        def _write_chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not self._admit():
+                return
+            if not urlsplit(self.path).path.endswith("/chat/completions"):
+                self._send(404, {"error": "not found"})
+                return
+            request = json.loads(body or b"{}")
+            with state.lock:
+                state.completions += 1
+            words = STUB_ANSWER.split(" ")
+            chunks = [" ".join(words[i:i + STUB_CHUNK_WORDS]) + " " for i in range(0, len(words), STUB_CHUNK_WORDS)]
+            completion_id = "chatcmpl-" + uuid.uuid4().hex
+            if not request.get("stream"):
+                self._send(200, {"id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                                 "model": request.get("model", "stub"),
+                                 "choices": [{"index": 0, "finish_reason": "stop",
+                                              "message": {"role": "assistant", "content": "".join(chunks)}}]})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for n, text in enumerate(chunks + [None]):
+                delta = {} if text is None else ({"role": "assistant", "content": text} if n == 0 else {"content": text})
+                event = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": request.get("model", "stub"),
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if text is None else None}]}
+                self._write_chunk(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def do_GET(self):
+            if not self._admit():
+                return
+            url = urlsplit(self.path)
+            if url.path.endswith("/simple/price"):
+                ids = [i for i in parse_qs(url.query).get("ids", [""])[0].split(",") if i]
+                self._send(200, {i: {"usd": round(state.price(i), 6), "usd_24h_change": round(state.random.uniform(-5, 5), 3)} for i in ids})
+            elif "/news" in url.path:
+                self._send(200, {"Data": [{"title": f"Stub headline {n}", "url": f"https://example.com/{n}"} for n in range(10)]})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_stub_server(latency_ms: float = 0.0, error_rate: float = 0.0, port: int = 0):
+    """
+    Start the stub server in a daemon thread.
+
+    Returns:
+        tuple: (server, state, base_url)
+    """
+    state = StubState(latency_ms, error_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_port}"
+
+
+def point_bot_at(base_url: str) -> None:
+    """Redirect the bot's upstream URLs (CoinGecko, news and the OpenAI API) to the stub server."""
+    import utils
+    import coins
+    import ai_chat
+    os.environ["OPENAI_API_KEY"] = "stub-key"  # AI chat is disabled without a key; never send a real one here
+    ai_chat.OPENAI_BASE_URL = base_url + "/v1"
+    ai_chat._client = None
+    # Not served: the registry refresh fails and keeps the snapshot
+    coins.COINGECKO_LIST_API = base_url + "/api/v3/coins/list"
+    coins.COINGECKO_MARKETS_API = base_url + "/api/v3/coins/markets?vs_currency=usd&page={page}"
+    utils.COINGECKO_SIMPLE_PRICE_API = base_url + "/api/v3/simple/price?vs_currencies=usd&include_24hr_change=true&ids={ids}"
+    utils.CRYPTOCOMPARE_NEWS_API = base_url + "/data/v2/news/?lang=EN"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub CoinGecko/CryptoCompare/OpenAI server")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    _, _, url = start_stub_server(args.latency_ms, args.error_rate, args.port)
+    print(f"Stub upstream listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,125 @@
+"""
+webhook_poster.py
+
+Local stand-in for Telegram's webhook deliveries.
+Starts the bot's webhook server in-process (offline Telegram transport, throwaway data directory),
+POSTs synthetic updates to it the way Telegram does (JSON body, secret-token header) from many
+users at once, then stops the bot and checks that:
+  * every update was answered, including those still in flight when shutdown began (drain);
+  * each user's replies came back in the order that user's updates were sent.
+
+Usage:
+    python benchmarks/webhook_poster.py --users 50 --per-user 10 --telegram-latency-ms 20
+    python benchmarks/webhook_poster.py --url http://127.0.0.1:8443/telegram --secret s3cret   # post to a running bot
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+SECRET = "webhook-poster-secret"
+
+
+def build_payloads(bot, users: int, per_user: int):
+    """One list of update JSON bodies per user; reply n to user u must mention price n."""
+    from fake_telegram import make_update
+    return {uid: [make_update(bot, uid, f"/setalert btc {n + 1}").to_json() for n in range(per_user)]
+            for uid in range(1, users + 1)}
+
+
+async def post_all(url: str, secret: str, payloads, concurrency: int):
+    """POST every user's updates in order (one user's updates are sent one after another)."""
+    import httpx
+    headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret}
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def send_user(bodies):
+            for body in bodies:
+                async with sem:
+                    start = time.perf_counter()
+                    resp = await client.post(url, content=body, headers=headers)
+                    resp.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+        started = time.perf_counter()
+        await asyncio.gather(*(send_user(b) for b in payloads.values()))
+    return latencies, time.perf_counter() - started
+
+
+def check_order(request, users: int, per_user: int):
+    """Return (answered, users whose replies came back out of order)."""
+    replies = {}
+    for _, params, _ in request.sent("sendMessage"):
+        text = params.get("text", "")
+        if text.startswith("Alert set for BTC at $"):
+            price = float(text[len("Alert set for BTC at $"):].split()[0].rstrip(".").replace(",", ""))
+            replies.setdefault(int(params["chat_id"]), []).append(price)
+    answered = sum(len(v) for v in replies.values())
+    out_of_order = [uid for uid, prices in replies.items() if prices != sorted(prices)]
+    return answered, out_of_order
+
+
+async def run_local(args) -> dict:
+    from loadtest import _use_temp_data_dir, summarize
+    _use_temp_data_dir()
+    import main
+    from fake_telegram import FakeTelegramRequest
+    request = FakeTelegramRequest(latency=args.telegram_latency_ms / 1000.0)
+    app = main.build_application("123456:WEBHOOK", request=request)
+    await app.initialize()
+    await app.updater.start_webhook(listen="127.0.0.1", port=args.port, url_path="telegram", secret_token=SECRET)
+    await app.start()
+    url = f"http://127.0.0.1:{args.port}/telegram"
+
+    payloads = build_payloads(app.bot, args.users, args.per_user)
+    latencies, wall = await post_all(url, SECRET, payloads, args.concurrency)
+    # Telegram only waits for the 200; processing continues. Stopping must drain what is in flight.
+    stop_started = time.perf_counter()
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    drain_s = time.perf_counter() - stop_started
+    answered, out_of_order = check_order(request, args.users, args.per_user)
+    expected = args.users * args.per_user
+    return {
+        "updates": expected,
+        "answered": answered,
+        "users_out_of_order": len(out_of_order),
+        "post": summarize(latencies, wall),
+        "processed_per_s": round(expected / (wall + drain_s), 1),
+        "drain_s": round(drain_s, 3),
+        "ok": answered == expected and not out_of_order,
+    }
+
+
+async def run_remote(args) -> dict:
+    from loadtest import summarize
+    from telegram import Bot
+    payloads = build_payloads(Bot("123456:POSTER"), args.users, args.per_user)
+    latencies, wall = await post_all(args.url, args.secret, payloads, args.concurrency)
+    return {"updates": args.users * args.per_user, "post": summarize(latencies, wall)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--per-user", type=int, default=10, help="updates sent by each user, in order")
+    parser.add_argument("--concurrency", type=int, default=50, help="POSTs in flight")
+    parser.add_argument("--telegram-latency-ms", type=float, default=20.0, help="fake Bot API latency")
+    parser.add_argument("--port", type=int, default=8787, help="port for the in-process webhook server")
+    parser.add_argument("--url", help="post to an already running bot instead of starting one")
+    parser.add_argument("--secret", default=SECRET, help="secret token sent with --url")
+    args = parser.parse_args()
+
+    sys.path[:0] = [REPO_ROOT, BENCH_DIR]
+    report = asyncio.run(run_remote(args) if args.url else run_local(args))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report.get("ok", True) else 1)
+
+
+if __name__ == "__main__":
+    main()
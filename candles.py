@@ -0,0 +1,319 @@
+"""
+candles.py
+
+Local historical price store for Cryptiq bot.
+Each coin has one file of fixed-width hourly candles (int64 bucket start, float64 open, high, low,
+close) behind a small header. Reads go through numpy.memmap, so range slices and lookups are
+zero-copy views onto the page cache, shared by every process that opens the same files (chart
+workers included). Candles are extended live from the price bus (each tick updates the current
+hour in place or appends the next one), and a background job backfills history and any gaps
+from CoinGecko's market_chart endpoint, so 7d/30d performance and price history are computed
+locally instead of fetched per request. numpy is imported on first use, not at bot startup.
+"""
+import os
+import math
+import time
+import struct
+import asyncio
+import logging
+import functools
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Set, Tuple
+
+import metrics
+from coins import coin_registry
+from http_client import get_http_client
+
+if TYPE_CHECKING:
+    import numpy as np
+
+CANDLE_DIR = os.environ.get("CRYPTIQ_CANDLE_DIR", os.path.join(os.path.dirname(__file__), "candles"))
+CANDLE_INTERVAL = 3600  # seconds per candle
+CANDLE_BACKFILL_DAYS = 90  # CoinGecko serves hourly points for up to 90 days
+CANDLE_BACKFILL_PER_RUN = int(os.environ.get("CANDLE_BACKFILL_PER_RUN", "10"))  # coins fetched per job run
+CANDLE_MAX_GAP = 6 * 3600  # a close older than this before the asked time counts as unknown
+COINGECKO_MARKET_CHART_API = "https://api.coingecko.com/api/v3/coins/{id}/market_chart?vs_currency=usd&days={days}"
+
+_MAGIC = b"CQCD"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHHI4x")  # magic, version, flags, interval; padded to 16 bytes
+_FLAG_BACKFILLED = 1
+
+logger = logging.getLogger("cryptiq")
+
+
+@functools.lru_cache(maxsize=1)
+def candle_dtype() -> "np.dtype":
+    """Record layout of one candle: int64 bucket start, float64 open, high, low, close (numpy loads here)."""
+    import numpy as np
+    return np.dtype([("ts", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8")])
+
+
+def aggregate(points_ms: Iterable[Tuple[float, float]], interval: int = CANDLE_INTERVAL) -> "np.ndarray":
+    """Turn [(timestamp ms, price)] (oldest first) into OHLC candles, one per interval bucket."""
+    import numpy as np
+    points = np.asarray([p for p in points_ms if p[1] is not None], dtype=np.float64).reshape(-1, 2)
+    if not len(points):
+        return np.zeros(0, dtype=candle_dtype())
+    points = points[np.argsort(points[:, 0], kind="stable")]
+    buckets = (points[:, 0] // 1000).astype(np.int64) // interval * interval
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(points)] - 1
+    out = np.zeros(len(starts), dtype=candle_dtype())
+    out["ts"] = buckets[starts]
+    out["open"] = points[starts, 1]
+    out["high"] = np.maximum.reduceat(points[:, 1], starts)
+    out["low"] = np.minimum.reduceat(points[:, 1], starts)
+    out["close"] = points[ends, 1]
+    return out
+
+
+class CandleStore:
+    """
+    Per-coin candle files with memory-mapped reads.
+
+    Args:
+        directory (str): Folder holding one <coin id>.bin file per coin.
+        interval (int): Seconds per candle.
+    """
+
+    def __init__(self, directory: str = CANDLE_DIR, interval: int = CANDLE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._maps: "Dict[str, Tuple[int, int, np.ndarray]]" = {}  # coin -> (inode, size, view)
+        self._last: "Dict[str, np.ndarray]" = {}  # coin -> its newest candle (one-element array)
+        self._lock = threading.Lock()
+        self.ingested = 0
+        self.backfills = 0
+        self.failures = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    # --- Files ---
+
+    def _path(self, coin_id: str) -> str:
+        return os.path.join(self.directory, f"{coin_id}.bin")
+
+    def _header(self, flags: int = 0) -> bytes:
+        return _HEADER.pack(_MAGIC, _VERSION, flags, self.interval)
+
+    def _flags(self, coin_id: str) -> int:
+        try:
+            with open(self._path(coin_id), "rb") as f:
+                magic, _, flags, _ = _HEADER.unpack(f.read(_HEADER.size))
+        except (OSError, struct.error):
+            return 0
+        return flags if magic == _MAGIC else 0
+
+    def _rewrite(self, coin_id: str, candles: "np.ndarray", flags: int) -> None:
+        path = self._path(coin_id)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(self._header(flags))
+            f.write(candles.astype(candle_dtype(), copy=False).tobytes())
+        os.replace(tmp, path)
+        self._last.pop(coin_id, None)
+
+    # --- Reads ---
+
+    def candles(self, coin_id: str, start: Optional[float] = None, end: Optional[float] = None) -> "np.ndarray":
+        """
+        Candles with start <= ts <= end (open-ended when None), oldest first, as a read-only view
+        of the memory-mapped file (no copy).
+        """
+        import numpy as np
+        try:
+            st = os.stat(self._path(coin_id))
+        except OSError:
+            return np.zeros(0, dtype=candle_dtype())
+        cached = self._maps.get(coin_id)
+        if cached is None or cached[0] != st.st_ino or cached[1] != st.st_size:
+            count = (st.st_size - _HEADER.size) // candle_dtype().itemsize
+            if count <= 0:
+                return np.zeros(0, dtype=candle_dtype())
+            view = np.memmap(self._path(coin_id), dtype=candle_dtype(), mode="r", offset=_HEADER.size, shape=(count,))
+            cached = self._maps[coin_id] = (st.st_ino, st.st_size, view)
+        view = cached[2]
+        ts = view["ts"]
+        lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+        hi = len(view) if end is None else int(np.searchsorted(ts, end, side="right"))
+        return view[lo:hi]
+
+    def close_at(self, coin_id: str, ts: float) -> Optional[float]:
+        """Close of the last candle starting at or before ts, or None if none is recent enough."""
+        view = self.candles(coin_id, ts - CANDLE_MAX_GAP, ts)
+        return float(view["close"][-1]) if len(view) else None
+
+    def closes_on_grid(self, coin_id: str, grid: "np.ndarray") -> "np.ndarray":
+        """Close at each timestamp of a sorted grid (NaN where unknown)."""
+        import numpy as np
+        out = np.full(len(grid), np.nan)
+        if not len(grid):
+            return out
+        view = self.candles(coin_id, grid[0] - CANDLE_MAX_GAP, grid[-1])
+        if len(view):
+            idx = np.searchsorted(view["ts"], grid, side="right") - 1
+            found = np.clip(idx, 0, None)
+            ok = (idx >= 0) & (grid - view["ts"][found] <= CANDLE_MAX_GAP)
+            out[ok] = view["close"][found[ok]]
+        return out
+
+    def portfolio_value_at(self, amounts: Dict[str, float], ts: float) -> Optional[float]:
+        """Value of {coin id: amount} at ts from stored closes, or None if any coin's price is unknown."""
+        total = 0.0
+        for coin_id, amount in amounts.items():
+            close = self.close_at(coin_id, ts)
+            if close is None:
+                return None
+            total += amount * close
+        return total
+
+    def portfolio_series(self, amounts: Dict[str, float], start: float, end: Optional[float] = None) -> "Tuple[np.ndarray, np.ndarray]":
+        """Hourly (timestamps, values) of {coin id: amount} between start and end, where every coin is priced."""
+        import numpy as np
+        end = time.time() if end is None else end
+        grid = np.arange(math.ceil(start / self.interval) * self.interval, end, self.interval, dtype=np.float64)
+        values = np.zeros(len(grid))
+        for coin_id, amount in amounts.items():
+            values += amount * self.closes_on_grid(coin_id, grid)
+        ok = ~np.isnan(values)
+        return grid[ok], values[ok]
+
+    # --- Writes ---
+
+    def _last_candle(self, coin_id: str) -> "Optional[np.ndarray]":
+        import numpy as np
+        last = self._last.get(coin_id)
+        if last is None:
+            view = self.candles(coin_id)
+            if not len(view):
+                return None
+            last = self._last[coin_id] = np.array(view[-1:])
+        return last
+
+    def ingest(self, ticks: Iterable[Any]) -> int:
+        """
+        Fold price ticks (objects with coin_id, usd, ts) into the current candle of each coin:
+        update it in place, or append a new candle when the hour rolled over. Returns ticks used.
+        """
+        import numpy as np
+        used = 0
+        with self._lock:
+            for tick in ticks:
+                bucket = int(tick.ts) // self.interval * self.interval
+                price = float(tick.usd)
+                path = self._path(tick.coin_id)
+                last = self._last_candle(tick.coin_id)
+                if last is not None and bucket < last["ts"][0]:
+                    continue  # older than what is stored
+                if last is not None and bucket == last["ts"][0]:
+                    last["high"] = max(last["high"][0], price)
+                    last["low"] = min(last["low"][0], price)
+                    last["close"] = price
+                    with open(path, "r+b") as f:
+                        f.seek(-candle_dtype().itemsize, os.SEEK_END)
+                        f.write(last.tobytes())
+                else:
+                    last = np.array([(bucket, price, price, price, price)], dtype=candle_dtype())
+                    new_file = not os.path.exists(path)
+                    with open(path, "ab") as f:
+                        if new_file:
+                            f.write(self._header())
+                        f.write(last.tobytes())
+                    self._last[tick.coin_id] = last
+                used += 1
+        self.ingested += used
+        return used
+
+    def merge(self, coin_id: str, candles: "np.ndarray", backfilled: bool = False) -> int:
+        """Add candles for buckets the store does not have yet (stored candles win). Returns candles added."""
+        import numpy as np
+        with self._lock:
+            existing = np.array(self.candles(coin_id))
+            new = candles[~np.isin(candles["ts"], existing["ts"])] if len(existing) else candles
+            flags = self._flags(coin_id) | (_FLAG_BACKFILLED if backfilled else 0)
+            if not len(new) and flags == self._flags(coin_id):
+                return 0
+            combined = np.concatenate([existing, new.astype(candle_dtype())])
+            combined = combined[np.argsort(combined["ts"], kind="stable")]
+            self._rewrite(coin_id, combined, flags)
+            return len(new)
+
+    # --- Backfill ---
+
+    def backfill_days(self, coin_id: str, now: Optional[float] = None) -> int:
+        """Days of history to fetch for a coin: full history if never backfilled, else back to the oldest gap."""
+        import numpy as np
+        now = time.time() if now is None else now
+        if not self._flags(coin_id) & _FLAG_BACKFILLED:
+            return CANDLE_BACKFILL_DAYS
+        ts = self.candles(coin_id, now - CANDLE_BACKFILL_DAYS * 86400)["ts"]
+        if not len(ts):
+            return CANDLE_BACKFILL_DAYS
+        edges = np.r_[ts, (now // self.interval) * self.interval]
+        gaps = np.flatnonzero(np.diff(edges) > 2 * self.interval)
+        if not len(gaps):
+            return 0
+        return min(CANDLE_BACKFILL_DAYS, int(math.ceil((now - edges[gaps[0]]) / 86400)) + 1)
+
+    async def backfill(self, coin_id: str, days: Optional[int] = None) -> int:
+        """Fetch missing history for one coin. Returns the number of candles added."""
+        days = self.backfill_days(coin_id) if days is None else days
+        if not days or coin_registry.get(coin_id) is None:
+            return 0
+        try:
+            data = await get_http_client().get_json(COINGECKO_MARKET_CHART_API.format(id=coin_id, days=days))
+            fetched = aggregate(data.get("prices") or [], self.interval)
+            current = int(time.time()) // self.interval * self.interval
+            fetched = fetched[fetched["ts"] < current]  # the live hour is built from ticks
+            added = await asyncio.get_running_loop().run_in_executor(None, self.merge, coin_id, fetched, True)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"[candles] backfill of {coin_id} failed: {e}")
+            return 0
+        self.backfills += 1
+        return added
+
+    def coins(self) -> Set[str]:
+        """Coin ids with a candle file."""
+        return {name[:-4] for name in os.listdir(self.directory) if name.endswith(".bin")}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mapped_coins": len(self._maps),
+            "ingested": self.ingested,
+            "backfills": self.backfills,
+            "failures": self.failures,
+        }
+
+
+_store: Optional[CandleStore] = None
+_store_lock = threading.Lock()
+
+
+def get_candle_store() -> CandleStore:
+    """Return the process-wide candle store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CandleStore()
+    return _store
+
+
+@metrics.timed("storage_seconds", op="candles_ingest")
+async def ingest_ticks(ticks) -> None:
+    """Price bus subscriber extending each ticked coin's current candle (file writes run off the loop)."""
+    await asyncio.get_running_loop().run_in_executor(None, get_candle_store().ingest, ticks)
+
+
+async def backfill_job(context) -> None:
+    """JobQueue callback backfilling up to CANDLE_BACKFILL_PER_RUN coins that miss history."""
+    store = get_candle_store()
+    fetched = 0
+    for coin_id in sorted(store.coins()):
+        if fetched >= CANDLE_BACKFILL_PER_RUN:
+            break
+        if store.backfill_days(coin_id):
+            await store.backfill(coin_id)
+            fetched += 1
+            await asyncio.sleep(2)  # stay well inside CoinGecko's public rate limit
@@ -0,0 +1,200 @@
+"""
+charts.py
+
+Off-loop chart rendering for Cryptiq bot.
+Pie and line charts are drawn with matplotlib's Agg backend in a ProcessPoolExecutor, so a render
+never blocks the bot's event loop. Rendered PNG bytes are cached under a hash of the chart's
+inputs (holdings, prices rounded to a few significant digits, chart type, title) with LRU
+eviction by total byte size, so repeated /portfolio calls within a price tick reuse the image.
+Titles come from the message catalog in the user's language and are passed to the workers as text.
+"""
+import os
+import json
+import math
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import metrics
+from messages import catalog
+
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", "2"))
+CHART_CACHE_BYTES = int(os.environ.get("CHART_CACHE_BYTES", str(16 * 1024 * 1024)))
+PRICE_SIGNIFICANT_DIGITS = 4
+
+# --- Renderers (run inside worker processes; must stay top-level and picklable) ---
+
+def _new_figure():
+    """Create a figure bound to the Agg canvas, without touching pyplot's global state."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=(6, 4), dpi=100)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _to_png(fig) -> bytes:
+    import io
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    return buf.getvalue()
+
+
+def render_pie(slices: Sequence[Tuple[str, float]], title: str = "") -> bytes:
+    """Render a portfolio allocation pie chart. slices: [(label, usd value)]."""
+    fig = _new_figure()
+    ax = fig.add_subplot(1, 1, 1)
+    ax.pie([v for _, v in slices], labels=[label for label, _ in slices], autopct="%1.1f%%", startangle=90)
+    ax.axis("equal")
+    ax.set_title(title)
+    return _to_png(fig)
+
+
+def render_line(points: Sequence[Tuple[str, float]], title: str = "") -> bytes:
+    """Render a portfolio value line chart. points: [(x label, usd value)], oldest first."""
+    fig = _new_figure()
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(range(len(points)), [v for _, v in points], marker="o")
+    step = max(1, len(points) // 6)
+    ticks = list(range(0, len(points), step))
+    ax.set_xticks(ticks)
+    ax.set_xticklabels([points[i][0] for i in ticks], rotation=30, ha="right", fontsize=7)
+    ax.set_title(title)
+    ax.grid(True, alpha=0.3)
+    return _to_png(fig)
+
+
+_RENDERERS = {"pie": render_pie, "line": render_line}
+
+
+def _render(kind: str, data: List[Tuple[str, float]], title: str) -> bytes:
+    return _RENDERERS[kind](data, title)
+
+
+# --- Service ---
+
+def round_significant(value: float, digits: int = PRICE_SIGNIFICANT_DIGITS) -> float:
+    """Round to a number of significant digits, so tiny price moves map to the same cache key."""
+    if value == 0 or not math.isfinite(value):
+        return value
+    return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+
+
+def chart_key(kind: str, payload: Any, title: str) -> str:
+    """Content address for a chart: sha256 of its canonical JSON inputs."""
+    blob = json.dumps([kind, title, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ChartService:
+    """
+    Renders charts in worker processes and caches the PNG bytes.
+
+    Args:
+        workers (int): Worker process count.
+        cache_bytes (int): Maximum total size of cached PNGs.
+    """
+
+    def __init__(self, workers: int = CHART_WORKERS, cache_bytes: int = CHART_CACHE_BYTES):
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self._inflight: Dict[str, "asyncio.Future[bytes]"] = {}
+        self.hits = 0
+        self.renders = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # spawn: workers must not inherit the bot's event loop and threads
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _cache_get(self, key: str) -> Optional[bytes]:
+        png = self._cache.get(key)
+        if png is not None:
+            self._cache.move_to_end(key)
+        return png
+
+    def _cache_put(self, key: str, png: bytes) -> None:
+        if len(png) > self.cache_bytes:
+            return
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cached_bytes -= len(old)
+        self._cache[key] = png
+        self._cached_bytes += len(png)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    @metrics.timed("chart_render_seconds")
+    async def render(self, kind: str, data: List[Tuple[str, float]], language: str = "en") -> bytes:
+        """
+        Return PNG bytes for a chart, rendering it in a worker process on a cache miss.
+        Concurrent requests for the same chart share one render.
+        """
+        # Resolved here: workers get plain text and languages without a translation share the image
+        title = catalog.render(language, "chart." + kind)
+        key = chart_key(kind, data, title)
+        png = self._cache_get(key)
+        if png is not None:
+            self.hits += 1
+            return png
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor(), _render, kind, data, title)
+        self._inflight[key] = future
+        try:
+            png = await future
+            self.renders += 1
+            self._cache_put(key, png)
+            return png
+        finally:
+            self._inflight.pop(key, None)
+
+    async def pie_chart(self, holdings: Dict[str, float], prices: Dict[str, float], language: str = "en") -> Optional[bytes]:
+        """
+        Allocation pie for holdings {symbol: amount} priced by {symbol: usd}. None if nothing has value.
+        Prices are rounded to a few significant digits before valuing, so the key (and the image)
+        only changes when the allocation visibly changes.
+        """
+        slices = []
+        for symbol in sorted(holdings):
+            value = float(holdings[symbol]) * round_significant(float(prices.get(symbol, 0)))
+            if value > 0:
+                slices.append((str(symbol).upper(), round_significant(value)))
+        if not slices:
+            return None
+        return await self.render("pie", slices, language)
+
+    async def line_chart(self, points: List[Tuple[str, float]], language: str = "en") -> Optional[bytes]:
+        """Value-over-time line chart for [(label, usd value)]. None if there are fewer than two points."""
+        if len(points) < 2:
+            return None
+        return await self.render("line", [(label, round(float(v), 2)) for label, v in points], language)
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache and render counters."""
+        return {"entries": len(self._cache), "bytes": self._cached_bytes, "hits": self.hits, "renders": self.renders}
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+# Shared by every handler in the process
+chart_service = ChartService()
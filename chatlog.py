@@ -0,0 +1,250 @@
+"""
+chatlog.py
+
+Append-only chat log for Cryptiq bot, stored as JSON Lines split into segment files.
+Each logged message is a single appended line, and an in-memory per-user index answers
+"last portfolio value" and "last N entries" without reading history back from disk.
+The index is rebuilt by scanning the segment files once when the log is first opened.
+Closed segments past the retention window are gzipped into an archive folder by the maintenance
+job, so the hot directory (and the startup scan) stays small; each user's last portfolio value
+from archived segments is carried over in a small summary file.
+"""
+import os
+import gzip
+import json
+import shutil
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Union
+
+CHAT_LOG_DIR = os.environ.get("CRYPTIQ_CHAT_LOG_DIR", os.path.join(os.path.dirname(__file__), "chat_logs"))
+LEGACY_CHAT_LOG_FILE = os.path.join(os.path.dirname(__file__), "chat_log.json")
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+RECENT_ENTRIES_PER_USER = 20
+SEGMENT_PREFIX = "chat-"
+SEGMENT_SUFFIX = ".jsonl"
+ARCHIVE_SUBDIR = "archive"
+ARCHIVE_SUMMARY = "last_values.json"  # {user id: last portfolio value} from archived segments
+
+
+class _UserIndex:
+    """In-memory index entry for one user."""
+    __slots__ = ("recent", "last_portfolio_value")
+
+    def __init__(self) -> None:
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_ENTRIES_PER_USER)
+        self.last_portfolio_value: Optional[float] = None
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        self.recent.append(entry)
+        if entry.get("portfolio_value") is not None:
+            self.last_portfolio_value = entry["portfolio_value"]
+
+
+class ChatLog:
+    """
+    Segmented JSONL chat log with a per-user in-memory index.
+
+    Args:
+        directory (str): Folder holding the segment files.
+        segment_max_bytes (int): Size at which the current segment is closed and a new one started.
+    """
+
+    def __init__(self, directory: str = CHAT_LOG_DIR, segment_max_bytes: int = SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.archive_dir = os.path.join(directory, ARCHIVE_SUBDIR)
+        self._lock = threading.Lock()
+        self._index: Dict[str, _UserIndex] = {}
+        self._segment_no = 0
+        self._file = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._rebuild_index()
+
+    # --- Segment files ---
+
+    def segment_paths(self) -> List[str]:
+        """Return all segment file paths, oldest first."""
+        names = [n for n in os.listdir(self.directory)
+                 if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX)]
+        return [os.path.join(self.directory, n) for n in sorted(names)]
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self) -> None:
+        """Open the current segment for appending, rolling over to a new one when full."""
+        path = self._segment_path(self._segment_no)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_max_bytes:
+            self._segment_no += 1
+            path = self._segment_path(self._segment_no)
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")  # terminate a torn line so the next entry parses
+
+    def _rebuild_index(self) -> None:
+        """Scan every hot segment once to rebuild the per-user index."""
+        for uid, value in self._read_archive_summary().items():
+            self._user(uid).last_portfolio_value = value
+        paths = self.segment_paths()
+        archived = self.archived_paths()
+        if not paths and not archived:
+            self._import_legacy_json()
+            paths = self.segment_paths()
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from a crash mid-write
+                    self._user(entry.pop("user_id", "")).add(entry)
+        if paths:
+            self._segment_no = self._segment_number(paths[-1])
+        elif archived:
+            self._segment_no = self._segment_number(archived[-1]) + 1  # never reuse an archived number
+
+    @staticmethod
+    def _segment_number(path: str) -> int:
+        name = os.path.basename(path)
+        return int(name[len(SEGMENT_PREFIX):name.index(SEGMENT_SUFFIX)])
+
+    def _import_legacy_json(self) -> None:
+        """One-shot import of the old single-file chat_log.json into the first segment."""
+        try:
+            with open(LEGACY_CHAT_LOG_FILE, "r") as f:
+                logs = json.load(f).get("logs", {})
+        except Exception:
+            return
+        with open(self._segment_path(0), "w", encoding="utf-8") as out:
+            for uid, entries in logs.items():
+                for entry in entries:
+                    out.write(json.dumps(dict(entry, user_id=str(uid))) + "\n")
+
+    def _user(self, user_id: str) -> _UserIndex:
+        idx = self._index.get(user_id)
+        if idx is None:
+            idx = self._index[user_id] = _UserIndex()
+        return idx
+
+    # --- Archive ---
+
+    def archived_paths(self) -> List[str]:
+        """Return all archived (gzipped) segment paths, oldest first."""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        names = [n for n in os.listdir(self.archive_dir)
+                 if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX + ".gz")]
+        return [os.path.join(self.archive_dir, n) for n in sorted(names)]
+
+    def _read_archive_summary(self) -> Dict[str, float]:
+        try:
+            with open(os.path.join(self.archive_dir, ARCHIVE_SUMMARY), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_archive_summary(self, summary: Dict[str, float]) -> None:
+        path = os.path.join(self.archive_dir, ARCHIVE_SUMMARY)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(summary, f)
+        os.replace(path + ".tmp", path)
+
+    def archive_segments(self, older_than: float) -> int:
+        """
+        Move closed segments last written before older_than into the archive as gzip files.
+        The in-memory index is unchanged; users' last portfolio values survive restarts through
+        the archive summary.
+
+        Args:
+            older_than (float): Unix time; segments modified earlier are archived.
+
+        Returns:
+            int: Number of segments archived.
+        """
+        with self._lock:
+            current = self._segment_path(self._segment_no)
+        stale = [p for p in self.segment_paths() if p != current and os.path.getmtime(p) < older_than]
+        if not stale:
+            return 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+        summary = self._read_archive_summary()
+        for path in stale:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("portfolio_value") is not None:
+                        summary[str(entry.get("user_id", ""))] = entry["portfolio_value"]
+            dest = os.path.join(self.archive_dir, os.path.basename(path) + ".gz")
+            with open(path, "rb") as src, gzip.open(dest + ".tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(dest + ".tmp", dest)
+            # Summary first: a crash before the remove only archives the segment again
+            self._write_archive_summary(summary)
+            os.remove(path)
+        return len(stale)
+
+    def stats(self) -> Dict[str, int]:
+        """Segment counts and the hot directory's size."""
+        paths = self.segment_paths()
+        return {
+            "segments": len(paths),
+            "segment_bytes": sum(os.path.getsize(p) for p in paths),
+            "archived_segments": len(self.archived_paths()),
+            "indexed_users": len(self._index),
+        }
+
+    # --- Public API ---
+
+    def append(self, user_id: Union[str, int], entry: Dict[str, Any]) -> None:
+        """Append one entry for a user. O(1): a single line write plus an index update."""
+        uid = str(user_id)
+        line = json.dumps(dict(entry, user_id=uid)) + "\n"
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_max_bytes:
+                if self._file is not None:
+                    self._file.close()
+                    self._segment_no += 1
+                self._open_segment()
+            self._file.write(line)
+            self._file.flush()
+            self._user(uid).add(entry)
+
+    def last_portfolio_value(self, user_id: Union[str, int]) -> Optional[float]:
+        """Return the most recently logged portfolio value for a user, or None."""
+        idx = self._index.get(str(user_id))
+        return idx.last_portfolio_value if idx is not None else None
+
+    def recent(self, user_id: Union[str, int], n: int = RECENT_ENTRIES_PER_USER) -> List[Dict[str, Any]]:
+        """Return up to the last n entries for a user (capped at RECENT_ENTRIES_PER_USER), oldest first."""
+        idx = self._index.get(str(user_id))
+        if idx is None or n <= 0:
+            return []
+        return list(idx.recent)[-n:]
+
+    def close(self) -> None:
+        """Close the open segment file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_chat_log: Optional[ChatLog] = None
+_chat_log_lock = threading.Lock()
+
+
+def get_chat_log() -> ChatLog:
+    """Return the process-wide chat log, building its index on first use."""
+    global _chat_log
+    if _chat_log is None:
+        with _chat_log_lock:
+            if _chat_log is None:
+                _chat_log = ChatLog()
+    return _chat_log
@@ -0,0 +1,319 @@
+"""
+coins.py
+
+Coin registry for Cryptiq bot: resolves what users type ("btc", "Ethereum", "avalanche-2") to
+CoinGecko ids without any network I/O.
+The index is built lazily on first use from the bundled snapshot (coins.json, CoinGecko's
+/coins/list with market-cap ranks) or, when present, from the last background refresh saved next
+to it. Lookups by symbol, name or id are single dict hits; symbols shared by several coins resolve
+to the one with the best market-cap rank. Prefix and fuzzy suggestions power "did you mean"
+replies for /setalert and holdings input. A daily job refreshes the coin universe from /coins/list,
+ranks it with the first pages of /coins/markets, and swaps the new index in.
+
+Regenerate the bundled snapshot with:
+    python coins.py --snapshot
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import asyncio
+import difflib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from http_client import get_http_client, close_http_client
+
+COINS_SNAPSHOT = os.path.join(os.path.dirname(__file__), "coins.json")
+COIN_REGISTRY_FILE = os.environ.get("CRYPTIQ_COIN_REGISTRY_FILE",
+                                    os.path.join(os.path.dirname(__file__), "coin_registry.json"))
+COIN_REFRESH_INTERVAL = float(os.environ.get("COIN_REFRESH_INTERVAL", str(24 * 3600)))
+COIN_REFRESH_PAGES = int(os.environ.get("COIN_REFRESH_PAGES", "2"))  # ranked coins, 250 per page
+COINGECKO_LIST_API = "https://api.coingecko.com/api/v3/coins/list"
+COINGECKO_MARKETS_API = ("https://api.coingecko.com/api/v3/coins/markets?vs_currency=usd"
+                         "&order=market_cap_desc&per_page=250&page={page}")
+UNRANKED = 1_000_000
+MENTION_MAX_RANK = 100
+MIN_LIST_SIZE = 1000  # a /coins/list response smaller than this is treated as broken
+# Tickers that are also everyday words; never treated as a coin mention in free text
+_COMMON_WORDS = {"near", "one", "dot", "link", "flow", "gas", "ape", "dash", "sand", "ton", "sui", "neo",
+                 "eos", "trump", "pepe", "bonk", "wif", "gala", "cake", "comp", "mana", "uni", "ens", "kas"}
+
+logger = logging.getLogger("cryptiq")
+
+
+class Coin(NamedTuple):
+    id: str
+    symbol: str
+    name: str
+    rank: int
+
+
+def _key(text: Any) -> str:
+    """Lookup form of user input: lowercase, surrounding whitespace and '$' removed, spaces collapsed."""
+    return " ".join(str(text).lower().strip().lstrip("$").split())
+
+
+class _Index:
+    """Immutable lookup tables over one list of coins; replaced as a whole on refresh."""
+    __slots__ = ("coins", "by_id", "by_symbol", "by_name", "keys", "key_coin", "ranked_keys")
+
+    def __init__(self, rows: Iterable[Tuple[str, str, str, int]]):
+        coins = []
+        for coin_id, symbol, name, rank in rows:
+            coins.append(Coin(sys.intern(str(coin_id)), sys.intern(_key(symbol)), str(name),
+                              int(rank) if rank else UNRANKED))
+        coins.sort(key=lambda c: c.rank)
+        self.coins = coins
+        self.by_id: Dict[str, int] = {}
+        self.by_symbol: Dict[str, int] = {}
+        self.by_name: Dict[str, int] = {}
+        for i, coin in enumerate(coins):  # best rank first, so setdefault keeps the top coin per key
+            self.by_id.setdefault(coin.id, i)
+            self.by_symbol.setdefault(coin.symbol, i)
+            self.by_name.setdefault(_key(coin.name), i)
+        # Every lookup key, sorted for prefix search; a key maps to the coin resolve() would return
+        self.key_coin: Dict[str, int] = dict(self.by_name)
+        self.key_coin.update(self.by_id)
+        self.key_coin.update(self.by_symbol)
+        self.keys: List[str] = sorted(self.key_coin)
+        # Fuzzy matching only considers ranked coins: the long tail of the full list adds noise and time
+        self.ranked_keys: List[str] = [k for k in self.keys if coins[self.key_coin[k]].rank < UNRANKED]
+
+    def resolve(self, key: str) -> Optional[int]:
+        i = self.by_symbol.get(key)
+        if i is None:
+            i = self.by_id.get(key)
+        if i is None:
+            i = self.by_name.get(key)
+        return i
+
+    def rows(self) -> List[List[Any]]:
+        return [[c.id, c.symbol, c.name, c.rank if c.rank < UNRANKED else None] for c in self.coins]
+
+
+def _read_rows(path: str) -> Tuple[List[List[Any]], float]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["coins"], float(data.get("fetched_at", 0))
+
+
+class CoinRegistry:
+    """
+    Lazily loaded coin index with background refresh.
+
+    Args:
+        snapshot (str): Bundled JSON snapshot used when no refreshed copy exists.
+        cache_file (str): Where refreshed data is saved and loaded from on the next start.
+        refresh_interval (float): Minimum seconds between refreshes from CoinGecko.
+    """
+
+    def __init__(self, snapshot: str = COINS_SNAPSHOT, cache_file: str = COIN_REGISTRY_FILE,
+                 refresh_interval: float = COIN_REFRESH_INTERVAL):
+        self.snapshot = snapshot
+        self.cache_file = cache_file
+        self.refresh_interval = refresh_interval
+        self._index: Optional[_Index] = None
+        self._lock = threading.Lock()
+        self.source = "none"
+        self.fetched_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+
+    def _get_index(self) -> _Index:
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load()
+                index = self._index
+        return index
+
+    def _load(self) -> _Index:
+        try:
+            rows, self.fetched_at = _read_rows(self.cache_file)
+            self.source = "cache"
+            return _Index(rows)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[coins] ignoring unreadable {self.cache_file}: {e}")
+        rows, _ = _read_rows(self.snapshot)
+        self.source = "snapshot"
+        return _Index(rows)
+
+    # --- Lookups ---
+
+    def resolve(self, text: Any) -> Optional[str]:
+        """Return the CoinGecko id for a symbol, name or id, or None if the coin is unknown."""
+        index = self._get_index()
+        i = index.resolve(_key(text))
+        return None if i is None else index.coins[i].id
+
+    def get(self, coin_id: str) -> Optional[Coin]:
+        index = self._get_index()
+        i = index.by_id.get(coin_id)
+        return None if i is None else index.coins[i]
+
+    def valid_ids(self, ids: Iterable[str]) -> List[str]:
+        """
+        Keep only ids listed by CoinGecko (keeps order, removes duplicates). Coins listed after the
+        loaded data become valid once a refresh from /coins/list has confirmed them.
+        """
+        by_id = self._get_index().by_id
+        return list(dict.fromkeys(i for i in ids if i in by_id))
+
+    def suggest(self, text: Any, limit: int = 3) -> List[Coin]:
+        """
+        Coins the user may have meant: an exact match first, then keys starting with the input
+        (best market cap first), then close spellings.
+
+        Args:
+            text (str): What the user typed.
+            limit (int): Maximum number of suggestions.
+
+        Returns:
+            list: Coin tuples, most likely first.
+        """
+        index = self._get_index()
+        key = _key(text)
+        if not key:
+            return []
+        found: Dict[int, None] = {}
+        exact = index.resolve(key)
+        if exact is not None:
+            found[exact] = None
+        prefixed = set()
+        pos = bisect.bisect_left(index.keys, key)
+        while pos < len(index.keys) and index.keys[pos].startswith(key) and len(prefixed) < 50:
+            prefixed.add(index.key_coin[index.keys[pos]])
+            pos += 1
+        for i in sorted(prefixed):  # coins are stored in rank order
+            found[i] = None
+        if len(found) < limit:
+            for match in difflib.get_close_matches(key, index.ranked_keys, n=limit * 3, cutoff=0.7):
+                found[index.key_coin[match]] = None
+        return [index.coins[i] for i in list(found)[:limit]]
+
+    def mentioned(self, words: Iterable[str], max_rank: int = MENTION_MAX_RANK) -> Dict[str, str]:
+        """
+        Well-known coins named in free text, as {word: CoinGecko id}. Only top coins count, and
+        tickers shorter than three letters or that double as everyday words are ignored.
+        """
+        index = self._get_index()
+        found = {}
+        for word in words:
+            if len(word) < 3 or word in _COMMON_WORDS:
+                continue
+            i = index.resolve(word)
+            if i is not None and index.coins[i].rank <= max_rank:
+                found[word] = index.coins[i].id
+        return found
+
+    # --- Refresh ---
+
+    async def refresh(self, force: bool = False) -> bool:
+        """
+        Reload the coin universe from CoinGecko's /coins/list, rank it with the first
+        COIN_REFRESH_PAGES pages of /coins/markets, and save it for the next start. Ranks only
+        decide which coin a shared symbol resolves to; listed coins outside the fetched pages keep
+        their previous rank. Skipped while the loaded data is younger than refresh_interval.
+
+        Returns:
+            bool: True if a new index was swapped in.
+        """
+        current = self._get_index()
+        if not force and time.time() - self.fetched_at < self.refresh_interval:
+            return False
+        try:
+            rows = await fetch_rows(current)
+            fetched_at = time.time()
+            index = _Index(rows)
+            await asyncio.get_running_loop().run_in_executor(None, self._save, index, fetched_at)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"[coins] refresh failed, keeping the {self.source} index: {e}")
+            return False
+        self._index = index
+        self.source = "refresh"
+        self.fetched_at = fetched_at
+        self.refreshes += 1
+        return True
+
+    def _save(self, index: _Index, fetched_at: float) -> None:
+        tmp = self.cache_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": fetched_at, "coins": index.rows()}, f, separators=(",", ":"))
+        os.replace(tmp, self.cache_file)
+
+    def stats(self) -> Dict[str, Any]:
+        index = self._index
+        return {
+            "coins": len(index.coins) if index is not None else 0,
+            "source": self.source,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "age_seconds": (time.time() - self.fetched_at) if self.fetched_at else -1,
+        }
+
+
+async def fetch_rows(previous: Optional[_Index] = None) -> List[List[Any]]:
+    """
+    Download every listed coin as [id, symbol, name, rank] rows: /coins/list gives the universe,
+    /coins/markets the ranks. Raises on any upstream failure or a suspiciously short list.
+    """
+    client = get_http_client()
+    listed = await client.get_json(COINGECKO_LIST_API)
+    if not isinstance(listed, list) or len(listed) < MIN_LIST_SIZE:
+        raise ValueError(f"CoinGecko returned {len(listed) if isinstance(listed, list) else type(listed).__name__} "
+                         f"for coins/list")
+    ranks: Dict[str, int] = {}
+    for page in range(1, COIN_REFRESH_PAGES + 1):
+        data = await client.get_json(COINGECKO_MARKETS_API.format(page=page))
+        if not isinstance(data, list):
+            raise ValueError(f"CoinGecko returned {type(data).__name__} for coins/markets")
+        for item in data:
+            if item.get("id") and item.get("market_cap_rank"):
+                ranks[item["id"]] = int(item["market_cap_rank"])
+    rows = []
+    for item in listed:
+        coin_id, symbol = item.get("id"), item.get("symbol")
+        if not coin_id or not symbol:
+            continue
+        rank = ranks.get(coin_id)
+        if rank is None and previous is not None:
+            i = previous.by_id.get(coin_id)
+            rank = previous.coins[i].rank if i is not None else None
+        rows.append([coin_id, symbol, item.get("name") or symbol, rank if rank and rank < UNRANKED else None])
+    return rows
+
+
+# Shared by every handler that turns user input into CoinGecko ids
+coin_registry = CoinRegistry()
+
+
+async def refresh_coins_job(context) -> None:
+    """JobQueue callback refreshing the shared coin registry."""
+    await coin_registry.refresh()
+
+
+async def _write_snapshot(path: str) -> int:
+    """Regenerate the bundled snapshot from CoinGecko. Returns the number of coins written."""
+    try:
+        rows = _Index(await fetch_rows()).rows()
+    finally:
+        await close_http_client()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{\n  "source": "CoinGecko /coins/list, ranked by /coins/markets (market_cap_desc)",\n')
+        f.write(f'  "as_of": "{time.strftime("%Y-%m-%d")}",\n  "coins": [\n')
+        f.write(",\n".join("    " + json.dumps(row, ensure_ascii=False) for row in rows))
+        f.write("\n  ]\n}\n")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["--snapshot"]:
+        sys.exit("usage: python coins.py --snapshot")
+    print(f"wrote {asyncio.run(_write_snapshot(COINS_SNAPSHOT))} coins to {COINS_SNAPSHOT}")
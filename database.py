@@ -2,69 +2,433 @@
 database.py
 
 Handles persistent storage and retrieval of user data, alerts, and chat logs for Cryptiq bot.
-All data is stored in local JSON files. For production/scaling, migrate to a real database.
+User data and alerts are stored in a local SQLite database running in WAL mode, with one indexed
+row per user and per alert, so a write only touches the rows it changes. User records are served
+from an in-memory LRU cache with write-behind: saves mark a record dirty and are merged and
+flushed in one transaction periodically and at shutdown, so hot reads do no I/O. Legacy JSON files
+(user_data.json, alerts.json) are imported once on first use. Chat logs live in the append-only
+segmented log in chatlog.py.
 """
 import os
+import copy
 import json
-from typing import Any, Dict, Union
+import atexit
+import asyncio
+import sqlite3
+import datetime
+import functools
+import threading
+import contextlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import chatlog
+import metrics
 
 USER_DATA_FILE = os.path.join(os.path.dirname(__file__), "user_data.json")
-CHAT_LOG_FILE = os.path.join(os.path.dirname(__file__), "chat_log.json")
 ALERTS_FILE = os.path.join(os.path.dirname(__file__), "alerts.json")
+DB_FILE = os.environ.get("CRYPTIQ_DB_FILE", os.path.join(os.path.dirname(__file__), "cryptiq.db"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_FLUSH_INTERVAL = float(os.environ.get("USER_FLUSH_INTERVAL", "5"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    coin TEXT NOT NULL,
+    price REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_user ON alerts (user_id);
+CREATE INDEX IF NOT EXISTS idx_alerts_coin ON alerts (coin);
+"""
+
+# One connection per thread; sqlite3 connections must not be shared across threads.
+_local = threading.local()
+_init_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """Return this thread's database connection, creating the schema on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # isolation_level=None: autocommit, transactions are opened explicitly in _transaction()
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with _init_lock:
+            conn.executescript(_SCHEMA)
+            _local.conn = conn
+            migrate_from_json()
+    return conn
+
+
+@contextlib.contextmanager
+def _transaction() -> Iterator[sqlite3.Connection]:
+    """Run a block of statements as one write transaction."""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _read_json_file(path: str) -> Any:
+    """Read a legacy JSON file, returning None if it is missing, empty or invalid."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def migrate_from_json() -> bool:
+    """
+    Import the legacy JSON files into SQLite. Runs once; later calls are no-ops.
+    The JSON files are left in place untouched.
+
+    Returns:
+        bool: True if the import ran during this call.
+    """
+    conn = _local.conn
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            conn.execute("ROLLBACK")
+            return False
+        users = _read_json_file(USER_DATA_FILE) or {}
+        alerts = _read_json_file(ALERTS_FILE) or {}
+        for uid, user_data in users.get("users", {}).items():
+            conn.execute("INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+                         (str(uid), json.dumps(user_data)))
+        for uid, user_alerts in alerts.items():
+            for alert in user_alerts:
+                _insert_alert(conn, uid, alert)
+        conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return True
+
 
+# --- Users ---
 
+_MISSING = object()
+
+
+class _UserCache:
+    """
+    LRU cache of user records with write-behind.
+
+    Records are kept as parsed dicts; readers get a copy, so mutating it without save_user_data
+    changes nothing (same as reading from the database). Users without a profile are cached as
+    None. Dirty records are pinned in memory until their flush has committed, so eviction never
+    loses a write and a reader never falls back to a row older than the cached record.
+    """
+
+    def __init__(self, capacity: int = USER_CACHE_SIZE):
+        self.capacity = capacity
+        self._records: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+        self._dirty: set = set()
+        self._flushing: set = set()  # records being written by flush(), still pinned until commit
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # serialises flushes and deletes
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_records = 0
+
+    def _evict(self) -> None:
+        """Drop least recently used clean records while over capacity (caller holds the lock)."""
+        if len(self._records) <= self.capacity:
+            return
+        for uid in list(self._records):
+            if len(self._records) <= self.capacity:
+                break
+            if uid not in self._dirty and uid not in self._flushing:
+                del self._records[uid]
+
+    def get(self, uid: str) -> Any:
+        """Return a copy of the cached record (None = no profile), or _MISSING."""
+        with self._lock:
+            record = self._records.get(uid, _MISSING)
+            if record is _MISSING:
+                self.misses += 1
+                return _MISSING
+            self._records.move_to_end(uid)
+            self.hits += 1
+            return copy.deepcopy(record)
+
+    def fill(self, uid: str, record: Optional[Dict[str, Any]]) -> None:
+        """Cache a record read from the database, unless a newer write got there first."""
+        with self._lock:
+            if uid not in self._records:
+                self._records[uid] = record
+                self._evict()
+
+    def put(self, uid: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._records[uid] = copy.deepcopy(record)
+            self._records.move_to_end(uid)
+            self._dirty.add(uid)
+            self._evict()
+
+    def delete(self, uid: str) -> bool:
+        """Delete a user from the cache and the database now. Returns True if a profile existed."""
+        with self._flush_lock:
+            with self._lock:
+                unflushed = uid in self._dirty and self._records.get(uid) is not None
+                self._dirty.discard(uid)
+                self._records[uid] = None  # known to have no profile
+                self._records.move_to_end(uid)
+                self._evict()
+            with _transaction() as conn:
+                cur = conn.execute("DELETE FROM users WHERE user_id = ?", (uid,))
+        return cur.rowcount > 0 or unflushed
+
+    def clear(self) -> None:
+        """Forget every cached record, including unflushed writes."""
+        with self._flush_lock:
+            with self._lock:
+                self._records.clear()
+                self._dirty.clear()
+
+    def flush(self) -> int:
+        """Write every dirty record in one transaction. Returns the number of records written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                batch = {uid: self._records[uid] for uid in self._dirty}
+                rows = [(uid, json.dumps(record)) for uid, record in batch.items()]
+                self._flushing = set(batch)
+                self._dirty.clear()
+            try:
+                with _transaction() as conn:
+                    conn.executemany("INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)", rows)
+            except BaseException:
+                # Nothing was written: mark the batch dirty again unless it was overwritten meanwhile
+                with self._lock:
+                    self._flushing = set()
+                    for uid, record in batch.items():
+                        if uid not in self._dirty:
+                            self._records[uid] = record
+                            self._dirty.add(uid)
+                raise
+            with self._lock:
+                self._flushing = set()
+                self.flushes += 1
+                self.flushed_records += len(rows)
+                self._evict()
+            return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the write-behind backlog."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._records),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "flushes": self.flushes,
+            "flushed_records": self.flushed_records,
+        }
+
+
+_user_cache = _UserCache()
+
+
+@metrics.timed("storage_seconds", op="load_user_data")
 def load_user_data(user_id: Union[str, int]) -> Dict[str, Any]:
     """Load user data for a given user ID."""
+    uid = str(user_id)
+    record = _user_cache.get(uid)
+    if record is not _MISSING:
+        return record or {}
     try:
-        with open(USER_DATA_FILE, "r") as f:
-            data: Dict[str, Any] = json.load(f)
-        return data["users"].get(str(user_id), {})
+        row = _connect().execute("SELECT data FROM users WHERE user_id = ?", (uid,)).fetchone()
+        record = json.loads(row[0]) if row else None
     except Exception:
         return {}
+    _user_cache.fill(uid, record)
+    return copy.deepcopy(record) if record else {}
 
 
+@metrics.timed("storage_seconds", op="save_user_data")
 def save_user_data(user_id: Union[str, int], user_data: Dict[str, Any]) -> None:
-    """Save user data for a given user ID."""
+    """Save user data for a given user ID (written to the database on the next flush)."""
+    _user_cache.put(str(user_id), user_data)
+
+
+@metrics.timed("storage_seconds", op="delete_user_data")
+def delete_user_data(user_id: Union[str, int]) -> bool:
+    """Delete a user's profile immediately. Returns True if a profile existed."""
+    return _user_cache.delete(str(user_id))
+
+
+@metrics.timed("storage_seconds", op="flush_user_data")
+def flush_user_data() -> int:
+    """Write pending user record changes to the database. Returns the number of records written."""
+    return _user_cache.flush()
+
+
+async def flush_user_data_job(context) -> None:
+    """JobQueue callback flushing pending user records off the event loop."""
+    await asyncio.get_running_loop().run_in_executor(None, flush_user_data)
+
+
+def iter_users() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield (user_id, user_data) for every profile, reading the table in one pass. Pending
+    write-behind changes are flushed first so the scan sees them. Meant for background jobs.
+    """
+    flush_user_data()
+    for uid, data in _connect().execute("SELECT user_id, data FROM users"):
+        yield uid, json.loads(data)
+
+
+@metrics.timed("storage_seconds", op="snapshot_rows")
+def snapshot_rows() -> Tuple[List[Tuple[str, str]], List[Tuple[int, str, str, float, str]]]:
+    """
+    Return every (user_id, data) row and every (id, user_id, coin, price, data) alert row, read in
+    one transaction so both tables come from the same point in time. Pending user changes are
+    flushed first. Meant for backups.
+    """
+    flush_user_data()
+    conn = _connect()
+    conn.execute("BEGIN")  # deferred: a read transaction sees one WAL snapshot for both queries
     try:
-        with open(USER_DATA_FILE, "r") as f:
-            data = json.load(f)
-    except Exception:
-        data = {"users": {}}
-    data["users"][str(user_id)] = user_data
-    with open(USER_DATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+        users = conn.execute("SELECT user_id, data FROM users").fetchall()
+        alerts = conn.execute("SELECT id, user_id, coin, price, data FROM alerts").fetchall()
+    finally:
+        conn.execute("COMMIT")
+    return users, alerts
+
+
+def replace_all_rows(users: List[Tuple[str, str]], alerts: List[Tuple[int, str, str, float, str]]) -> None:
+    """
+    Replace the users and alerts tables with the given rows (alert ids are kept) in one
+    transaction, dropping pending and cached user records. Used to restore a backup; the
+    bot should not be running while it happens.
+    """
+    _user_cache.clear()
+    with _transaction() as conn:
+        conn.execute("DELETE FROM users")
+        conn.execute("DELETE FROM alerts")
+        conn.executemany("INSERT INTO users (user_id, data) VALUES (?, ?)", users)
+        conn.executemany("INSERT INTO alerts (id, user_id, coin, price, data) VALUES (?, ?, ?, ?, ?)", alerts)
+
+
+def checkpoint() -> None:
+    """Fold the WAL back into the database file and truncate it, and refresh query planner statistics."""
+    conn = _connect()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("PRAGMA optimize")
+
+
+def user_cache_stats() -> Dict[str, Any]:
+    """Return the user cache's counters."""
+    return _user_cache.stats()
+
+
+# Last-chance flush for scripts and clean exits that skip the bot's shutdown hook
+atexit.register(flush_user_data)
 
 
+# --- Alerts ---
+
+def _insert_alert(conn: sqlite3.Connection, user_id: Union[str, int], alert: Dict[str, Any]) -> int:
+    """Insert one alert row and return its id."""
+    data = {k: v for k, v in alert.items() if k != "id"}
+    cur = conn.execute("INSERT INTO alerts (user_id, coin, price, data) VALUES (?, ?, ?, ?)",
+                       (str(user_id), str(alert["coin"]), float(alert["price"]), json.dumps(data)))
+    return int(cur.lastrowid)
+
+
+@metrics.timed("storage_seconds", op="load_alerts")
 def load_alerts() -> Dict[str, Any]:
     """Load all alerts from storage."""
     try:
-        with open(ALERTS_FILE, "r") as f:
-            return json.load(f)
+        rows = _connect().execute("SELECT id, user_id, data FROM alerts ORDER BY id").fetchall()
     except Exception:
         return {}
+    alerts: Dict[str, List[Dict[str, Any]]] = {}
+    for alert_id, uid, data in rows:
+        alert = json.loads(data)
+        alert["id"] = alert_id
+        alerts.setdefault(uid, []).append(alert)
+    return alerts
 
 
+@metrics.timed("storage_seconds", op="save_alerts")
 def save_alerts(alerts: Dict[str, Any]) -> None:
-    """Save all alerts to storage."""
-    with open(ALERTS_FILE, "w") as f:
-        json.dump(alerts, f, indent=2)
+    """
+    Save all alerts to storage. Alerts that carry an id keep it (the alert engine refers to alerts
+    by id); new ones are inserted and get their id set on the dict; stored alerts that are no
+    longer listed are deleted.
+    """
+    with _transaction() as conn:
+        stored = {row[0] for row in conn.execute("SELECT id FROM alerts")}
+        kept = set()
+        for uid, user_alerts in alerts.items():
+            for alert in user_alerts:
+                alert_id = alert.get("id")
+                if alert_id is None:
+                    alert["id"] = _insert_alert(conn, uid, alert)
+                else:
+                    data = {k: v for k, v in alert.items() if k != "id"}
+                    conn.execute("INSERT OR REPLACE INTO alerts (id, user_id, coin, price, data) VALUES (?, ?, ?, ?, ?)",
+                                 (int(alert_id), str(uid), str(alert["coin"]), float(alert["price"]), json.dumps(data)))
+                    kept.add(int(alert_id))
+        conn.executemany("DELETE FROM alerts WHERE id = ?", [(i,) for i in stored - kept])
+
+
+@metrics.timed("storage_seconds", op="add_alert")
+def add_alert(user_id: Union[str, int], alert: Dict[str, Any]) -> int:
+    """Add a single alert for a user and return its id."""
+    with _transaction() as conn:
+        return _insert_alert(conn, user_id, alert)
+
+
+@metrics.timed("storage_seconds", op="apply_alert_changes")
+def apply_alert_changes(removed_ids: List[int], updated: Dict[int, Dict[str, Any]]) -> None:
+    """Remove and rewrite alerts by id in a single transaction (used when alerts fire)."""
+    with _transaction() as conn:
+        conn.executemany("DELETE FROM alerts WHERE id = ?", [(i,) for i in removed_ids])
+        conn.executemany(
+            "UPDATE alerts SET price = ?, data = ? WHERE id = ?",
+            [(float(a["price"]), json.dumps({k: v for k, v in a.items() if k not in ("id", "user_id")}), i)
+             for i, a in updated.items()]
+        )
+
 
+# --- Chat log ---
 
+@functools.lru_cache(maxsize=1)
+def _log_timezone() -> Any:
+    """Timezone used for chat log timestamps; pytz is imported on first use only."""
+    import pytz
+    return pytz.timezone('US/Pacific')
+
+
+@metrics.timed("storage_seconds", op="log_chat")
 def log_chat(user_id: Union[str, int], user_message: str, bot_response: str, portfolio_value: Union[float, None] = None) -> None:
     """Log a chat message and bot response for a user."""
-    import datetime
-    import pytz
-    pacific = pytz.timezone('US/Pacific')
-    now = datetime.datetime.now(pacific)
+    now = datetime.datetime.now(_log_timezone())
     now_str = now.strftime('%Y-%m-%d %I:%M %p %Z')
-    if os.path.exists(CHAT_LOG_FILE):
-        with open(CHAT_LOG_FILE, "r") as f:
-            data = json.load(f)
-    else:
-        data = {"logs": {}}
-    uid = str(user_id)
-    if uid not in data["logs"]:
-        data["logs"][uid] = []
     entry: Dict[str, Any] = {
         "timestamp": now_str,
         "user_message": user_message,
@@ -72,6 +436,16 @@ def log_chat(user_id: Union[str, int], user_message: str, bot_response: str, por
     }
     if portfolio_value is not None:
         entry["portfolio_value"] = portfolio_value
-    data["logs"][uid].append(entry)
-    with open(CHAT_LOG_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    chatlog.get_chat_log().append(user_id, entry)
+
+
+@metrics.timed("storage_seconds", op="get_last_portfolio_value")
+def get_last_portfolio_value(user_id: Union[str, int]) -> Union[float, None]:
+    """Return the most recently logged portfolio value for a user, or None."""
+    return chatlog.get_chat_log().last_portfolio_value(user_id)
+
+
+@metrics.timed("storage_seconds", op="get_recent_chats")
+def get_recent_chats(user_id: Union[str, int], n: int = 10) -> List[Dict[str, Any]]:
+    """Return a user's last n chat log entries, oldest first."""
+    return chatlog.get_chat_log().recent(user_id, n)
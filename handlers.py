@@ -5,12 +5,32 @@ Telegram command and message handlers for Cryptiq bot.
 Each handler function responds to a specific command, message, or button press from the user.
 Handlers use utility and database modules for business logic and persistence.
 """
+import os
+import time
+import functools
 from telegram import Update, ForceReply
 from telegram.ext import ContextTypes
 import database
 import utils
+import alerts
+import price_feed
+import news as news_feed
+import timeseries
 import keyboards
-import json  # Ensure json is imported for file operations
+import ai_chat
+import metrics
+import candles
+from notifier import notifier, PRIORITY_ALERT
+from coins import coin_registry
+from messages import catalog, user_language
+
+# Telegram user ids allowed to use admin commands (/stats), comma- or space-separated
+ADMIN_USER_IDS = {int(x) for x in os.environ.get("ADMIN_USER_IDS", "").replace(",", " ").split() if x.isdigit()}
+
+def _language(update):
+    """Language code of the user behind an update (the default language if unknown)."""
+    user = getattr(update, 'effective_user', None)
+    return user_language(database.load_user_data(user.id) if user is not None else None)
 
 # Example handler with detailed docstring:
 # async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -30,126 +50,221 @@ async def show_portfolio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     try:
         user_id = getattr(getattr(update, 'effective_user', None), 'id', None)
-        message = getattr(update, 'message', None)
+        message = getattr(update, 'effective_message', None)  # the menu message when opened from a button
         if user_id is None or message is None:
             return
         user_data = database.load_user_data(user_id)
+        language = user_language(user_data)
         if not user_data:
-            await message.reply_text("No portfolio found. Use /start to set up your profile.\n\nCryptiq does not offer financial advice.")
+            await message.reply_text(catalog.render(language, "portfolio.no_profile"))
             return
         holdings = user_data.get("holdings", {})
-        strategy = user_data.get("strategy", "Not set")
+        strategy = user_data.get("strategy") or catalog.render(language, "portfolio.strategy_not_set")
         coin_symbols = [k for k, v in holdings.items() if v not in (None, '', 'skip') and v is not None]
         if not coin_symbols:
-            await message.reply_text("No holdings found. Use /setholdings <coin> <amount> to add.\n\nCryptiq does not offer financial advice.")
+            await message.reply_text(catalog.render(language, "portfolio.no_holdings"))
             return
         error_msgs = []
         def debug_message(msg: str) -> None:
             error_msgs.append(msg)
-        market_data = utils.get_market_data_for_coins(coin_symbols, debug_message=debug_message)
+        # Keep these coins on the price feed so later checks are answered from the cache
+        price_feed.price_bus.watch(utils.coin_ids_for_symbols(coin_symbols))
+        market_data = await utils.get_market_data_for_coins_async(coin_symbols, debug_message=debug_message)
         if not market_data:
-            err = error_msgs[0] if error_msgs else "Could not fetch real-time data from CoinGecko. Please try again later."
+            err = error_msgs[0] if error_msgs else catalog.render(language, "portfolio.fetch_failed")
             await message.reply_text(f"{err}")
             return
         total_value = 0
-        holdings_str = ""
+        holding_lines = []
         for symbol in coin_symbols:
-            coingecko_id = utils.COIN_SYMBOL_TO_ID.get(str(symbol).lower(), str(symbol).lower())
+            coingecko_id = utils.coin_id_for_symbol(symbol)
             amount = float(holdings[symbol])
+            if coingecko_id is None:
+                holding_lines.append(catalog.render(language, "portfolio.holding_unknown", symbol=str(symbol).upper(), amount=amount,
+                                                    suggestion=_did_you_mean(symbol, language, "coin.did_you_mean_inline")))
+                continue
             price = float(market_data.get(str(coingecko_id), {}).get('usd', 0))
             value = amount * price
             total_value += value
             change = float(market_data.get(str(coingecko_id), {}).get('usd_24h_change', 0))
-            holdings_str += f"{str(symbol).upper()}: {amount} (${'{:,}'.format(value)})  24h: {change:+.2f}%\n"
-        # Try to get previous value for performance tracking
-        try:
-            with open(database.CHAT_LOG_FILE, "r") as f:
-                data = json.load(f)
-            user_logs = data.get("logs", {}).get(str(user_id), [])
-            prev_value = None
-            for entry in reversed(user_logs):
-                if 'portfolio_value' in entry:
-                    prev_value = entry['portfolio_value']
-                    break
-        except Exception:
-            prev_value = None
+            holding_lines.append(catalog.render(language, "portfolio.holding", symbol=str(symbol).upper(), amount=amount,
+                                                value=value, change=change))
+        # Previous value for performance tracking (indexed lookup, no log scan)
+        prev_value = database.get_last_portfolio_value(user_id)
+        stale_as_of = [v['as_of'] for v in market_data.values() if isinstance(v, dict) and v.get('stale')]
+        stale_str = ""
+        if stale_as_of:
+            stale_str = catalog.render(language, "portfolio.stale", time=time.strftime('%H:%M UTC', time.gmtime(min(stale_as_of))))
         perf_str = ""
         if prev_value is not None and total_value > 0:
             change = total_value - prev_value
             pct = (change / prev_value) * 100 if prev_value != 0 else 0
             arrow = "\u2191" if change > 0 else ("\u2193" if change < 0 else "")
-            perf_str = f"\nPerformance since last check: {arrow} ${change:,.2f} ({pct:+.2f}%)"
+            perf_str = catalog.render(language, "portfolio.since_last_check", arrow=arrow, change=change, pct=pct)
+        history = timeseries.get_timeseries_store()
+        day_ago_value = history.value_at(user_id, time.time() - 24 * 3600)
+        if day_ago_value and total_value > 0:
+            day_change = total_value - day_ago_value
+            perf_str += catalog.render(language, "portfolio.change_24h", change=day_change, pct=day_change / day_ago_value * 100)
+        # 7d/30d performance from the local candle store (no per-request history fetch)
+        amounts = {}
+        for symbol in coin_symbols:
+            coingecko_id = utils.coin_id_for_symbol(symbol)
+            if coingecko_id is not None:
+                amounts[coingecko_id] = amounts.get(coingecko_id, 0.0) + float(holdings[symbol])
+        if amounts and total_value > 0:
+            store = candles.get_candle_store()
+            for days in (7, 30):
+                past_value = store.portfolio_value_at(amounts, time.time() - days * 86400)
+                if past_value:
+                    past_change = total_value - past_value
+                    perf_str += catalog.render(language, "portfolio.change_days", days=days, change=past_change,
+                                               pct=past_change / past_value * 100)
+        history.record(user_id, total_value)
         database.log_chat(user_id, "[portfolio check]", f"Portfolio value: ${total_value:,.2f}", portfolio_value=total_value)
-        await message.reply_text(
-            f"\U0001F4B0 Portfolio Overview:\nStrategy: {strategy}\nTotal Value: ${total_value:,.2f}{perf_str}\nHoldings:\n{holdings_str}\nCryptiq does not offer financial advice."
-        )
-        await utils.send_portfolio_pie_chart(update, holdings, market_data)
-        await utils.send_portfolio_line_chart(update, user_id)
+        await message.reply_text(catalog.render(language, "portfolio.overview", strategy=strategy, total=total_value,
+                                                performance=perf_str, stale=stale_str, holdings="\n".join(holding_lines)))
+        await utils.send_portfolio_pie_chart(update, holdings, market_data, language)
+        await utils.send_portfolio_line_chart(update, user_id, language, amounts)
     except Exception as e:
         utils.log_error(e, context="show_portfolio")
-        message = getattr(update, 'message', None)
+        message = getattr(update, 'effective_message', None)
         if message is not None:
-            await message.reply_text("An error occurred. Please try again later. (Logged)")
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
 
 # --- Settings, language, and menu handlers ---
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     /settings command handler. Shows the user current settings and options to change them.
     """
-    return await utils.settings_command(update, context)
+    try:
+        user = getattr(update, 'effective_user', None)
+        message = getattr(update, 'effective_message', None)
+        if user is None or message is None:
+            return
+        user_data = database.load_user_data(user.id)
+        language = user_language(user_data)
+        digest = user_data.get("digest") is not False
+        await message.reply_text(
+            catalog.render(language, "settings.overview", name=catalog.locale(language).name,
+                           digest=catalog.render(language, "settings.digest_on" if digest else "settings.digest_off")),
+            reply_markup=keyboards.settings_keyboard(language, digest))
+    except Exception as e:
+        utils.log_error(e, context="settings_command")
+        message = getattr(update, 'effective_message', None)
+        if message is not None:
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
+
+async def _apply_digest(update, enabled):
+    """Turn the daily portfolio digest on or off for the user and confirm it."""
+    user = getattr(update, 'effective_user', None)
+    message = getattr(update, 'effective_message', None)
+    if user is None or message is None:
+        return
+    user_data = database.load_user_data(user.id)
+    user_data["digest"] = enabled
+    database.save_user_data(user.id, user_data)
+    language = user_language(user_data)
+    await message.reply_text(catalog.render(language, "settings.digest_enabled" if enabled else "settings.digest_disabled"),
+                             reply_markup=keyboards.settings_keyboard(language, enabled))
 
 async def language_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     /language command handler. Displays available languages and current language setting.
+    With an argument (/language es), sets the language directly.
     """
-    return await utils.language_command(update, context)
+    try:
+        if getattr(context, 'args', None):
+            return await set_language(update, context)
+        message = getattr(update, 'effective_message', None)
+        if message is None:
+            return
+        language = _language(update)
+        await message.reply_text(catalog.render(language, "language.choose", name=catalog.locale(language).name),
+                                 reply_markup=keyboards.language_keyboard())
+    except Exception as e:
+        utils.log_error(e, context="language_command")
+        message = getattr(update, 'effective_message', None)
+        if message is not None:
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
 
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     /menu command handler. Shows the main menu with available actions for the user.
     """
-    return await utils.main_menu(update, context)
+    try:
+        message = getattr(update, 'effective_message', None)
+        if message is None:
+            return
+        language = _language(update)
+        await message.reply_text(catalog.render(language, "menu.title"), reply_markup=keyboards.main_menu_keyboard(language))
+    except Exception as e:
+        utils.log_error(e, context="main_menu")
+        message = getattr(update, 'effective_message', None)
+        if message is not None:
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
 
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    set_language handler. Updates the user's language preference.
+    set_language handler. Updates the user's language preference from /language <code or name>.
     """
-    return await utils.set_language(update, context)
+    return await _apply_language(update, " ".join(getattr(context, 'args', None) or []))
 
 async def language_chosen(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    language_chosen handler. Confirms and applies the user's language choice.
+    language_chosen handler. Confirms and applies the user's language choice typed while the bot
+    is waiting for one.
     """
-    return await utils.language_chosen(update, context)
+    user_data_dict = getattr(context, 'user_data', None)
+    if user_data_dict is not None:
+        user_data_dict.pop('awaiting_language', None)
+    message = getattr(update, 'message', None)
+    return await _apply_language(update, getattr(message, 'text', None) or "")
+
+async def _apply_language(update, text):
+    """Save the language named by text (code or name) and confirm it in that language."""
+    user = getattr(update, 'effective_user', None)
+    message = getattr(update, 'effective_message', None)
+    if user is None or message is None:
+        return
+    user_data = database.load_user_data(user.id)
+    code = catalog.resolve_language(text)
+    if code is None:
+        await message.reply_text(catalog.render(user_language(user_data), "language.unknown", text=text.strip(),
+                                                names=", ".join(catalog.languages().values())))
+        return
+    user_data["language"] = code
+    database.save_user_data(user.id, user_data)
+    await message.reply_text(catalog.render(code, "language.set", name=catalog.locale(code).name))
 
 # --- News, alerts, and profile handlers ---
 async def news(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    news handler. Sends the latest crypto news to the user, with error handling.
+    news handler. Sends the latest crypto news to the user from the pre-rendered payload that
+    news.refresh_news_job keeps up to date (no network I/O here).
     """
     try:
-        message = getattr(update, 'message', None)
+        message = getattr(update, 'effective_message', None)
         if message is None:
             return
-        NEWS_API = "https://min-api.cryptocompare.com/data/v2/news/?lang=EN"
-        try:
-            resp = utils.requests.get(NEWS_API)
-            data = resp.json()
-            articles = data.get('Data', [])[:5]
-            if not articles:
-                await message.reply_text("No news found.\n\nCryptiq does not offer financial advice.")
-                return
-            msg = "\U0001F4F0 Latest Crypto News:\n"
-            for a in articles:
-                msg += f"\n• <a href='{a['url']}'>{a['title']}</a>"
-            await message.reply_text(msg, parse_mode='HTML')
-        except Exception:
-            await message.reply_text("Could not fetch news.\n\nCryptiq does not offer financial advice.")
+        language = _language(update)
+        payload = news_feed.news_cache.reply(language)
+        if payload is None:
+            await message.reply_text(catalog.render(language, "news.unavailable"))
+            return
+        await message.reply_text(payload, parse_mode='HTML')
     except Exception as e:
         utils.log_error(e, context="news")
-        message = getattr(update, 'message', None)
+        message = getattr(update, 'effective_message', None)
         if message is not None:
-            await message.reply_text("An error occurred. Please try again later. (Logged)")
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
+
+def _did_you_mean(text, language, key="coin.did_you_mean"):
+    """' Did you mean BTC (Bitcoin), ...?' for an unrecognised coin, or '' if nothing is close."""
+    suggestions = coin_registry.suggest(text)
+    if not suggestions:
+        return ""
+    return catalog.render(language, key, suggestions=", ".join(f"{c.symbol.upper()} ({c.name})" for c in suggestions))
 
 async def set_alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -159,34 +274,41 @@ async def set_alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = getattr(update, 'effective_user', None)
         message = getattr(update, 'message', None)
         args = getattr(context, 'args', None)
+        language = _language(update)
         if user is None or message is None or not args or len(args) < 2:
             if message is not None:
-                await message.reply_text("Usage: /setalert <coin> <price>\nExample: /setalert btc 70000\n\nCryptiq does not offer financial advice.")
+                await message.reply_text(catalog.render(language, "alert.usage"))
             return
         coin = args[0].lower()
         try:
             price = float(args[1])
             if price < 0 or price > 1e7:
-                await message.reply_text("Please enter a valid, positive price (less than 10 million).\n\nCryptiq does not offer financial advice.")
+                await message.reply_text(catalog.render(language, "alert.invalid_price"))
                 return
         except Exception:
-            await message.reply_text("Usage: /setalert <coin> <price> (price must be a number)\n\nCryptiq does not offer financial advice.")
+            await message.reply_text(catalog.render(language, "alert.price_not_number"))
             return
         if not coin.isalnum() or len(coin) > 10:
-            await message.reply_text("Please enter a valid coin symbol (letters/numbers, max 10 chars).\n\nCryptiq does not offer financial advice.")
+            await message.reply_text(catalog.render(language, "alert.invalid_symbol"))
+            return
+        coin_id = utils.coin_id_for_symbol(coin)
+        if coin_id is None:
+            await message.reply_text(catalog.render(language, "alert.unknown_coin", coin=coin.upper(),
+                                                    suggestion=_did_you_mean(coin, language)))
             return
         user_id = str(user.id)
-        alerts = database.load_alerts()
-        if user_id not in alerts:
-            alerts[user_id] = []
-        alerts[user_id].append({"coin": coin, "price": price})
-        database.save_alerts(alerts)
-        await message.reply_text(f"Alert set for {coin.upper()} at ${price:,.2f}.\n\nCryptiq does not offer financial advice.")
+        repeat = len(args) > 2 and args[2].lower() == "repeat"
+        # The direction needs a price within the cache TTL; without one the alert is saved
+        # undirected and the engine classifies it on the next evaluation
+        entry = (await utils.get_market_data_for_coins_async([coin_id])).get(coin_id)
+        current_price = float(entry['usd']) if entry and not entry.get('stale') and 'usd' in entry else None
+        alerts.get_alert_engine().add(user_id, coin, price, current_price=current_price, repeat=repeat)
+        await message.reply_text(catalog.render(language, "alert.set_repeating" if repeat else "alert.set", coin=coin.upper(), price=price))
     except Exception as e:
         utils.log_error(e, context="set_alert")
-        message = getattr(update, 'message', None)
+        message = getattr(update, 'effective_message', None)
         if message is not None:
-            await message.reply_text("An error occurred. Please try again later. (Logged)")
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
 
 async def delete_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -198,39 +320,48 @@ async def delete_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if user is None or message is None:
             return
         user_id = user.id
+        language = _language(update)  # read before the profile is gone
         try:
-            data = database.load_user_data(user_id)
-            if data:
-                # Remove user from user_data.json
-                all_data = {}
-                try:
-                    with open(database.USER_DATA_FILE, "r") as f:
-                        all_data = json.load(f)
-                except Exception:
-                    pass
-                if str(user_id) in all_data.get("users", {}):
-                    del all_data["users"][str(user_id)]
-                    with open(database.USER_DATA_FILE, "w") as f2:
-                        json.dump(all_data, f2, indent=2)
-                    await message.reply_text("Your profile and portfolio have been deleted.\n\nCryptiq does not offer financial advice.")
-                else:
-                    await message.reply_text("No profile found to delete.\n\nCryptiq does not offer financial advice.")
+            alerts.get_alert_engine().remove_user(user_id)
+            timeseries.get_timeseries_store().delete(user_id)
+            ai_chat.conversations.forget(user_id)
+            if database.delete_user_data(user_id):
+                await message.reply_text(catalog.render(language, "profile.deleted"))
             else:
-                await message.reply_text("No profile found to delete.\n\nCryptiq does not offer financial advice.")
+                await message.reply_text(catalog.render(language, "profile.not_found"))
         except Exception:
-            await message.reply_text("Error deleting profile.\n\nCryptiq does not offer financial advice.")
+            await message.reply_text(catalog.render(language, "profile.delete_failed"))
     except Exception as e:
         utils.log_error(e, context="delete_profile")
-        message = getattr(update, 'message', None)
+        message = getattr(update, 'effective_message', None)
         if message is not None:
-            await message.reply_text("An error occurred. Please try again later. (Logged)")
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
 
 # --- Button and message handlers ---
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    button_handler handler. Handles button presses in messages, such as inline keyboards.
+    button_handler handler. Handles button presses in messages, such as inline keyboards:
+    language picks (lang:<code>), main menu actions (menu:<action>) and settings toggles
+    (settings:digest:on|off).
     """
-    return await utils.button_handler(update, context)
+    try:
+        query = getattr(update, 'callback_query', None)
+        if query is None:
+            return
+        data = query.data or ""
+        await query.answer()
+        if data.startswith(keyboards.LANGUAGE_PREFIX):
+            await _apply_language(update, data[len(keyboards.LANGUAGE_PREFIX):])
+        elif data == keyboards.MENU_PREFIX + "portfolio":
+            await show_portfolio(update, context)
+        elif data == keyboards.MENU_PREFIX + "news":
+            await news(update, context)
+        elif data == keyboards.MENU_PREFIX + "language":
+            await language_command(update, context)
+        elif data.startswith(keyboards.SETTINGS_PREFIX + "digest:"):
+            await _apply_digest(update, data.endswith(":on"))
+    except Exception as e:
+        utils.log_error(e, context="button_handler")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -253,15 +384,37 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         user_message = message.text
         if not user_message or len(user_message) > 1000:
-            await message.reply_text("Please enter a valid message (1-1000 characters).\n\nCryptiq does not offer financial advice.")
+            await message.reply_text(catalog.render(_language(update), "error.invalid_message"))
             return
         # ...existing code for chat logic...
         await utils.handle_message(update, context)
     except Exception as e:
         utils.log_error(e, context="handle_message")
+        message = getattr(update, 'effective_message', None)
+        if message is not None:
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
+
+# --- Admin handlers ---
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /stats command handler (admins only). Shows handler, storage and upstream latency percentiles,
+    error counts, cache hit ratios and event-loop lag from metrics.py.
+    """
+    try:
+        user = getattr(update, 'effective_user', None)
         message = getattr(update, 'message', None)
+        if user is None or message is None:
+            return
+        if user.id not in ADMIN_USER_IDS:
+            await message.reply_text(catalog.render(_language(update), "error.admin_only"))
+            return
+        summary = metrics.render_summary()
+        await message.reply_text(summary[:4000] + ("\n..." if len(summary) > 4000 else ""))
+    except Exception as e:
+        utils.log_error(e, context="stats")
+        message = getattr(update, 'effective_message', None)
         if message is not None:
-            await message.reply_text("An error occurred. Please try again later. (Logged)")
+            await message.reply_text(catalog.render(_language(update), "error.generic"))
 
 # --- Help and onboarding handlers ---
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -288,9 +441,63 @@ async def handle_setup_answers(update: Update, context: ContextTypes.DEFAULT_TYP
     """
     return await utils.handle_setup_answers(update, context)
 
-# --- Alert checker (background job) ---
-async def alert_checker(app):
+# --- Alert checker (price bus subscriber) ---
+def _render_alerts(language, lines):
+    """Text for one or more fired alerts merged into a single message."""
+    if len(lines) == 1:
+        return catalog.render(language, "alert.fired_one", line=lines[0])
+    return catalog.render(language, "alert.fired_many", lines="\n".join(f"\u2022 {line}" for line in lines))
+
+@functools.lru_cache(maxsize=None)
+def _alert_renderer(language):
+    """The notifier render callback for one language (one shared object per language)."""
+    return functools.partial(_render_alerts, language)
+
+async def _send_fired_alerts(app, prices):
+    """
+    Evaluate alerts against {coin symbol: price} and queue a message for every user whose alert
+    fired. Delivery is paced by the notifier; several alerts for one user arrive as one message.
+    """
+    notifier.ensure_started(app.bot)
+    for alert in await alerts.get_alert_engine().evaluate_async(prices):
+        language = user_language(database.load_user_data(alert['user_id']))
+        notifier.notify(
+            int(alert['user_id']),
+            catalog.render(language, "alert.fired", coin=alert['coin'].upper(), price=alert['current_price'], target=alert['price']),
+            priority=PRIORITY_ALERT, merge_key="alert", render=_alert_renderer(language)
+        )
+
+@metrics.timed("handler_seconds", handler="alert_checker")
+async def alert_checker(app, ticks=None):
     """
-    alert_checker job. Periodically checks and sends alerts for price thresholds.
+    alert_checker. Subscribed to the price bus: receives each batch of price ticks and sends the
+    alerts the move has crossed. When called without ticks it fetches prices for every coin with
+    an armed alert in one batched request instead.
     """
-    return await utils.alert_checker(app)
+    try:
+        engine = alerts.get_alert_engine()
+        coins = engine.coins()
+        if not coins:
+            return
+        prices = {}
+        if ticks is not None:
+            by_id = {tick.coin_id: tick.usd for tick in ticks}
+            for coin in coins:
+                coin_id = utils.coin_id_for_symbol(coin)
+                if coin_id in by_id:
+                    prices[coin] = by_id[coin_id]
+        else:
+            market_data = await utils.get_market_data_for_coins_async(coins)
+            for coin in coins:
+                entry = market_data.get(utils.coin_id_for_symbol(coin))
+                # Never fire on stale prices served after an upstream failure
+                if entry and not entry.get('stale') and 'usd' in entry:
+                    prices[coin] = float(entry['usd'])
+        if prices:
+            await _send_fired_alerts(app, prices)
+    except Exception as e:
+        utils.log_error(e, context="alert_checker")
+
+def alert_coin_ids():
+    """CoinGecko ids of every coin with an armed alert (keeps them on the price feed)."""
+    return utils.coin_ids_for_symbols(alerts.get_alert_engine().coins())
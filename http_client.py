@@ -0,0 +1,130 @@
+"""
+http_client.py
+
+Shared non-blocking HTTP client for Cryptiq bot's upstream APIs (CoinGecko, CryptoCompare).
+Wraps one pooled httpx.AsyncClient (keep-alive connections reused across requests) with
+per-host concurrency limits, timeouts, and retries with jittered exponential backoff, so a slow
+or failing upstream never blocks the bot's event loop.
+"""
+import os
+import time
+import random
+import asyncio
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = 50
+HTTP_MAX_KEEPALIVE = 20
+HTTP_PER_HOST_LIMIT = int(os.environ.get("HTTP_PER_HOST_LIMIT", "8"))
+HTTP_RETRIES = 3
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class AsyncHTTPClient:
+    """
+    Pooled async HTTP client with per-host limits and retry.
+
+    Args:
+        timeout (float): Total timeout in seconds for a single attempt.
+        per_host_limit (int): Maximum concurrent requests to one host.
+        retries (int): Extra attempts after the first on transport errors or retryable statuses.
+        backoff_base (float): Base delay in seconds for exponential backoff.
+        backoff_max (float): Upper bound for a single backoff delay.
+    """
+
+    def __init__(self, timeout: float = HTTP_TIMEOUT, per_host_limit: int = HTTP_PER_HOST_LIMIT,
+                 retries: int = HTTP_RETRIES, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.per_host_limit = per_host_limit
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+            headers={"User-Agent": "Cryptiq-Bot"},
+        )
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        sem = self._host_limits.get(host)
+        if sem is None:
+            sem = self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return sem
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter exponential backoff, honouring a Retry-After header when present."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return min(delay, self.backoff_max)
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """
+        GET a URL with retry. Returns the final response (which may still be an error status).
+
+        Raises:
+            httpx.TransportError: If every attempt failed at the transport level.
+        """
+        sem = self._host_limit(url)
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            try:
+                async with sem:
+                    start = time.perf_counter()  # time the request itself, not the wait for a slot
+                    resp = await self._client.get(url, params=params, headers=headers)
+            except httpx.TransportError:
+                metrics.registry.observe("upstream_seconds", time.perf_counter() - start, host=host)
+                metrics.registry.inc("upstream_requests_total", host=host, status="transport_error")
+                if attempt >= self.retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+            else:
+                metrics.registry.observe("upstream_seconds", time.perf_counter() - start, host=host)
+                metrics.registry.inc("upstream_requests_total", host=host, status=resp.status_code)
+                if resp.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    return resp
+                await asyncio.sleep(self._backoff(attempt, resp.headers.get("Retry-After")))
+            metrics.registry.inc("upstream_retries_total", host=host)
+            attempt += 1
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None,
+                       headers: Optional[Dict[str, str]] = None) -> Any:
+        """GET a URL and decode the JSON body. Raises httpx.HTTPStatusError on a non-2xx final status."""
+        resp = await self.get(url, params=params, headers=headers)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def aclose(self) -> None:
+        """Close pooled connections."""
+        await self._client.aclose()
+
+
+_http_client: Optional[AsyncHTTPClient] = None
+
+
+def get_http_client() -> AsyncHTTPClient:
+    """Return the process-wide client, creating it on first use."""
+    global _http_client
+    if _http_client is None:
+        _http_client = AsyncHTTPClient()
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the process-wide client (called on bot shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -3,23 +3,76 @@ keyboards.py
 
 Defines keyboard layouts and helper functions for Telegram inline and reply keyboards in Cryptiq bot.
 Used to provide interactive menus and options to users.
+Layouts are data (button label keys from the message catalog plus callback data); each keyboard is
+built once per language and the same markup object is reused for every reply.
 """
+import functools
+from typing import Dict, List, Tuple
 
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 
-# Example of an inline keyboard
-def start_keyboard():
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Button 1", callback_data="button1"),
-         InlineKeyboardButton("Button 2", callback_data="button2")]
+from messages import catalog
+
+# Callback data prefixes handled by handlers.button_handler
+MENU_PREFIX = "menu:"
+LANGUAGE_PREFIX = "lang:"
+SETTINGS_PREFIX = "settings:"
+
+# Inline layouts: rows of (button label key, callback data)
+LAYOUTS: Dict[str, List[List[Tuple[str, str]]]] = {
+    "main_menu": [
+        [("portfolio", MENU_PREFIX + "portfolio"), ("news", MENU_PREFIX + "news")],
+        [("language", MENU_PREFIX + "language")],
+    ],
+    # /settings, one layout per state of the daily digest toggle
+    "settings_digest_on": [
+        [("digest_off", SETTINGS_PREFIX + "digest:off")],
+        [("language", MENU_PREFIX + "language")],
+    ],
+    "settings_digest_off": [
+        [("digest_on", SETTINGS_PREFIX + "digest:on")],
+        [("language", MENU_PREFIX + "language")],
+    ],
+}
+
+
+def keyboard(name: str, language: str) -> InlineKeyboardMarkup:
+    """The inline keyboard for a layout in a language (built on first use, then shared)."""
+    # Unknown languages share the default language's markup instead of caching a copy each
+    return _build(name, catalog.locale(language).code)
+
+
+@functools.lru_cache(maxsize=None)
+def _build(name: str, language: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(catalog.button(language, label), callback_data=data) for label, data in row]
+        for row in LAYOUTS[name]
+    ])
+
+
+def main_menu_keyboard(language: str = "en") -> InlineKeyboardMarkup:
+    """Main menu: portfolio, news and language buttons."""
+    return keyboard("main_menu", language)
+
+
+def settings_keyboard(language: str = "en", digest: bool = True) -> InlineKeyboardMarkup:
+    """Settings: a button turning the daily digest off (or back on), and the language picker."""
+    return keyboard("settings_digest_on" if digest else "settings_digest_off", language)
+
+
+@functools.lru_cache(maxsize=1)
+def language_keyboard() -> InlineKeyboardMarkup:
+    """One button per loaded locale, labelled with its native name (the same for every language)."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(name, callback_data=LANGUAGE_PREFIX + code)]
+        for code, name in catalog.languages().items()
     ])
-    return keyboard
 
-# Example of a reply keyboard
-def main_menu_keyboard():
-    keyboard = ReplyKeyboardMarkup([
-        [KeyboardButton("Menu 1"), KeyboardButton("Menu 2")]
-    ], resize_keyboard=True)
-    return keyboard
 
-# (Add or update docstrings and comments for each keyboard layout/helper as you move logic in)
\ No newline at end of file
+def build_all() -> int:
+    """Build every keyboard for every loaded language up front (called at startup). Returns the count."""
+    language_keyboard()
+    for language in catalog.languages():
+        for name in LAYOUTS:
+            keyboard(name, language)
+    return len(catalog.languages()) * len(LAYOUTS) + 1
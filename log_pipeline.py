@@ -0,0 +1,292 @@
+"""
+log_pipeline.py
+
+Non-blocking structured logging for Cryptiq bot.
+Code that logs (handlers, jobs, the event loop) only builds the record and puts it on an in-memory
+queue; a background thread formats each record as one JSON object per line and writes it to the
+main log and, for errors, the error log. Both files rotate by size and rotated files are gzipped.
+Repeats of the same error are deduplicated where they are logged: the first occurrence in a
+window is written, further ones are only counted, and when the window closes one summary record
+carries the count and the first/last time it was seen. If the queue is full, records are dropped
+(and counted) rather than blocking the caller.
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import logging
+import datetime
+import threading
+import logging.handlers
+from typing import Any, Dict, List, Optional, Tuple
+
+LOG_DIR = os.environ.get("CRYPTIQ_LOG_DIR", os.path.dirname(os.path.abspath(__file__)))
+LOG_FILE = os.path.join(LOG_DIR, "cryptiq.log")
+ERROR_LOG_FILE = os.path.join(LOG_DIR, "error_log.jsonl")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.environ.get("LOG_BACKUPS", "5"))
+LOG_QUEUE_SIZE = 10000
+LOG_DEDUP_WINDOW = float(os.environ.get("LOG_DEDUP_WINDOW", "60"))  # seconds
+LOG_DEDUP_BURST = 3  # identical records written per window before suppressing
+
+# Attributes every LogRecord has; anything else was passed with extra= and is written as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object: time, level, logger, message, extra fields, traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": _iso(record.created),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exc_type"] = record.exc_info[0].__name__ if record.exc_info[0] else None
+            entry["traceback"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["traceback"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _iso(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat(timespec="milliseconds")
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _rotating_handler(path: str, level: int) -> logging.Handler:
+    """Size-rotated JSONL file; rotated files become path.1.gz, path.2.gz, ..."""
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                                   encoding="utf-8", delay=True)
+    handler.namer = lambda name: name + ".gz"
+    handler.rotator = _gzip_rotator
+    handler.setLevel(level)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+class ErrorDeduplicator(logging.Filter):
+    """
+    Rate-limits identical WARNING+ records (same logger, call site and message) to `burst` per
+    `window` seconds. Suppressed repeats are counted; expired() returns one summary per key.
+
+    Args:
+        window (float): Seconds a deduplication window lasts, from the first occurrence.
+        burst (int): Identical records let through per window.
+        clock (callable): Time source, injectable for tests.
+    """
+
+    def __init__(self, window: float = LOG_DEDUP_WINDOW, burst: int = LOG_DEDUP_BURST, clock=time.time):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.clock = clock
+        self._seen: Dict[Tuple, List[Any]] = {}  # key -> [first seen, last seen, count, sample fields]
+        self._closed: List[logging.LogRecord] = []
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.window <= 0:
+            return True
+        message = record.getMessage()
+        key = (record.name, record.levelno, record.pathname, record.lineno, message[:300])
+        now = self.clock()
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] >= self.window:
+                self._close(seen)
+                seen = None
+            if seen is None:
+                # Keep the fields for the summary, not the record (its traceback pins stack frames)
+                sample = dict(vars(record), msg=message, args=None, exc_info=None, exc_text=None)
+                self._seen[key] = [now, now, 1, sample]
+                return True
+            seen[1] = now
+            seen[2] += 1
+            if seen[2] <= self.burst:
+                return True
+            self.suppressed += 1
+            return False
+
+    def _close(self, seen: List[Any]) -> None:
+        first, last, count, sample = seen
+        if count <= self.burst:
+            return
+        summary = logging.makeLogRecord(sample)
+        summary.msg = f"{sample['msg']} (repeated {count} times)"
+        summary.created = last
+        summary.count = count
+        summary.suppressed = count - self.burst
+        summary.first_seen = _iso(first)
+        summary.last_seen = _iso(last)
+        self._closed.append(summary)
+
+    def expired(self, force: bool = False) -> List[logging.LogRecord]:
+        """Summary records for windows that closed (all windows with force) with repeats suppressed."""
+        now = self.clock()
+        with self._lock:
+            for key, seen in list(self._seen.items()):
+                if force or now - seen[0] >= self.window:
+                    del self._seen[key]
+                    self._close(seen)
+            summaries, self._closed = self._closed, []
+        return summaries
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and leaves traceback formatting to the writer thread."""
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args now (they may change after this call); exc_info stays for the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Queue handler installed on the root logger plus the writer thread that drains it.
+
+    Args:
+        handlers (list): Output handlers run on the writer thread.
+        queue_size (int): Records buffered before new ones are dropped.
+        deduplicator (ErrorDeduplicator): Filter applied where records are logged.
+    """
+
+    def __init__(self, handlers: List[logging.Handler], queue_size: int = LOG_QUEUE_SIZE,
+                 deduplicator: Optional[ErrorDeduplicator] = None):
+        self.handlers = handlers
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.deduplicator = deduplicator or ErrorDeduplicator()
+        self.queue_handler = _QueueHandler(self.queue)
+        self.queue_handler.addFilter(self.deduplicator)
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="cryptiq-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush pending summaries and records, then stop the writer thread."""
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+    def _write(self, record: logging.LogRecord) -> None:
+        self.written += 1
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                record = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                record = False
+            if record is None:
+                break
+            if record is not False:
+                self._write(record)
+            for summary in self.deduplicator.expired():
+                self._write(summary)
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                self._write(record)
+        for summary in self.deduplicator.expired(force=True):
+            self._write(summary)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.queue_handler.dropped,
+            "suppressed": self.deduplicator.suppressed,
+        }
+
+
+_pipeline: Optional[LogPipeline] = None
+
+
+def start_logging() -> LogPipeline:
+    """
+    Route all logging through the queue: JSONL to LOG_FILE, errors also to ERROR_LOG_FILE,
+    plain text to the console. Idempotent; the writer is flushed and stopped at exit.
+    """
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
+    os.makedirs(LOG_DIR, exist_ok=True)
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    console.setLevel(logging.INFO)
+    _pipeline = LogPipeline([_rotating_handler(LOG_FILE, logging.DEBUG),
+                             _rotating_handler(ERROR_LOG_FILE, logging.ERROR),
+                             console])
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_pipeline.queue_handler)
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per request otherwise
+    _pipeline.start()
+    atexit.register(stop_logging)
+    return _pipeline
+
+
+def stop_logging() -> None:
+    """Write out everything still queued and stop the writer (safe to call twice)."""
+    global _pipeline
+    if _pipeline is not None:
+        root = logging.getLogger()
+        root.removeHandler(_pipeline.queue_handler)
+        _pipeline.stop()
+        _pipeline = None
+
+
+def stats() -> Dict[str, int]:
+    """Pipeline counters for the metrics registry (zeros before start_logging())."""
+    if _pipeline is None:
+        return {"queued": 0, "written": 0, "dropped": 0, "suppressed": 0}
+    return _pipeline.stats()
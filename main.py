@@ -1,46 +1,180 @@
 """
 Main entry point for Cryptiq Telegram bot.
-Sets up the bot, registers handlers, and starts polling.
+Sets up the bot, registers handlers, and starts polling or, with BOT_MODE=webhook, a webhook server.
+Importing this module only loads .env; logging, the token check and the Application build
+happen inside main(), and build_application() only wires handlers and jobs.
 """
 import os
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, JobQueue
+import asyncio
 from dotenv import load_dotenv
-import handlers
 
-# Load environment variables from .env file for secrets and configuration
+# Load environment variables from .env file for secrets and configuration.
+# Done before importing the bot modules, which read their settings at import time.
 load_dotenv()
-TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
-if not TELEGRAM_TOKEN:
-    raise RuntimeError("TELEGRAM_TOKEN must be set as an environment variable.")
-
-# Initialize the Telegram bot application and job queue for background tasks
-job_queue = JobQueue()
-app = Application.builder().token(TELEGRAM_TOKEN).job_queue(job_queue).build()
-
-# Register all command handlers for user commands (e.g., /start, /help, /portfolio, etc.)
-app.add_handler(CommandHandler("start", handlers.start))           # Onboarding and main menu
-app.add_handler(CommandHandler("help", handlers.help_command))     # Show help and command list
-app.add_handler(CommandHandler("portfolio", handlers.show_portfolio)) # Show user's portfolio
-# app.add_handler(CommandHandler("setbank", handlers.set_bank))      # Set user's bank balance
-# app.add_handler(CommandHandler("setholdings", handlers.set_holdings)) # Set user's crypto holdings
-# app.add_handler(CommandHandler("setstrategy", handlers.set_strategy)) # Set user's trading strategy
-app.add_handler(CommandHandler("setalert", handlers.set_alert))    # Set price alerts
-app.add_handler(CommandHandler("news", handlers.news))             # Show latest crypto news
-app.add_handler(CommandHandler("deleteprofile", handlers.delete_profile)) # Delete user profile and data
-app.add_handler(CommandHandler("menu", handlers.main_menu))        # Show main menu with buttons
-app.add_handler(CommandHandler("settings", handlers.settings_command)) # Show and change user settings
-app.add_handler(CommandHandler("language", handlers.language_command)) # Change language
-
-# Register message handler for all non-command text messages (AI chat, onboarding, etc.)
-app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_message))
-# Register callback query handler for inline keyboard button presses
-app.add_handler(CallbackQueryHandler(handlers.button_handler))
-
-# Background job: check for triggered price alerts every 60 seconds
-async def alert_checker_job(context):
-    await handlers.alert_checker(app)
-job_queue.run_repeating(alert_checker_job, interval=60, first=0)
+
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, JobQueue
+import handlers
+import utils
+import database
+import chatlog
+import http_client
+import price_feed
+import news
+import charts
+import metrics
+import ai_chat
+import coins
+import log_pipeline
+import valuation
+import admission
+import candles
+import maintenance
+import messages
+import keyboards
+from update_processor import PerUserUpdateProcessor
+from notifier import notifier
+
+# Update source: "polling" (default) or "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling").lower()
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # Public URL Telegram posts to, e.g. https://bot.example.com/telegram
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+
+_loop_monitor = None
+
+# Start the price feed once the bot's event loop is running
+async def on_startup(application):
+    price_feed.price_bus.add_watch_provider(handlers.alert_coin_ids)  # Always track coins with alerts
+    price_feed.price_bus.subscribe("alerts", lambda ticks: handlers.alert_checker(application, ticks))
+    price_feed.price_bus.subscribe("candles", candles.ingest_ticks)  # Extend hourly candles from live ticks
+    await price_feed.start_price_feed()
+    global _loop_monitor
+    _loop_monitor = asyncio.get_running_loop().create_task(metrics.monitor_event_loop())  # Event-loop lag probe
+    metrics.start_exposition_server()  # GET /metrics on METRICS_PORT, if set
+
+# Deliver queued notifications while the bot can still send
+async def on_stop(application):
+    await notifier.drain()
+
+# Release shared resources when the bot stops
+async def on_shutdown(application):
+    global _loop_monitor
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+        _loop_monitor = None
+    metrics.stop_exposition_server()
+    await price_feed.stop_price_feed()
+    await notifier.stop()
+    database.flush_user_data()  # Persist user records still waiting for write-behind
+    charts.chart_service.shutdown()  # Stop chart worker processes
+    await http_client.close_http_client()  # Close pooled upstream connections
+
+def build_application(token, request=None):
+    """
+    Build the Telegram Application and register all handlers and jobs. Performs no network I/O.
+
+    Args:
+        token (str): Telegram bot token.
+        request (telegram.request.BaseRequest): Optional. Custom Bot API transport (used by benchmarks).
+
+    Returns:
+        telegram.ext.Application: The configured application.
+    """
+    # Initialize the Telegram bot application and job queue for background tasks.
+    # Updates are processed concurrently on a bounded pool, in order per user.
+    processor = PerUserUpdateProcessor()
+    builder = (Application.builder().token(token).job_queue(JobQueue()).concurrent_updates(processor)
+               .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown))
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    app = builder.build()
+
+    # Compile every locale's messages and build each language's keyboards once, before any update arrives
+    messages.catalog.load()
+    keyboards.build_all()
+
+    # Register all command handlers for user commands (e.g., /start, /help, /portfolio, etc.)
+    app.add_handler(CommandHandler("start", handlers.start))           # Onboarding and main menu
+    app.add_handler(CommandHandler("help", handlers.help_command))     # Show help and command list
+    app.add_handler(CommandHandler("portfolio", handlers.show_portfolio)) # Show user's portfolio
+    # app.add_handler(CommandHandler("setbank", handlers.set_bank))      # Set user's bank balance
+    # app.add_handler(CommandHandler("setholdings", handlers.set_holdings)) # Set user's crypto holdings
+    # app.add_handler(CommandHandler("setstrategy", handlers.set_strategy)) # Set user's trading strategy
+    app.add_handler(CommandHandler("setalert", handlers.set_alert))    # Set price alerts
+    app.add_handler(CommandHandler("news", handlers.news))             # Show latest crypto news
+    app.add_handler(CommandHandler("deleteprofile", handlers.delete_profile)) # Delete user profile and data
+    app.add_handler(CommandHandler("menu", handlers.main_menu))        # Show main menu with buttons
+    app.add_handler(CommandHandler("settings", handlers.settings_command)) # Show and change user settings
+    app.add_handler(CommandHandler("language", handlers.language_command)) # Change language
+    app.add_handler(CommandHandler("stats", handlers.stats))           # Admin-only metrics summary
+
+    # Register message handler for all non-command text messages (AI chat, onboarding, etc.)
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_message))
+    # Register callback query handler for inline keyboard button presses
+    app.add_handler(CallbackQueryHandler(handlers.button_handler))
+
+    # Background job: refresh the cached /news payload
+    app.job_queue.run_repeating(metrics.instrument(news.refresh_news_job), interval=news.NEWS_REFRESH_INTERVAL, first=0)
+    # Background job: write cached user record changes to the database
+    app.job_queue.run_repeating(database.flush_user_data_job, interval=database.USER_FLUSH_INTERVAL)
+    # Background job: re-rank the coin registry from CoinGecko (skipped while the saved copy is fresh)
+    app.job_queue.run_repeating(metrics.instrument(coins.refresh_coins_job), interval=3600, first=60)
+    # Background job: backfill price history (and gaps) for coins with candles
+    app.job_queue.run_repeating(metrics.instrument(candles.backfill_job), interval=3600, first=30)
+    # Background jobs: revalue every portfolio in one pass for the history store and the daily digest
+    if valuation.SNAPSHOT_INTERVAL > 0:
+        app.job_queue.run_repeating(metrics.instrument(valuation.snapshot_job), interval=valuation.SNAPSHOT_INTERVAL,
+                                    first=valuation.SNAPSHOT_INTERVAL)
+    if valuation.digest_time() is not None:
+        app.job_queue.run_daily(metrics.instrument(valuation.daily_digest_job), time=valuation.digest_time())
+    # Background job: archive old chat log segments, snapshot users/alerts incrementally, checkpoint the WAL
+    if maintenance.MAINTENANCE_INTERVAL > 0:
+        app.job_queue.run_repeating(metrics.instrument(maintenance.maintenance_job),
+                                    interval=maintenance.MAINTENANCE_INTERVAL, first=300)
+
+    # Time every handler and export the caches' own counters
+    metrics.instrument_application(app)
+    # Rate-limit each user per command class and shed expensive requests when saturated (outermost wrapper)
+    admission.guard_application(app)
+    metrics.registry.register_collector("price_cache", utils.price_cache.stats)
+    metrics.registry.register_collector("price_bus", price_feed.price_bus.stats)
+    metrics.registry.register_collector("news", news.news_cache.stats)
+    metrics.registry.register_collector("charts", charts.chart_service.stats)
+    metrics.registry.register_collector("updates", processor.stats)
+    metrics.registry.register_collector("user_cache", database.user_cache_stats)
+    metrics.registry.register_collector("notifier", notifier.stats)
+    metrics.registry.register_collector("ai_context", ai_chat.conversations.stats)
+    metrics.registry.register_collector("ai_cache", ai_chat.response_cache.stats)
+    metrics.registry.register_collector("coins", coins.coin_registry.stats)
+    metrics.registry.register_collector("logging", log_pipeline.stats)
+    metrics.registry.register_collector("valuation", valuation.stats)
+    metrics.registry.register_collector("admission", admission.admission.stats)
+    metrics.registry.register_collector("candles", lambda: candles.get_candle_store().stats())
+    metrics.registry.register_collector("maintenance", maintenance.stats)
+    metrics.registry.register_collector("messages", messages.catalog.stats)
+
+    # Price alerts are checked by handlers.alert_checker as ticks arrive on the price feed (see on_startup)
+    return app
+
+def main():
+    """Configure logging, build the bot and start receiving Telegram updates (polling or webhook)."""
+    utils.configure_logging()
+    token = os.environ.get("TELEGRAM_TOKEN")
+    if not token:
+        raise RuntimeError("TELEGRAM_TOKEN must be set as an environment variable.")
+    app = build_application(token)
+    chatlog.get_chat_log()  # Rebuild the per-user chat log index before taking updates
+    print(f"Cryptiq bot is running ({BOT_MODE})...")
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook.")
+        # Serves POSTs from Telegram; on SIGINT/SIGTERM stops accepting updates and drains in-flight ones
+        app.run_webhook(listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, url_path=WEBHOOK_PATH,
+                        webhook_url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    else:
+        app.run_polling()  # Start polling for Telegram updates
 
 if __name__ == "__main__":
-    print("Cryptiq bot is running...")
-    app.run_polling()  # Start polling for Telegram updates
+    main()
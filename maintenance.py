@@ -0,0 +1,326 @@
+"""
+maintenance.py
+
+Background maintenance for Cryptiq bot's data files.
+A periodic job keeps the hot working set small and takes backups:
+- chat log segments older than the retention window are gzipped into the chat log archive;
+- user and alert state is snapshotted from one consistent read of the database. A snapshot only
+  stores the rows that changed (or were deleted) since the previous one, with a full snapshot
+  every BACKUP_FULL_EVERY snapshots, so any snapshot can be restored by replaying the chain from
+  the full snapshot before it. Chains older than BACKUP_RETENTION_DAYS are pruned;
+- the SQLite write-ahead log is checkpointed and truncated.
+
+Point-in-time restore (with the bot stopped):
+    python maintenance.py list
+    python maintenance.py restore 2026-10-01T12:00    (UTC; or "latest")
+"""
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import datetime
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import chatlog
+import database
+import metrics
+
+BACKUP_DIR = os.environ.get("CRYPTIQ_BACKUP_DIR", os.path.join(os.path.dirname(__file__), "backups"))
+MAINTENANCE_INTERVAL = float(os.environ.get("MAINTENANCE_INTERVAL", "3600"))  # seconds, 0 = off
+BACKUP_FULL_EVERY = int(os.environ.get("BACKUP_FULL_EVERY", "24"))  # snapshots per chain, full one included
+BACKUP_RETENTION_DAYS = float(os.environ.get("BACKUP_RETENTION_DAYS", "30"))
+CHAT_RETENTION_DAYS = float(os.environ.get("CHAT_RETENTION_DAYS", "30"))  # hot chat log window
+SNAPSHOT_PREFIX = "snap-"
+SNAPSHOT_SUFFIX = ".jsonl.gz"
+
+logger = logging.getLogger("cryptiq")
+
+
+class SnapshotInfo(NamedTuple):
+    """One snapshot file; seq orders snapshots, kind is "full" or "incr"."""
+    seq: int
+    ts: int
+    kind: str
+    path: str
+
+
+def _digest(value: str) -> bytes:
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+
+
+def _rows_to_state(users: List[Tuple], alerts: List[Tuple]) -> Dict[str, str]:
+    """Key every row ("u:<user id>", "a:<alert id>") to its stored text."""
+    state = {f"u:{uid}": data for uid, data in users}
+    for alert_id, uid, coin, price, data in alerts:
+        state[f"a:{alert_id}"] = json.dumps([uid, coin, price, data])
+    return state
+
+
+def _state_to_rows(state: Dict[str, str]) -> Tuple[List[Tuple], List[Tuple]]:
+    users = []
+    alerts = []
+    for key, value in state.items():
+        kind, ident = key.split(":", 1)
+        if kind == "u":
+            users.append((ident, value))
+        else:
+            uid, coin, price, data = json.loads(value)
+            alerts.append((int(ident), uid, coin, price, data))
+    return users, alerts
+
+
+class SnapshotStore:
+    """
+    Incremental snapshots of the users and alerts tables.
+
+    Each snapshot is a gzipped JSONL file: a header line, then one line per changed row
+    ({"k": key, "v": stored text}) or deleted row ({"k": key, "deleted": true}).
+
+    Args:
+        directory (str): Folder holding the snapshot files.
+        full_every (int): Snapshots per chain; the first of each chain is full.
+        retention_days (float): Age after which whole chains are deleted (the chain covering
+            the cutoff is kept so every point inside the window stays restorable).
+    """
+
+    def __init__(self, directory: str = BACKUP_DIR, full_every: int = BACKUP_FULL_EVERY,
+                 retention_days: float = BACKUP_RETENTION_DAYS):
+        self.directory = directory
+        self.full_every = max(1, full_every)
+        self.retention_days = retention_days
+        self._digests: Optional[Dict[str, bytes]] = None  # row key -> digest as of the last snapshot
+        self._lock = threading.Lock()
+        self.snapshots = 0
+        self.rows_written = 0
+        self.pruned = 0
+
+    # --- Files ---
+
+    def list(self) -> List[SnapshotInfo]:
+        """Return every snapshot, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        out = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)):
+                continue
+            try:
+                seq, ts, kind = name[len(SNAPSHOT_PREFIX):-len(SNAPSHOT_SUFFIX)].split("-")
+                out.append(SnapshotInfo(int(seq), int(ts), kind, os.path.join(self.directory, name)))
+            except ValueError:
+                continue
+        return sorted(out)
+
+    def _write(self, seq: int, ts: int, kind: str, changed: Dict[str, str], deleted: List[str]) -> SnapshotInfo:
+        name = f"{SNAPSHOT_PREFIX}{seq:08d}-{ts}-{kind}{SNAPSHOT_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": seq, "ts": ts, "kind": kind, "changed": len(changed), "deleted": len(deleted)}) + "\n")
+            for key, value in changed.items():
+                f.write(json.dumps({"k": key, "v": value}) + "\n")
+            for key in deleted:
+                f.write(json.dumps({"k": key, "deleted": True}) + "\n")
+        os.replace(path + ".tmp", path)
+        return SnapshotInfo(seq, ts, kind, path)
+
+    @staticmethod
+    def _apply(state: Dict[str, str], path: str) -> None:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            next(f, None)  # header
+            for line in f:
+                record = json.loads(line)
+                if record.get("deleted"):
+                    state.pop(record["k"], None)
+                else:
+                    state[record["k"]] = record["v"]
+
+    # --- Snapshot and restore ---
+
+    def state_at(self, ts: Optional[float] = None, snapshots: Optional[List[SnapshotInfo]] = None) -> Tuple[Optional[SnapshotInfo], Dict[str, str]]:
+        """
+        Rebuild the table state of the newest snapshot taken at or before ts (default: latest).
+
+        Returns:
+            tuple: (snapshot restored, {row key: stored text}); (None, {}) if there is none.
+        """
+        snaps = self.list() if snapshots is None else snapshots
+        chosen = [s for s in snaps if ts is None or s.ts <= ts]
+        if not chosen:
+            return None, {}
+        target = chosen[-1]
+        start = max(i for i, s in enumerate(chosen) if s.kind == "full" or i == 0)
+        state: Dict[str, str] = {}
+        for snap in chosen[start:]:
+            self._apply(state, snap.path)
+        return target, state
+
+    def snapshot(self, now: Optional[float] = None) -> Optional[SnapshotInfo]:
+        """
+        Snapshot the users and alerts tables, storing only rows changed since the last snapshot.
+
+        Returns:
+            SnapshotInfo: The snapshot written, or None if nothing changed.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            users, alerts = database.snapshot_rows()
+            state = _rows_to_state(users, alerts)
+            digests = {key: _digest(value) for key, value in state.items()}
+            snaps = self.list()
+            os.makedirs(self.directory, exist_ok=True)
+            if self._digests is None:
+                # First snapshot in this process: the previous state is the end of the chain on disk
+                self._digests = {key: _digest(value) for key, value in self.state_at(None, snaps)[1].items()}
+            fulls = [i for i, snap in enumerate(snaps) if snap.kind == "full"]
+            if not fulls or len(snaps) - fulls[-1] >= self.full_every:
+                kind, changed, deleted = "full", state, []
+            else:
+                kind = "incr"
+                changed = {key: state[key] for key, d in digests.items() if self._digests.get(key) != d}
+                deleted = [key for key in self._digests if key not in digests]
+                if not changed and not deleted:
+                    return None
+            info = self._write(snaps[-1].seq + 1 if snaps else 1, int(now), kind, changed, deleted)
+            self._digests = digests
+            self.snapshots += 1
+            self.rows_written += len(changed) + len(deleted)
+            self._prune(snaps + [info], now)
+            return info
+
+    def _prune(self, snaps: List[SnapshotInfo], now: float) -> None:
+        """Delete chains that ended before the retention cutoff."""
+        if self.retention_days <= 0:
+            return
+        cutoff = now - self.retention_days * 86400
+        fulls = [s for s in snaps if s.kind == "full" and s.ts <= cutoff]
+        if not fulls:
+            return
+        for snap in snaps:
+            if snap.seq >= fulls[-1].seq:
+                break
+            os.remove(snap.path)
+            self.pruned += 1
+
+    def restore(self, ts: Optional[float] = None) -> Optional[SnapshotInfo]:
+        """
+        Replace the users and alerts tables with their state at the newest snapshot taken at or
+        before ts (default: latest). Run with the bot stopped.
+
+        Returns:
+            SnapshotInfo: The snapshot restored, or None if there is none that old.
+        """
+        with self._lock:
+            target, state = self.state_at(ts)
+            if target is None:
+                return None
+            database.replace_all_rows(*_state_to_rows(state))
+            self._digests = None
+            return target
+
+    def stats(self) -> Dict[str, int]:
+        return {"snapshots": self.snapshots, "rows_written": self.rows_written, "pruned": self.pruned}
+
+
+_store: Optional[SnapshotStore] = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """Return the process-wide snapshot store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SnapshotStore()
+    return _store
+
+
+# --- Job ---
+
+_last_run: Dict[str, Any] = {"archived_segments": 0, "snapshot_rows": 0, "seconds": 0.0, "failures": 0}
+
+
+@metrics.timed("storage_seconds", op="maintenance")
+def run_maintenance(now: Optional[float] = None) -> Dict[str, Any]:
+    """Archive old chat log segments, take a snapshot and checkpoint the WAL. Each step runs even if another fails."""
+    now = time.time() if now is None else now
+    start = time.perf_counter()
+    failures = 0
+    archived = 0
+    rows = 0
+    try:
+        if CHAT_RETENTION_DAYS > 0:
+            archived = chatlog.get_chat_log().archive_segments(now - CHAT_RETENTION_DAYS * 86400)
+    except Exception as e:
+        failures += 1
+        logger.error(f"[maintenance] chat log archiving failed: {e}", exc_info=e)
+    try:
+        store = get_snapshot_store()
+        written = store.rows_written
+        store.snapshot(now)
+        rows = store.rows_written - written
+    except Exception as e:
+        failures += 1
+        logger.error(f"[maintenance] snapshot failed: {e}", exc_info=e)
+    try:
+        database.checkpoint()
+    except Exception as e:
+        failures += 1
+        logger.error(f"[maintenance] WAL checkpoint failed: {e}", exc_info=e)
+    _last_run.update(archived_segments=archived, snapshot_rows=rows, seconds=time.perf_counter() - start,
+                     failures=failures)
+    return dict(_last_run)
+
+
+async def maintenance_job(context) -> None:
+    """JobQueue callback running maintenance off the event loop."""
+    await asyncio.get_running_loop().run_in_executor(None, run_maintenance)
+
+
+def stats() -> Dict[str, Any]:
+    """Last maintenance run plus snapshot and chat log counters."""
+    out = dict(_last_run)
+    out.update(get_snapshot_store().stats())
+    out.update(chatlog.get_chat_log().stats())
+    return out
+
+
+# --- Command line ---
+
+def _parse_time(text: str) -> Optional[float]:
+    if text == "latest":
+        return None
+    when = datetime.datetime.fromisoformat(text)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when.timestamp()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="List or restore Cryptiq user/alert snapshots.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="list snapshots")
+    restore = sub.add_parser("restore", help="restore the newest snapshot at or before a time (stop the bot first)")
+    restore.add_argument("time", help='ISO time, UTC unless an offset is given, or "latest"')
+    args = parser.parse_args(argv)
+    store = get_snapshot_store()
+    if args.command == "list":
+        for snap in store.list():
+            print(f"{snap.seq:8d}  {datetime.datetime.fromtimestamp(snap.ts, datetime.timezone.utc).isoformat()}  "
+                  f"{snap.kind:4s}  {os.path.getsize(snap.path)} bytes")
+        return 0
+    info = store.restore(_parse_time(args.time))
+    if info is None:
+        print("No snapshot at or before that time.")
+        return 1
+    print(f"Restored snapshot {info.seq} taken {datetime.datetime.fromtimestamp(info.ts, datetime.timezone.utc).isoformat()}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,171 @@
+"""
+messages.py
+
+Message catalog for Cryptiq bot.
+Every user-facing reply lives in one JSON file per language under locales/ (en.json is the
+reference). All locales are loaded once into precompiled templates: the shared disclaimer is
+spliced in, templates without fields become plain strings, and the rest keep only their bound
+str.format method. Each language's table already contains the English fallback for keys it does
+not translate, so render() is one dict lookup per call whatever the number of languages.
+"""
+import os
+import json
+import string
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Set, Union
+
+LOCALE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")
+DEFAULT_LANGUAGE = "en"
+
+logger = logging.getLogger("cryptiq")
+
+# A compiled template: a finished string, or str.format bound to the template text
+Template = Union[str, Callable[..., str]]
+
+_formatter = string.Formatter()
+
+
+def _fields(template: str) -> Set[str]:
+    """Names of the replacement fields in a str.format template (raises ValueError if malformed)."""
+    return {name.split(".")[0].split("[")[0] for _, name, _, _ in _formatter.parse(template) if name}
+
+
+def _compile(template: str) -> Template:
+    """Precompile one template: field-free text is unescaped once, anything else keeps its format method."""
+    return template.format if _fields(template) else template.format()
+
+
+class Locale:
+    """
+    One loaded language.
+
+    Args:
+        code (str): Language code (file name without .json).
+        name (str): Native language name, shown in the language picker.
+        english_name (str): English name of the language, also accepted when typed.
+        templates (dict): Compiled templates by message key, fallbacks included.
+        buttons (dict): Keyboard button labels by key, fallbacks included.
+    """
+
+    def __init__(self, code: str, name: str, english_name: str, templates: Dict[str, Template], buttons: Dict[str, str]):
+        self.code = code
+        self.name = name
+        self.english_name = english_name
+        self.templates = templates
+        self.buttons = buttons
+
+
+class MessageCatalog:
+    """
+    All locales, loaded and compiled on first use.
+
+    Args:
+        directory (str): Folder holding <language code>.json files.
+        default (str): Reference language; other locales fall back to it key by key.
+    """
+
+    def __init__(self, directory: str = LOCALE_DIR, default: str = DEFAULT_LANGUAGE):
+        self.directory = directory
+        self.default = default
+        self._locales: Optional[Dict[str, Locale]] = None
+        self._lock = threading.Lock()
+
+    # --- Loading ---
+
+    def _read(self, code: str) -> Dict[str, Any]:
+        with open(os.path.join(self.directory, code + ".json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _build(self, code: str, raw: Dict[str, Any], base: Optional[Dict[str, Any]]) -> Locale:
+        """Compile one locale; keys missing from it or with mismatched fields use the base text."""
+        disclaimer = raw.get("disclaimer", base["disclaimer"] if base else "")
+        texts: Dict[str, str] = dict(base["messages"]) if base else {}
+        for key, text in raw.get("messages", {}).items():
+            if base is not None:
+                if key not in base["messages"]:
+                    logger.warning(f"[messages] {code}: unknown message key {key!r} ignored")
+                    continue
+                try:
+                    extra = _fields(text) - _fields(base["messages"][key])
+                except ValueError as e:
+                    extra = {str(e)}
+                if extra:
+                    logger.warning(f"[messages] {code}: {key!r} has unexpected fields {sorted(extra)}, using {self.default}")
+                    continue
+            texts[key] = text
+        templates = {key: _compile(text.replace("{disclaimer}", disclaimer.replace("{", "{{").replace("}", "}}")))
+                     for key, text in texts.items()}
+        buttons = dict(base.get("buttons", {})) if base else {}
+        buttons.update(raw.get("buttons", {}))
+        return Locale(code, raw.get("language_name", code), raw.get("english_name", code), templates, buttons)
+
+    def load(self) -> Dict[str, Locale]:
+        """Load and compile every locale (idempotent). The default locale must exist and be valid."""
+        if self._locales is not None:
+            return self._locales
+        with self._lock:
+            if self._locales is None:
+                base = self._read(self.default)
+                locales = {self.default: self._build(self.default, base, None)}
+                for name in sorted(os.listdir(self.directory)):
+                    code = name[:-5]
+                    if not name.endswith(".json") or code == self.default:
+                        continue
+                    try:
+                        locales[code] = self._build(code, self._read(code), base)
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"[messages] skipping locale {name}: {e}")
+                self._locales = locales
+        return self._locales
+
+    # --- Lookups ---
+
+    def locale(self, language: Optional[str]) -> Locale:
+        """The locale for a language code, or the default one."""
+        locales = self.load()
+        return locales.get(language) or locales[self.default]
+
+    def render(self, language: Optional[str], key: str, **params: Any) -> str:
+        """
+        Render a message in a language (unknown languages use the default).
+
+        Args:
+            language (str): Language code, e.g. user_data["language"].
+            key (str): Message key, e.g. "alert.set".
+            **params: Values for the template's fields.
+
+        Returns:
+            str: The finished text.
+        """
+        template = self.locale(language).templates[key]
+        return template if template.__class__ is str else template(**params)
+
+    def button(self, language: Optional[str], key: str) -> str:
+        """Label of a keyboard button in a language."""
+        return self.locale(language).buttons[key]
+
+    def languages(self) -> Dict[str, str]:
+        """{language code: native name} for every loaded locale, default first."""
+        return {code: loc.name for code, loc in self.load().items()}
+
+    def resolve_language(self, text: str) -> Optional[str]:
+        """Language code for a code or native/English name typed by a user, or None."""
+        wanted = text.strip().lower()
+        for code, loc in self.load().items():
+            if wanted in (code, loc.name.lower(), loc.english_name.lower()):
+                return code
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        locales = self.load()
+        return {"locales": len(locales), "messages": len(locales[self.default].templates)}
+
+
+def user_language(user_data: Optional[Dict[str, Any]]) -> str:
+    """The language stored in a user record, or the default."""
+    return (user_data or {}).get("language") or DEFAULT_LANGUAGE
+
+
+# Shared by every module that replies to users
+catalog = MessageCatalog()
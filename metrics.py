@@ -0,0 +1,273 @@
+"""
+metrics.py
+
+In-process instrumentation for Cryptiq bot.
+Latency histograms (fixed exponential buckets, so recording is a bisect and two increments under a
+lock), counters and gauges keyed by name and labels, plus collectors that snapshot the counters the
+caches already keep. Handlers, storage calls and upstream HTTP calls are timed with `timed()` /
+`instrument()`; an event-loop lag probe runs alongside the bot. Everything is exposed as a short
+summary for the admin-only /stats command and in Prometheus text format on a local HTTP port.
+"""
+import os
+import time
+import bisect
+import asyncio
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))  # 0 disables the exposition endpoint
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+LOOP_LAG_INTERVAL = 0.5
+# Bucket upper bounds in seconds: 0.5 ms .. ~33 s, doubling
+BUCKETS: Tuple[float, ...] = tuple(0.0005 * 2 ** i for i in range(17))
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram."""
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside the bucket that contains it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class MetricsRegistry:
+    """Thread-safe store of histograms, counters, gauges and collectors."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._histograms: Dict[_Key, Histogram] = {}
+        self._counters: Dict[_Key, float] = {}
+        self._gauges: Dict[_Key, float] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> _Key:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(seconds)
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def register_collector(self, name: str, collect: Callable[[], Dict[str, Any]]) -> None:
+        """Register a callable whose numeric results are exported as gauges `<name>_<field>`."""
+        self._collectors[name] = collect
+
+    def histograms(self) -> Dict[_Key, Histogram]:
+        with self._lock:
+            return dict(self._histograms)
+
+    def counters(self) -> Dict[_Key, float]:
+        with self._lock:
+            return dict(self._counters)
+
+    def gauges(self) -> Dict[_Key, float]:
+        """Set gauges plus a fresh snapshot of every collector."""
+        with self._lock:
+            out = dict(self._gauges)
+        for prefix, collect in list(self._collectors.items()):
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for field, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    out[(f"{prefix}_{field}", ())] = value
+        return out
+
+    def reset(self) -> None:
+        """Drop every recorded value (collectors stay registered)."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+
+registry = MetricsRegistry()
+
+
+# --- Recording helpers ---
+
+def timed(name: str, **labels: Any) -> Callable:
+    """
+    Decorator recording the latency of a sync or async function in histogram `name`, and
+    counting exceptions that escape it in `<name>_errors_total`.
+    """
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException:
+                    registry.inc(f"{name}_errors_total", **labels)
+                    raise
+                finally:
+                    registry.observe(name, time.perf_counter() - start, **labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                registry.inc(f"{name}_errors_total", **labels)
+                raise
+            finally:
+                registry.observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def instrument(callback: Callable, name: Optional[str] = None) -> Callable:
+    """Wrap a handler or job callback so its latency lands in `handler_seconds{handler=name}`."""
+    if getattr(callback, "_instrumented", False):
+        return callback
+    wrapped = timed("handler_seconds", handler=name or callback.__name__)(callback)
+    wrapped._instrumented = True
+    return wrapped
+
+
+def instrument_application(app) -> None:
+    """Wrap the callback of every handler registered on a telegram.ext.Application."""
+    for group in app.handlers.values():
+        for handler in group:
+            handler.callback = instrument(handler.callback)
+
+
+async def monitor_event_loop(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Measure how late the event loop wakes a sleeping task; runs until cancelled."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        registry.observe("event_loop_lag_seconds", lag)
+        registry.set_gauge("event_loop_lag_last_seconds", lag)
+
+
+# --- Exposition ---
+
+def _labels_text(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_text() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for (name, labels), value in sorted(registry.counters().items()):
+        lines.append(f"cryptiq_{name}{_labels_text(labels)} {value}")
+    for (name, labels), value in sorted(registry.gauges().items()):
+        lines.append(f"cryptiq_{name}{_labels_text(labels)} {value}")
+    for (name, labels), hist in sorted(registry.histograms().items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS, hist.counts):
+            cumulative += n
+            le = 'le="%g"' % bound
+            lines.append(f"cryptiq_{name}_bucket{_labels_text(labels, le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"cryptiq_{name}_bucket{_labels_text(labels, le)} {hist.count}")
+        lines.append(f"cryptiq_{name}_sum{_labels_text(labels)} {hist.total}")
+        lines.append(f"cryptiq_{name}_count{_labels_text(labels)} {hist.count}")
+    return "\n".join(lines) + "\n"
+
+
+def render_summary() -> str:
+    """Short human-readable summary for the /stats command."""
+    lines = [f"Uptime: {int(time.time() - registry.started)}s"]
+    counters = registry.counters()
+    histograms = registry.histograms()
+    for (name, labels), hist in sorted(histograms.items()):
+        label = ",".join(v for _, v in labels)
+        errors = counters.get((f"{name}_errors_total", labels), 0)
+        lines.append(f"{name}[{label}] n={hist.count} p50={hist.quantile(0.5) * 1000:.1f}ms "
+                     f"p95={hist.quantile(0.95) * 1000:.1f}ms p99={hist.quantile(0.99) * 1000:.1f}ms"
+                     + (f" errors={int(errors)}" if errors else ""))
+    for (name, labels), value in sorted(counters.items()):
+        if name.endswith("_errors_total") and (name[:-len("_errors_total")], labels) in histograms:
+            continue  # already shown next to its histogram
+        lines.append(f"{name}[{','.join(v for _, v in labels)}] = {int(value)}")
+    for (name, labels), value in sorted(registry.gauges().items()):
+        lines.append(f"{name} = {value:.3f}" if isinstance(value, float) else f"{name} = {value}")
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def start_exposition_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Serve GET /metrics on host:port from a daemon thread (no-op when port is 0)."""
+    global _server
+    if not port or _server is not None:
+        return _server
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
+
+
+def stop_exposition_server() -> None:
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
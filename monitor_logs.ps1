@@ -2,7 +2,7 @@
 # Usage: Right-click and 'Run with PowerShell' or run in terminal
 
 # Monitor both the main log and error log
-Write-Host "Monitoring cryptiq.log and error_log.json. Press Ctrl+C to stop."
+Write-Host "Monitoring cryptiq.log and error_log.jsonl (one JSON record per line). Press Ctrl+C to stop."
 
 Get-Content -Path "cryptiq.log" -Wait -Tail 20 | ForEach-Object { Write-Host "[cryptiq.log] $_" }
-Get-Content -Path "error_log.json" -Wait -Tail 20 | ForEach-Object { Write-Host "[error_log.json] $_" }
+Get-Content -Path "error_log.jsonl" -Wait -Tail 20 | ForEach-Object { Write-Host "[error_log.jsonl] $_" }
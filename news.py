@@ -0,0 +1,106 @@
+"""
+news.py
+
+Background news refresher for Cryptiq bot.
+A scheduled job fetches the latest CryptoCompare headlines (with conditional requests, so an
+unchanged feed costs a 304), keeps the top articles and their pre-rendered HTML list in memory,
+and keeps serving the last good payload when a refresh fails. The /news handler answers straight
+from memory with no network I/O, adding the header from the message catalog in the user's language.
+"""
+import os
+import html
+import time
+from typing import Any, Dict, List, Optional
+
+import utils
+from http_client import get_http_client
+from messages import catalog
+
+NEWS_REFRESH_INTERVAL = float(os.environ.get("NEWS_REFRESH_INTERVAL", "300"))
+NEWS_TOP_N = 5
+
+
+def render_news_html(articles: List[Dict[str, Any]]) -> str:
+    """Build the article list of the /news reply (Telegram HTML), without the header."""
+    msg = ""
+    for a in articles:
+        msg += f"\n• <a href='{html.escape(str(a['url']), quote=True)}'>{html.escape(str(a['title']))}</a>"
+    return msg
+
+
+class NewsCache:
+    """
+    In-memory copy of the latest headlines and their rendered reply.
+
+    Args:
+        top_n (int): Number of articles kept and rendered.
+    """
+
+    def __init__(self, top_n: int = NEWS_TOP_N):
+        self.top_n = top_n
+        self.articles: List[Dict[str, Any]] = []
+        self.html: Optional[str] = None  # rendered article list; reply() adds the header
+        self.fetched_at: Optional[float] = None
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self.refreshes = 0
+        self.not_modified = 0
+        self.failures = 0
+
+    async def refresh(self) -> bool:
+        """
+        Fetch the feed and rebuild the payload if it changed.
+
+        Returns:
+            bool: True if a usable payload is available afterwards (new or previous).
+        """
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        try:
+            resp = await get_http_client().get(utils.CRYPTOCOMPARE_NEWS_API, headers=headers)
+            if resp.status_code == 304 and self.html is not None:
+                self.not_modified += 1
+                self.fetched_at = time.time()
+                return True
+            resp.raise_for_status()
+            articles = [a for a in resp.json().get('Data', []) if a.get('url') and a.get('title')][:self.top_n]
+            if not articles:
+                raise ValueError("News feed returned no articles")
+            self.articles = articles
+            self.html = render_news_html(articles)
+            self.fetched_at = time.time()
+            self._etag = resp.headers.get("ETag")
+            self._last_modified = resp.headers.get("Last-Modified")
+            self.refreshes += 1
+        except Exception as e:
+            # Keep serving the last good payload
+            self.failures += 1
+            utils.log_error(e, context="news refresh")
+        return self.html is not None
+
+    def reply(self, language: Optional[str] = None) -> Optional[str]:
+        """The /news reply in a language (Telegram HTML), or None before the first successful refresh."""
+        if self.html is None:
+            return None
+        return html.escape(catalog.render(language, "news.header"), quote=False) + "\n" + self.html
+
+    def stats(self) -> Dict[str, Any]:
+        """Return refresh counters and the age of the current payload."""
+        return {
+            "refreshes": self.refreshes,
+            "not_modified": self.not_modified,
+            "failures": self.failures,
+            "age_seconds": (time.time() - self.fetched_at) if self.fetched_at else -1,
+        }
+
+
+# Shared by the refresh job and the /news handler
+news_cache = NewsCache()
+
+
+async def refresh_news_job(context) -> None:
+    """JobQueue callback refreshing the shared news cache."""
+    await news_cache.refresh()
@@ -0,0 +1,326 @@
+"""
+notifier.py
+
+Rate-limited outbound message scheduler for Cryptiq bot.
+Proactive messages (price alerts, digests, broadcasts) are queued here instead of being sent
+inline, then delivered as fast as Telegram's flood limits allow: a global token bucket (~30
+messages/s per bot) and one bucket per chat (~1 message/s). Lower priority numbers go first, so
+alerts overtake digests. Messages for a chat that is waiting its turn are merged (same merge key)
+into a single message. RetryAfter pauses all sending for the period Telegram asks for, and the
+message is retried; other transient network errors are retried with backoff.
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+NOTIFY_GLOBAL_RATE = float(os.environ.get("NOTIFY_GLOBAL_RATE", "25"))  # messages/s, below Telegram's 30
+NOTIFY_CHAT_RATE = float(os.environ.get("NOTIFY_CHAT_RATE", "1"))  # messages/s to a single chat
+NOTIFY_CONCURRENCY = 16  # Bot API calls in flight
+NOTIFY_MAX_ATTEMPTS = 5
+CHAT_BUCKETS_PRUNE_AT = 10000  # per-chat buckets kept before idle ones are pruned
+
+PRIORITY_ALERT = 0
+PRIORITY_DIGEST = 10
+PRIORITY_BROADCAST = 20
+
+logger = logging.getLogger("cryptiq")
+
+
+class TokenBucket:
+    """
+    Token bucket pacing: `rate` tokens per second, bursts of up to `capacity`.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum tokens held.
+        clock (callable): Monotonic clock, injectable for tests.
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated", "clock")
+
+    def __init__(self, rate: float, capacity: float = 1.0, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class _Message:
+    """One queued (possibly merged) outbound message."""
+    __slots__ = ("chat_id", "priority", "merge_key", "parts", "render", "kwargs", "enqueued_at", "attempts", "sending")
+
+    def __init__(self, chat_id: int, text: str, priority: int, merge_key: Optional[str],
+                 render: Optional[Callable[[List[str]], str]], kwargs: Dict[str, Any]):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.merge_key = merge_key
+        self.parts = [text]
+        self.render = render
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.sending = False
+
+    def text(self) -> str:
+        return self.render(self.parts) if self.render is not None else "\n\n".join(self.parts)
+
+
+class Notifier:
+    """
+    Outbound message queue with global and per-chat pacing, priorities and merging.
+
+    Args:
+        global_rate (float): Messages per second across all chats.
+        chat_rate (float): Messages per second to one chat.
+        concurrency (int): Bot API calls in flight at once.
+        max_attempts (int): Delivery attempts per message before it is dropped.
+    """
+
+    def __init__(self, global_rate: float = NOTIFY_GLOBAL_RATE, chat_rate: float = NOTIFY_CHAT_RATE,
+                 concurrency: int = NOTIFY_CONCURRENCY, max_attempts: int = NOTIFY_MAX_ATTEMPTS):
+        self.chat_rate = chat_rate
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, capacity=max(1.0, global_rate / 10))  # small bursts only
+        self._chats: Dict[int, TokenBucket] = {}
+        self._next_prune = CHAT_BUCKETS_PRUNE_AT  # prune once the bucket count passes this
+        self._pending: Dict[int, List[_Message]] = {}  # per chat, in enqueue order
+        self._ready: List[Tuple[int, int, _Message]] = []  # (priority, seq, message)
+        self._delayed: List[Tuple[float, int, _Message]] = []  # (not before, seq, message)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._bot = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._sends: set = set()
+        self.enqueued = 0
+        self.merged = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    # --- Lifecycle ---
+
+    def ensure_started(self, bot) -> None:
+        """Start the dispatcher on the running loop if it is not running yet (idempotent)."""
+        self._bot = bot
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def drain(self, timeout: float = 10.0) -> bool:
+        """Wait until every queued message was delivered or dropped. False if the timeout expired."""
+        deadline = time.monotonic() + timeout
+        while self._pending or self._sends:
+            if self._task is None or time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def stop(self) -> None:
+        """Stop the dispatcher; messages still queued are discarded."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._sends):
+            task.cancel()
+
+    # --- Queueing ---
+
+    def notify(self, chat_id: int, text: str, priority: int = PRIORITY_ALERT, merge_key: Optional[str] = None,
+               render: Optional[Callable[[List[str]], str]] = None, **kwargs: Any) -> None:
+        """
+        Queue a message. If the chat already has a queued, not yet sending message with the same
+        merge_key, the text is appended to it instead (render(parts) builds the merged text).
+        Extra keyword arguments are passed to bot.send_message.
+        """
+        chat_id = int(chat_id)
+        self.enqueued += 1
+        queue = self._pending.setdefault(chat_id, [])
+        if merge_key is not None:
+            for msg in queue:
+                if msg.merge_key == merge_key and not msg.sending:
+                    msg.parts.append(text)
+                    if priority < msg.priority:
+                        msg.priority = priority
+                        heapq.heappush(self._ready, (priority, next(self._seq), msg))
+                    self.merged += 1
+                    return
+        msg = _Message(chat_id, text, priority, merge_key, render, kwargs)
+        queue.append(msg)
+        heapq.heappush(self._ready, (priority, next(self._seq), msg))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def depth(self) -> int:
+        """Messages waiting to be sent (merged messages count once)."""
+        return sum(len(q) for q in self._pending.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.depth(),
+            "in_flight": len(self._sends),
+            "enqueued": self.enqueued,
+            "merged": self.merged,
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+            "paused_seconds": max(0.0, self._paused_until - time.monotonic()),
+        }
+
+    # --- Dispatching ---
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    def _promote_delayed(self, now: float) -> None:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, seq, msg = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (msg.priority, seq, msg))
+
+    def _is_live(self, msg: _Message) -> bool:
+        queue = self._pending.get(msg.chat_id)
+        return bool(queue) and msg in queue and not msg.sending
+
+    async def _wait(self, timeout: Optional[float]) -> None:
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._promote_delayed(now)
+            if not self._ready:
+                await self._wait(self._delayed[0][0] - now if self._delayed else None)
+                continue
+            priority, seq, msg = heapq.heappop(self._ready)
+            if not self._is_live(msg) or priority != msg.priority:
+                continue  # already sent, merged, or re-queued with a higher priority
+            queue = self._pending[msg.chat_id]
+            if any(m.sending for m in queue):
+                # Keep one message in flight per chat so a chat's messages arrive in order
+                heapq.heappush(self._delayed, (now + 1 / self.chat_rate, seq, msg))
+                continue
+            wait = self._chat_bucket(msg.chat_id).delay()
+            if wait > 0:
+                heapq.heappush(self._delayed, (now + wait, seq, msg))
+                continue
+            wait = self._global.delay()
+            if wait > 0:
+                heapq.heappush(self._ready, (priority, seq, msg))
+                await asyncio.sleep(wait)
+                continue
+            await self._slots.acquire()
+            self._global.consume()
+            self._chat_bucket(msg.chat_id).consume()
+            msg.sending = True
+            task = asyncio.get_running_loop().create_task(self._send(msg))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+            if len(self._chats) > self._next_prune:
+                self._prune_chats()
+
+    def _prune_chats(self) -> None:
+        """
+        Drop buckets of idle chats (full, nothing pending). The next prune waits until the count
+        doubles, so the scan is amortised O(1) per send even when most chats stay active.
+        """
+        self._chats = {cid: b for cid, b in self._chats.items() if not b.full() or cid in self._pending}
+        self._next_prune = max(CHAT_BUCKETS_PRUNE_AT, 2 * len(self._chats))
+
+    def _requeue(self, msg: _Message, not_before: float) -> None:
+        msg.sending = False
+        heapq.heappush(self._delayed, (not_before, next(self._seq), msg))
+        self._wakeup.set()
+
+    def _finish(self, msg: _Message) -> None:
+        queue = self._pending.get(msg.chat_id)
+        if queue is not None:
+            if msg in queue:
+                queue.remove(msg)
+            if not queue:
+                del self._pending[msg.chat_id]
+
+    async def _send(self, msg: _Message) -> None:
+        from telegram.error import BadRequest, Forbidden, RetryAfter, NetworkError, TimedOut
+        try:
+            msg.attempts += 1
+            start = time.perf_counter()
+            try:
+                await self._bot.send_message(chat_id=msg.chat_id, text=msg.text(), **msg.kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                seconds = float(retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+                self.retries += 1
+                metrics.registry.inc("notify_retry_after_total")
+                self._requeue(msg, self._paused_until)
+                return
+            except (BadRequest, Forbidden):
+                # Permanent (bad markup, chat not found, bot blocked); BadRequest subclasses NetworkError
+                raise
+            except (TimedOut, NetworkError) as e:
+                if msg.attempts >= self.max_attempts:
+                    raise
+                self.retries += 1
+                logger.warning(f"[notifier] retrying chat {msg.chat_id} after {e}")
+                self._requeue(msg, time.monotonic() + min(30.0, 2 ** msg.attempts))
+                return
+            metrics.registry.observe("notify_send_seconds", time.perf_counter() - start)
+            metrics.registry.observe("notify_delivery_seconds", time.monotonic() - msg.enqueued_at,
+                                     priority=msg.priority)
+            self.sent += 1
+            self._finish(msg)
+        except Exception as e:
+            # Permanent failure (blocked bot, chat not found, attempts exhausted): drop the message
+            self.failed += 1
+            metrics.registry.inc("errors_total", context="notifier send")
+            logger.warning(f"[notifier] dropping message for chat {msg.chat_id}: {e}")
+            self._finish(msg)
+        finally:
+            self._slots.release()
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+
+# Shared by every sender of proactive messages
+notifier = Notifier()
@@ -0,0 +1,208 @@
+"""
+price_cache.py
+
+Process-wide price cache for Cryptiq bot.
+Holds one entry per CoinGecko coin id with a configurable TTL, merges concurrent misses for the
+same ids into a single upstream request (single-flight), and falls back to the last known price,
+marked with an "as of" timestamp, when the upstream call fails.
+"""
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+PRICE_CACHE_TTL = float(os.environ.get("PRICE_CACHE_TTL", "30"))
+
+# Fetch callback: takes a list of coin ids, returns {coin_id: {"usd": ..., ...}} or raises.
+FetchFn = Callable[[List[str]], Dict[str, Any]]
+AsyncFetchFn = Callable[[List[str]], Awaitable[Dict[str, Any]]]
+
+
+class PriceCache:
+    """
+    TTL cache of per-coin market data with request coalescing and stale fallback.
+
+    Entries are stored as (data, fetched_at). data is None for ids the upstream did not know,
+    so repeated requests for an invalid id are also answered from cache until the TTL expires.
+
+    Args:
+        ttl (float): Seconds an entry is considered fresh.
+        clock (callable): Time source, overridable for tests.
+    """
+
+    def __init__(self, ttl: float = PRICE_CACHE_TTL, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: Dict[str, Tuple[Optional[Dict[str, Any]], float]] = {}
+        # coin id -> Event set when the request fetching it completes
+        self._inflight: Dict[str, threading.Event] = {}
+        # Same for async callers: coin id -> Future resolved when its request completes
+        self._ainflight: Dict[str, "asyncio.Future[None]"] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_served = 0
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+
+    def _fresh(self, coin_id: str, now: float) -> bool:
+        entry = self._entries.get(coin_id)
+        return entry is not None and now - entry[1] < self.ttl
+
+    def _store(self, ids: List[str], data: Dict[str, Any], now: float) -> None:
+        """Cache a successful upstream response (caller holds the lock)."""
+        for coin_id in ids:
+            value = data.get(coin_id)
+            if isinstance(value, dict) and "error" not in value:
+                self._entries[coin_id] = (value, now)
+            elif value is None:
+                self._entries[coin_id] = (None, now)
+
+    def _result(self, ids: Iterable[str], now: float) -> Dict[str, Any]:
+        """Assemble the response from cached entries, marking stale ones (caller holds the lock)."""
+        result: Dict[str, Any] = {}
+        for coin_id in ids:
+            entry = self._entries.get(coin_id)
+            if entry is None or entry[0] is None:
+                continue
+            value = dict(entry[0])
+            value["as_of"] = entry[1]
+            if now - entry[1] >= self.ttl:
+                value["stale"] = True
+                self.stale_served += 1
+            result[coin_id] = value
+        return result
+
+    def get_many(self, ids: Iterable[str], fetch: FetchFn) -> Dict[str, Any]:
+        """
+        Return market data for the given coin ids, fetching only what is missing or expired.
+
+        Args:
+            ids (iterable): CoinGecko coin ids.
+            fetch (callable): Upstream fetch for a list of ids; raises on failure.
+
+        Returns:
+            dict: {coin_id: {"usd": ..., "usd_24h_change": ..., "as_of": ts[, "stale": True]}}.
+                Ids with no fresh or stale data are omitted.
+        """
+        ids = list(dict.fromkeys(ids))
+        now = self.clock()
+        lead: List[str] = []
+        wait: List[threading.Event] = []
+        with self._lock:
+            for coin_id in ids:
+                if self._fresh(coin_id, now):
+                    self.hits += 1
+                elif coin_id in self._inflight:
+                    self.coalesced += 1
+                    pending = self._inflight[coin_id]
+                    if pending not in wait:
+                        wait.append(pending)
+                else:
+                    self.misses += 1
+                    lead.append(coin_id)
+            flight = threading.Event()
+            for coin_id in lead:
+                self._inflight[coin_id] = flight
+        if lead:
+            try:
+                self.upstream_calls += 1
+                data = fetch(lead)
+                with self._lock:
+                    self._store(lead, data, self.clock())
+            except Exception:
+                # Fall through: whatever is cached is served below, marked stale
+                self.upstream_errors += 1
+            finally:
+                with self._lock:
+                    for coin_id in lead:
+                        self._inflight.pop(coin_id, None)
+                flight.set()
+        for other in wait:
+            other.wait()
+        with self._lock:
+            return self._result(ids, self.clock())
+
+    async def aget_many(self, ids: Iterable[str], fetch: AsyncFetchFn) -> Dict[str, Any]:
+        """
+        Async variant of get_many for use inside the event loop. Concurrent coroutines missing
+        the same ids await one shared upstream request.
+
+        Args:
+            ids (iterable): CoinGecko coin ids.
+            fetch (coroutine function): Upstream fetch for a list of ids; raises on failure.
+
+        Returns:
+            dict: Same shape as get_many.
+        """
+        ids = list(dict.fromkeys(ids))
+        now = self.clock()
+        lead: List[str] = []
+        wait: List["asyncio.Future[None]"] = []
+        for coin_id in ids:
+            if self._fresh(coin_id, now):
+                self.hits += 1
+            elif coin_id in self._ainflight:
+                self.coalesced += 1
+                pending = self._ainflight[coin_id]
+                if pending not in wait:
+                    wait.append(pending)
+            else:
+                self.misses += 1
+                lead.append(coin_id)
+        if lead:
+            flight: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+            for coin_id in lead:
+                self._ainflight[coin_id] = flight
+            try:
+                self.upstream_calls += 1
+                data = await fetch(lead)
+                with self._lock:
+                    self._store(lead, data, self.clock())
+            except Exception:
+                self.upstream_errors += 1
+            finally:
+                for coin_id in lead:
+                    self._ainflight.pop(coin_id, None)
+                flight.set_result(None)
+        for other in wait:
+            # shield: a cancelled waiter must not cancel the shared request's future
+            await asyncio.shield(other)
+        with self._lock:
+            return self._result(ids, self.clock())
+
+    def put(self, coin_id: str, data: Dict[str, Any], fetched_at: Optional[float] = None) -> None:
+        """Store pushed market data for a coin (e.g. from the price feed)."""
+        with self._lock:
+            self._entries[coin_id] = (data, fetched_at if fetched_at is not None else self.clock())
+
+    def peek(self, coin_id: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for a coin without fetching, fresh or not (None if unknown)."""
+        entry = self._entries.get(coin_id)
+        return dict(entry[0], as_of=entry[1]) if entry is not None and entry[0] is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/coalesced counters for sizing the TTL."""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "ttl": self.ttl,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale_served": self.stale_served,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        """Drop every cached entry (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by every handler in the process
+price_cache = PriceCache()
@@ -0,0 +1,316 @@
+"""
+price_feed.py
+
+Push-based price ingestion for Cryptiq bot.
+A long-lived task pulls ticks from a pluggable PriceSource (polling adapter, streaming feed, or a
+local replay file for tests) and publishes them on an in-process PriceBus. The bus writes every
+tick into the shared price cache and fans it out to subscribers such as the alert checker, so
+alerts fire within seconds of a move and the number of upstream calls no longer depends on how
+many users are active.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+
+import httpx
+
+import utils
+from price_cache import price_cache
+
+PRICE_SOURCE = os.environ.get("PRICE_SOURCE", "poll")
+PRICE_POLL_INTERVAL = float(os.environ.get("PRICE_POLL_INTERVAL", "10"))
+# How long a coin stays on the polling list after a user last asked for it
+WATCH_WINDOW = 15 * 60
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class PriceTick(NamedTuple):
+    """One price observation for a CoinGecko coin id."""
+    coin_id: str
+    usd: float
+    usd_24h_change: Optional[float]
+    ts: float
+
+
+TickHandler = Callable[[List[PriceTick]], Awaitable[None]]
+
+
+class _Subscription:
+    """A subscriber callback fed from its own bounded queue by a dedicated task."""
+
+    def __init__(self, name: str, handler: TickHandler):
+        self.name = name
+        self.handler = handler
+        # Created in start() so it binds to the bot's running event loop
+        self.queue: Optional["asyncio.Queue[List[PriceTick]]"] = None
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None:
+            self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def offer(self, ticks: List[PriceTick]) -> None:
+        """Queue a batch, dropping the oldest one if the subscriber has fallen behind."""
+        if self.queue is None:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(ticks)
+
+    async def run(self) -> None:
+        while True:
+            ticks = await self.queue.get()
+            try:
+                await self.handler(ticks)
+            except Exception as e:
+                utils.log_error(e, context=f"price bus subscriber {self.name}")
+
+
+class PriceBus:
+    """
+    In-process publish/subscribe hub for price ticks.
+
+    Also tracks which coin ids are wanted, so polling sources only ask upstream for coins
+    someone cares about: ids passed to watch() stay wanted for WATCH_WINDOW seconds, and
+    watch providers (e.g. the alert engine's coin list) are consulted on every poll.
+    """
+
+    def __init__(self) -> None:
+        self.latest: Dict[str, PriceTick] = {}
+        self._subs: List[_Subscription] = []
+        self._watched: Dict[str, float] = {}
+        self._providers: List[Callable[[], Iterable[str]]] = []
+        self._running = False
+        self.published = 0
+
+    def subscribe(self, name: str, handler: TickHandler) -> None:
+        """Register an async callback receiving each published batch of ticks."""
+        sub = _Subscription(name, handler)
+        self._subs.append(sub)
+        if self._running:
+            sub.start()
+
+    def publish(self, ticks: List[PriceTick]) -> None:
+        """Record ticks as the latest prices, refresh the price cache and notify subscribers."""
+        if not ticks:
+            return
+        for tick in ticks:
+            self.latest[tick.coin_id] = tick
+            data = {"usd": tick.usd}
+            if tick.usd_24h_change is not None:
+                data["usd_24h_change"] = tick.usd_24h_change
+            price_cache.put(tick.coin_id, data, tick.ts)
+        self.published += len(ticks)
+        for sub in self._subs:
+            sub.offer(ticks)
+
+    def watch(self, coin_ids: Iterable[str]) -> None:
+        """Mark coin ids as wanted (called when a user asks for them)."""
+        now = time.time()
+        for coin_id in coin_ids:
+            self._watched[coin_id] = now
+
+    def add_watch_provider(self, provider: Callable[[], Iterable[str]]) -> None:
+        """Register a callable returning coin ids that must always be tracked."""
+        self._providers.append(provider)
+
+    def watched(self) -> Set[str]:
+        """Return the coin ids currently wanted, expiring ones not asked for recently."""
+        cutoff = time.time() - WATCH_WINDOW
+        for coin_id in [c for c, t in self._watched.items() if t < cutoff]:
+            del self._watched[coin_id]
+        ids = set(self._watched)
+        for provider in self._providers:
+            ids.update(provider())
+        return ids
+
+    def start(self) -> None:
+        """Start subscriber tasks (must be called from the event loop)."""
+        self._running = True
+        for sub in self._subs:
+            sub.start()
+
+    async def stop(self) -> None:
+        """Cancel subscriber tasks."""
+        self._running = False
+        for sub in self._subs:
+            if sub.task is not None:
+                sub.task.cancel()
+        await asyncio.gather(*(s.task for s in self._subs if s.task is not None), return_exceptions=True)
+        for sub in self._subs:
+            sub.task = None
+            sub.queue = None
+
+    def stats(self) -> Dict[str, int]:
+        """Return publish and per-subscriber drop counters."""
+        stats = {"published": self.published, "coins": len(self.latest)}
+        for sub in self._subs:
+            stats[f"dropped_{sub.name}"] = sub.dropped
+        return stats
+
+
+# --- Sources ---
+
+class PriceSource:
+    """Base class for tick sources. run() publishes to the bus until cancelled."""
+
+    async def run(self, bus: PriceBus) -> None:
+        raise NotImplementedError
+
+
+class PollingSource(PriceSource):
+    """
+    Polls CoinGecko for every watched coin in one batched request per interval.
+
+    Args:
+        interval (float): Seconds between polls.
+    """
+
+    def __init__(self, interval: float = PRICE_POLL_INTERVAL):
+        self.interval = interval
+
+    async def run(self, bus: PriceBus) -> None:
+        while True:
+            started = time.monotonic()
+            ids = sorted(bus.watched())
+            if ids:
+                try:
+                    data = await utils.fetch_simple_prices_async(ids)
+                    now = time.time()
+                    bus.publish([
+                        PriceTick(coin_id, float(v["usd"]), v.get("usd_24h_change"), now)
+                        for coin_id, v in data.items() if isinstance(v, dict) and "usd" in v
+                    ])
+                except Exception as e:
+                    utils.log_error(e, context="price poll")
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+def _tick_from_json(obj: dict) -> PriceTick:
+    """Build a tick from {"coin_id"|"coin", "usd"|"price", "usd_24h_change"?, "ts"?}."""
+    return PriceTick(
+        str(obj.get("coin_id") or obj["coin"]),
+        float(obj["usd"] if "usd" in obj else obj["price"]),
+        obj.get("usd_24h_change"),
+        float(obj.get("ts") or time.time()),
+    )
+
+
+class StreamingSource(PriceSource):
+    """
+    Consumes a streaming HTTP endpoint that emits one JSON tick per line, reconnecting with
+    jittered backoff when the stream drops.
+
+    Args:
+        url (str): Stream URL.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+
+    async def run(self, bus: PriceBus) -> None:
+        attempt = 0
+        while True:
+            try:
+                async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None)) as client:
+                    async with client.stream("GET", self.url) as resp:
+                        resp.raise_for_status()
+                        attempt = 0
+                        async for line in resp.aiter_lines():
+                            if line.strip():
+                                bus.publish([_tick_from_json(json.loads(line))])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                utils.log_error(e, context="price stream")
+            await asyncio.sleep(random.uniform(0, min(30.0, 2 ** attempt)))
+            attempt += 1
+
+
+class ReplaySource(PriceSource):
+    """
+    Replays ticks from a local JSONL file, for tests and load runs.
+
+    Args:
+        path (str): File with one tick per line (see _tick_from_json).
+        speed (float): Playback speed multiplier; 0 publishes everything without waiting.
+        loop (bool): Start over at the end of the file.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = False):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+
+    async def run(self, bus: PriceBus) -> None:
+        while True:
+            prev_ts = None
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    tick = _tick_from_json(json.loads(line))
+                    if prev_ts is not None and self.speed > 0:
+                        await asyncio.sleep(max(0.0, (tick.ts - prev_ts) / self.speed))
+                    prev_ts = tick.ts
+                    bus.publish([tick._replace(ts=time.time())])
+                    await asyncio.sleep(0)
+            if not self.loop:
+                return
+
+
+def source_from_config(spec: str = PRICE_SOURCE) -> PriceSource:
+    """
+    Build a source from a PRICE_SOURCE spec: "poll", "stream:<url>" or "replay:<path>".
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "poll":
+        return PollingSource()
+    if kind == "stream" and arg:
+        return StreamingSource(arg)
+    if kind == "replay" and arg:
+        return ReplaySource(arg)
+    raise ValueError(f"Unknown PRICE_SOURCE: {spec!r}")
+
+
+# --- Ingestion task ---
+
+price_bus = PriceBus()
+_ingest_task: Optional[asyncio.Task] = None
+
+
+async def _ingest(source: PriceSource) -> None:
+    """Run the source, restarting it after unexpected failures."""
+    while True:
+        try:
+            await source.run(price_bus)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            utils.log_error(e, context="price ingestion")
+            await asyncio.sleep(5)
+
+
+async def start_price_feed(source: Optional[PriceSource] = None) -> None:
+    """Start subscriber tasks and the ingestion task (call from the bot's post_init)."""
+    global _ingest_task
+    price_bus.start()
+    if _ingest_task is None:
+        _ingest_task = asyncio.get_running_loop().create_task(_ingest(source or source_from_config()))
+
+
+async def stop_price_feed() -> None:
+    """Cancel ingestion and subscriber tasks (call from the bot's post_shutdown)."""
+    global _ingest_task
+    if _ingest_task is not None:
+        _ingest_task.cancel()
+        await asyncio.gather(_ingest_task, return_exceptions=True)
+        _ingest_task = None
+    await price_bus.stop()
@@ -0,0 +1,166 @@
+"""
+response_cache.py
+
+Shared cache of AI answers to general market questions for Cryptiq bot.
+Near-identical questions ("what's BTC doing today?", "What is btc doing today") are normalized to
+the same text, and the cache key adds a price fingerprint (current prices of the coins involved,
+rounded so one price tick maps to one key) and a portfolio fingerprint (strategy, coins held and
+language, which shape the prompt). Personalized or context-dependent prompts opt out. Entries
+expire after a TTL and are evicted LRU by entry count and total size in bytes; concurrent misses
+for the same key share one model call.
+"""
+import os
+import re
+import time
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+AI_CACHE_TTL = float(os.environ.get("AI_CACHE_TTL", "120"))
+AI_CACHE_MAX_ENTRIES = int(os.environ.get("AI_CACHE_MAX_ENTRIES", "1000"))
+AI_CACHE_MAX_BYTES = int(os.environ.get("AI_CACHE_MAX_BYTES", str(2 * 1024 * 1024)))
+PRICE_SIGNIFICANT_DIGITS = 3
+
+_CONTRACTIONS = {"what's": "what is", "whats": "what is", "how's": "how is", "hows": "how is",
+                 "where's": "where is", "it's": "it is", "isn't": "is not", "today's": "today"}
+_FILLER = {"the", "a", "an", "please", "pls", "hey", "hi", "cryptiq", "right", "now", "currently", "so"}
+# First-person and portfolio words: the answer is about this user, never share it
+_PERSONAL = {"i", "me", "my", "mine", "we", "our", "us", "portfolio", "holdings", "balance", "bank",
+             "should", "sell", "buy", "invest"}
+# Words that refer back to earlier messages: the answer depends on the conversation
+_CONTEXTUAL = {"it", "that", "this", "those", "they", "them", "also", "again", "more", "else", "above", "previous"}
+_MARKET = {"market", "markets", "crypto", "price", "prices", "news", "trend", "today", "doing", "up", "down",
+           "dominance", "volume"}
+
+
+def normalize(text: str) -> str:
+    """Canonical form of a question: lowercase, contractions expanded, punctuation and filler removed."""
+    text = unicodedata.normalize("NFKC", text).lower().replace("’", "'")
+    words = []
+    for word in text.split():
+        word = _CONTRACTIONS.get(word.strip("?!.,;:"), word)
+        for part in re.sub(r"[^\w\s]", " ", word).split():
+            if part not in _FILLER:
+                words.append(part)
+    return " ".join(words)
+
+
+def is_cacheable(normalized: str, known_coins: Iterable[str]) -> bool:
+    """True for general market questions; False for personal or follow-up prompts."""
+    words = set(normalized.split())
+    if not words or words & _PERSONAL or words & _CONTEXTUAL:
+        return False
+    return bool(words & _MARKET or words & set(known_coins))
+
+
+def price_fingerprint(prices: Dict[str, Optional[float]]) -> str:
+    """Rounded prices of the coins a question depends on, e.g. 'bitcoin=6.71e+04'."""
+    return ",".join(f"{coin}={'?' if price is None else format(price, f'.{PRICE_SIGNIFICANT_DIGITS}g')}"
+                    for coin, price in sorted(prices.items()))
+
+
+def portfolio_fingerprint(strategy: Any, coins: Iterable[str], language: str) -> str:
+    """The parts of a user's profile that go into a shareable prompt."""
+    return f"{strategy}|{','.join(sorted(set(str(c).lower() for c in coins)))}|{language}"
+
+
+def cache_key(normalized: str, prices: str, portfolio: str) -> str:
+    return hashlib.sha256("\x00".join((normalized, prices, portfolio)).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of answer texts bounded by entry count and bytes, with single-flight misses.
+
+    Args:
+        ttl (float): Seconds an answer stays valid.
+        max_entries (int): Maximum number of answers kept.
+        max_bytes (int): Maximum total UTF-8 size of the kept answers.
+        clock (callable): Time source, injectable for tests.
+    """
+
+    def __init__(self, ttl: float = AI_CACHE_TTL, max_entries: int = AI_CACHE_MAX_ENTRIES,
+                 max_bytes: int = AI_CACHE_MAX_BYTES, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()  # key -> (text, expires, size)
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= self.clock():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, text: str) -> None:
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (text, self.clock() + self.ttl, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Optional[str]]]) -> Tuple[Optional[str], str]:
+        """
+        Return (text, source) where source is "hit", "coalesced" or "computed". compute() runs only
+        on a miss with no identical request in flight; a None result is not cached.
+        """
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            return text, "hit"
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending), "coalesced"
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            text = await compute()
+        except BaseException:
+            future.set_result(None)
+            raise
+        else:
+            future.set_result(text)
+            if text is not None:
+                self.put(key, text)
+        finally:
+            del self._inflight[key]
+        return text, "computed"
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "hit_ratio": ((self.hits + self.coalesced) / lookups) if lookups else 0.0,
+        }
+
+
+# Shared by every AI chat request in the process
+response_cache = ResponseCache()
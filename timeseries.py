@@ -0,0 +1,302 @@
+"""
+timeseries.py
+
+Compact per-user portfolio value history for Cryptiq bot.
+Each user's history is two array-backed columns (timestamp, value) persisted as a small binary
+file of packed little-endian doubles: recording a point appends 16 bytes. Memory and disk per
+user stay bounded: once a series exceeds MAX_POINTS, everything but the newest RAW_POINTS is
+downsampled with LTTB (largest-triangle-three-buckets), which keeps the visual shape of the curve.
+Range queries and downsampling to a target point count serve charts and "performance since".
+"""
+import os
+import sys
+import time
+import bisect
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import metrics
+
+TIMESERIES_DIR = os.environ.get("CRYPTIQ_TIMESERIES_DIR", os.path.join(os.path.dirname(__file__), "timeseries"))
+TIMESERIES_CACHE_SIZE = int(os.environ.get("TIMESERIES_CACHE_SIZE", "5000"))  # user histories kept in memory
+MAX_POINTS = 2048
+RAW_POINTS = 1024
+_MAGIC = b"CQTS"
+_VERSION = 1
+_HEADER = struct.Struct("<4sH")
+_POINT_BYTES = 16
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> Tuple[List[float], List[float]]:
+    """
+    Downsample a series to `threshold` points with Largest-Triangle-Three-Buckets.
+    The first and last points are always kept; each bucket in between keeps the point forming the
+    largest triangle with the previously kept point and the average of the next bucket.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(xs), list(ys)
+    out_x = [xs[0]]
+    out_y = [ys[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_start = end
+        next_end = min(int((i + 2) * every) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = xs[n - 1], ys[n - 1]
+        else:
+            span = next_end - next_start
+            avg_x = sum(xs[next_start:next_end]) / span
+            avg_y = sum(ys[next_start:next_end]) / span
+        ax, ay = xs[a], ys[a]
+        best = start
+        best_area = -1.0
+        for j in range(start, min(end, n - 1)):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        out_x.append(xs[best])
+        out_y.append(ys[best])
+        a = best
+    out_x.append(xs[n - 1])
+    out_y.append(ys[n - 1])
+    return out_x, out_y
+
+
+class _Series:
+    """One user's (timestamp, value) columns."""
+    __slots__ = ("ts", "values")
+
+    def __init__(self) -> None:
+        self.ts = array("d")
+        self.values = array("d")
+
+
+class TimeSeriesStore:
+    """
+    Per-user portfolio value history with bounded size.
+
+    Args:
+        directory (str): Folder holding one binary file per user.
+        max_points (int): Points per user that trigger compaction.
+        raw_points (int): Newest points kept at full resolution when compacting.
+        capacity (int): Histories kept in memory; least recently used ones are dropped (they are on disk).
+    """
+
+    def __init__(self, directory: str = TIMESERIES_DIR, max_points: int = MAX_POINTS, raw_points: int = RAW_POINTS,
+                 capacity: int = TIMESERIES_CACHE_SIZE):
+        self.directory = directory
+        self.max_points = max_points
+        self.raw_points = raw_points
+        self.capacity = capacity
+        self._series: "OrderedDict[str, _Series]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    # --- Persistence ---
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.directory, f"{user_id}.bin")
+
+    def _load(self, user_id: str) -> _Series:
+        """Return a user's series, reading it from disk on first access (caller holds the lock)."""
+        series = self._series.get(user_id)
+        if series is not None:
+            self._series.move_to_end(user_id)
+            return series
+        series = _Series()
+        path = self._path(user_id)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            raw = b""
+        if len(raw) >= _HEADER.size and raw[:4] == _MAGIC:
+            body = raw[_HEADER.size:]
+            torn = len(body) % _POINT_BYTES
+            if torn:
+                # A crash mid-append left a partial point: cut it off on disk too, or the next
+                # append would land misaligned and shift every later point
+                body = body[:len(body) - torn]
+                with open(path, "r+b") as f:
+                    f.truncate(_HEADER.size + len(body))
+            interleaved = array("d")
+            interleaved.frombytes(body)
+            if sys.byteorder != "little":
+                interleaved.byteswap()
+            series.ts = interleaved[0::2]
+            series.values = interleaved[1::2]
+        self._series[user_id] = series
+        while len(self._series) > self.capacity:
+            self._series.popitem(last=False)
+        return series
+
+    @staticmethod
+    def _pack(ts: Sequence[float], values: Sequence[float]) -> bytes:
+        interleaved = array("d", [0.0]) * (2 * len(ts))
+        interleaved[0::2] = array("d", ts)
+        interleaved[1::2] = array("d", values)
+        if sys.byteorder != "little":
+            interleaved.byteswap()
+        return interleaved.tobytes()
+
+    def _append_file(self, user_id: str, ts: float, value: float) -> None:
+        path = self._path(user_id)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        with open(path, "ab") as f:
+            if size < _HEADER.size:
+                f.truncate(0)
+                f.write(_HEADER.pack(_MAGIC, _VERSION))
+            elif (size - _HEADER.size) % _POINT_BYTES:
+                # record_many appends without loading the file: drop a torn point here as well
+                f.truncate(size - (size - _HEADER.size) % _POINT_BYTES)
+            f.write(self._pack([ts], [value]))
+
+    def _rewrite_file(self, user_id: str, series: _Series) -> None:
+        path = self._path(user_id)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION))
+            f.write(self._pack(series.ts, series.values))
+        os.replace(tmp, path)
+
+    def _compact(self, series: _Series) -> None:
+        """Downsample all but the newest raw_points so the series fits in max_points."""
+        old = len(series.ts) - self.raw_points
+        target = max(3, self.max_points - self.raw_points) // 2
+        xs, ys = lttb(series.ts[:old], series.values[:old], target)
+        series.ts = array("d", xs) + series.ts[old:]
+        series.values = array("d", ys) + series.values[old:]
+
+    # --- Public API ---
+
+    @metrics.timed("storage_seconds", op="timeseries_record")
+    def record(self, user_id: Union[str, int], value: float, ts: Optional[float] = None) -> None:
+        """Append a portfolio value for a user (timestamps are expected to be non-decreasing)."""
+        uid = str(user_id)
+        ts = time.time() if ts is None else float(ts)
+        with self._lock:
+            self._append(uid, self._load(uid), ts, float(value))
+
+    def _append(self, uid: str, series: _Series, ts: float, value: float) -> None:
+        """Add a point to a loaded series and persist it (caller holds the lock)."""
+        if series.ts and ts < series.ts[-1]:
+            ts = series.ts[-1]
+        series.ts.append(ts)
+        series.values.append(value)
+        if len(series.ts) > self.max_points:
+            self._compact(series)
+            self._rewrite_file(uid, series)
+        else:
+            self._append_file(uid, ts, value)
+
+    @metrics.timed("storage_seconds", op="timeseries_record_many")
+    def record_many(self, points: Iterable[Tuple[Union[str, int], float]], ts: Optional[float] = None) -> int:
+        """
+        Append one value per user at a shared timestamp (bulk snapshots). Histories that are not in
+        memory are appended on disk without being loaded, unless the point triggers compaction.
+        The lock is taken per user, so readers are not blocked for the whole batch.
+
+        Returns:
+            int: Number of points recorded.
+        """
+        ts = time.time() if ts is None else float(ts)
+        count = 0
+        for user_id, value in points:
+            uid = str(user_id)
+            with self._lock:
+                series = self._series.get(uid)
+                if series is None:
+                    try:
+                        stored = (os.path.getsize(self._path(uid)) - _HEADER.size) // _POINT_BYTES
+                    except OSError:
+                        stored = 0
+                    if stored < self.max_points:
+                        self._append_file(uid, ts, float(value))
+                        count += 1
+                        continue
+                    series = self._load(uid)
+                self._append(uid, series, ts, float(value))
+            count += 1
+        return count
+
+    def range(self, user_id: Union[str, int], start: Optional[float] = None,
+              end: Optional[float] = None) -> Tuple[List[float], List[float]]:
+        """Return (timestamps, values) with start <= ts <= end (open-ended when None)."""
+        with self._lock:
+            series = self._load(str(user_id))
+            lo = 0 if start is None else bisect.bisect_left(series.ts, start)
+            hi = len(series.ts) if end is None else bisect.bisect_right(series.ts, end)
+            return list(series.ts[lo:hi]), list(series.values[lo:hi])
+
+    @metrics.timed("storage_seconds", op="timeseries_downsample")
+    def downsample(self, user_id: Union[str, int], points: int, start: Optional[float] = None,
+                   end: Optional[float] = None) -> Tuple[List[float], List[float]]:
+        """Return the range downsampled with LTTB to at most `points` points."""
+        xs, ys = self.range(user_id, start, end)
+        return lttb(xs, ys, points)
+
+    def value_at(self, user_id: Union[str, int], ts: float) -> Optional[float]:
+        """Return the last recorded value at or before ts, or None."""
+        with self._lock:
+            series = self._load(str(user_id))
+            i = bisect.bisect_right(series.ts, ts)
+            return series.values[i - 1] if i else None
+
+    def latest(self, user_id: Union[str, int]) -> Optional[Tuple[float, float]]:
+        """Return the most recent (timestamp, value), or None."""
+        with self._lock:
+            series = self._load(str(user_id))
+            return (series.ts[-1], series.values[-1]) if series.ts else None
+
+    def performance_since(self, user_id: Union[str, int], since: float) -> Optional[Tuple[float, float]]:
+        """
+        Return (absolute change, percent change) from the value at `since` to the latest value.
+        None if there is no value at or before `since` (the first recorded value is used instead
+        when the history starts after `since`).
+        """
+        latest = self.latest(user_id)
+        if latest is None:
+            return None
+        base = self.value_at(user_id, since)
+        if base is None:
+            xs, ys = self.range(user_id, since)
+            if not ys:
+                return None
+            base = ys[0]
+        change = latest[1] - base
+        return change, (change / base * 100) if base else 0.0
+
+    def delete(self, user_id: Union[str, int]) -> None:
+        """Remove a user's history from memory and disk."""
+        uid = str(user_id)
+        with self._lock:
+            self._series.pop(uid, None)
+            try:
+                os.remove(self._path(uid))
+            except FileNotFoundError:
+                pass
+
+
+_store: Optional[TimeSeriesStore] = None
+_store_lock = threading.Lock()
+
+
+def get_timeseries_store() -> TimeSeriesStore:
+    """Return the process-wide time-series store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TimeSeriesStore()
+    return _store
@@ -0,0 +1,124 @@
+"""
+update_processor.py
+
+Concurrent update processing for Cryptiq bot with per-user ordering.
+PerUserUpdateProcessor plugs into python-telegram-bot as the Application's update processor:
+updates from different users run concurrently on a bounded number of workers, while updates from
+the same user are processed strictly in arrival order (so onboarding state such as `setup_step`
+in context.user_data never races). Updates waiting for their user's turn do not occupy a worker.
+On shutdown it waits, up to a timeout, for in-flight updates to finish.
+"""
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "16"))
+UPDATE_MAX_PENDING = int(os.environ.get("UPDATE_MAX_PENDING", "256"))
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "30"))
+
+logger = logging.getLogger("cryptiq")
+
+
+class _UserQueue:
+    """Lock serialising one user's updates, plus how many updates hold or wait for it."""
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Update processor with a bounded worker pool and per-user ordering.
+
+    Args:
+        workers (int): Updates processed at the same time.
+        max_pending (int): Updates accepted at once, running or waiting; further updates wait in
+            the Application's update queue (or hold the webhook request) until one finishes.
+        drain_timeout (float): Seconds shutdown() waits for in-flight updates.
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS, max_pending: int = UPDATE_MAX_PENDING,
+                 drain_timeout: float = DRAIN_TIMEOUT):
+        super().__init__(max(workers, max_pending))
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self._worker_slots: Optional[asyncio.Semaphore] = None
+        self._users: Dict[Hashable, _UserQueue] = {}
+        self._in_flight = 0
+        self._idle: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def ordering_key(update: Any) -> Optional[Hashable]:
+        """Updates with the same key are processed in order: the sender, else the chat."""
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return ("user", update.effective_user.id)
+            if update.effective_chat is not None:
+                return ("chat", update.effective_chat.id)
+        return None
+
+    async def initialize(self) -> None:
+        # Created here so they bind to the running loop
+        self._worker_slots = asyncio.Semaphore(self.workers)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def do_process_update(self, update: Any, coroutine: Awaitable[Any]) -> None:
+        if self._worker_slots is None:
+            await self.initialize()
+        self._in_flight += 1
+        self._idle.clear()
+        key = self.ordering_key(update)
+        queue = None
+        if key is not None:
+            queue = self._users.get(key)
+            if queue is None:
+                queue = self._users[key] = _UserQueue()
+            queue.users += 1
+        try:
+            if queue is not None:
+                async with queue.lock:
+                    async with self._worker_slots:
+                        await coroutine
+            else:
+                async with self._worker_slots:
+                    await coroutine
+        finally:
+            if queue is not None:
+                queue.users -= 1
+                if not queue.users:
+                    del self._users[key]
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    def stats(self) -> Dict[str, int]:
+        """Return in-flight and per-user backlog figures."""
+        return {
+            "in_flight": self._in_flight,
+            "users_with_backlog": sum(1 for q in self._users.values() if q.users > 1),
+            "workers": self.workers,
+        }
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no update is in flight. Returns False if the timeout expired first."""
+        if self._idle is None or self._idle.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout if timeout is None else timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def shutdown(self) -> None:
+        if not await self.drain():
+            logger.warning(f"Shutting down with {self._in_flight} updates still in flight")
+            metrics.registry.inc("update_drain_timeouts_total")
@@ -4,133 +4,235 @@ utils.py
 Utility functions for Cryptiq bot, including market data fetching, error logging, prompt building, and chart helpers.
 These functions are used by handlers and other modules to keep code DRY and maintainable.
 """
-import os
-import json
-import datetime
-import requests
-import pytz
+import time
 import logging
-import matplotlib.pyplot as plt
 import io
-import asyncio
-
-# Configure logging for the entire bot
-LOG_FILE = os.path.join(os.path.dirname(__file__), "cryptiq.log")
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(name)s %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
+from price_cache import price_cache
+from http_client import get_http_client
+from coins import coin_registry
+import charts
+import timeseries
+import candles
+import metrics
+import ai_chat
+import log_pipeline
+
+# Heavy or rarely used dependencies (requests, matplotlib via charts.py) are imported where they
+# are first needed, so importing this module stays cheap on bot startup.
+
 logger = logging.getLogger("cryptiq")
 
+def configure_logging():
+    """
+    Configure logging for the entire bot (JSONL files + console, written by a background thread;
+    see log_pipeline.py). Called once from main.py at startup rather than at import time, so
+    importing modules has no side effects.
+    """
+    log_pipeline.start_logging()
+
 # --- Error logging helper ---
 def log_error(e, context=""):
     """
-    Logs errors to both error_log.json and the main log file with traceback and context.
+    Logs an error with traceback and context as a structured record. The record also goes to the
+    error log, and bursts of the same error are collapsed into one summary by the log pipeline.
 
     Args:
         e (Exception): The exception object.
         context (str): Additional context about the error.
     """
-    logger.error(f"[ERROR] {context}: {e}", exc_info=True)
-    try:
-        with open("error_log.json", "a") as f:
-            f.write(f"{datetime.datetime.now()}: {context}: {e}\n")
-    except Exception as file_err:
-        logger.error(f"Failed to write to error_log.json: {file_err}")
+    metrics.registry.inc("errors_total", context=context)
+    logger.error(f"[ERROR] {context}: {e}", exc_info=e, extra={"context": context})
 
 # --- Market data helper ---
-COIN_SYMBOL_TO_ID = {
-    'btc': 'bitcoin',
-    'bitcoin': 'bitcoin',
-    'ltc': 'litecoin',
-    'litecoin': 'litecoin',
-    # Add more mappings as needed
-}
 COINGECKO_SIMPLE_PRICE_API = "https://api.coingecko.com/api/v3/simple/price?vs_currencies=usd&include_24hr_change=true&ids={ids}"
 
+@metrics.timed("upstream_seconds", host="api.coingecko.com", client="sync")
+def _fetch_simple_prices(ids):
+    """
+    Fetch prices for a list of CoinGecko ids in one request. Ids missing from the coin registry
+    (CoinGecko's /coins/list) are dropped before the request. Raises on any upstream failure.
+
+    Args:
+        ids (list): CoinGecko coin ids.
+
+    Returns:
+        dict: The raw simple-price response, keyed by coin id.
+    """
+    import requests
+    ids = coin_registry.valid_ids(ids)
+    if not ids:
+        return {}
+    url = COINGECKO_SIMPLE_PRICE_API.format(ids='%2C'.join(ids))
+    logger.debug(f"[CoinGecko] Requesting URL: {url}")
+    resp = requests.get(url, timeout=10)
+    logger.debug(f"[CoinGecko] Status: {resp.status_code}")
+    resp.raise_for_status()
+    data = resp.json()
+    logger.debug(f"[CoinGecko] Response: {data}")
+    if not isinstance(data, dict) or 'status' in data or any('error' in v for v in data.values() if isinstance(v, dict)):
+        raise ValueError(f"CoinGecko API returned error data: {data}")
+    return data
+
+async def fetch_simple_prices_async(ids):
+    """
+    Async version of _fetch_simple_prices using the pooled HTTP client, bypassing the cache.
+    Raises on any upstream failure.
+
+    Args:
+        ids (list): CoinGecko coin ids.
+
+    Returns:
+        dict: The raw simple-price response, keyed by coin id.
+    """
+    ids = coin_registry.valid_ids(ids)
+    if not ids:
+        return {}
+    url = COINGECKO_SIMPLE_PRICE_API.format(ids='%2C'.join(ids))
+    data = await get_http_client().get_json(url)
+    if not isinstance(data, dict) or 'status' in data or any('error' in v for v in data.values() if isinstance(v, dict)):
+        raise ValueError(f"CoinGecko API returned error data: {data}")
+    return data
+
+def coin_id_for_symbol(symbol):
+    """Map a user-facing coin symbol, name or id (e.g. 'btc') to its CoinGecko id, or None if unlisted."""
+    return coin_registry.resolve(symbol)
+
+def coin_ids_for_symbols(coin_symbols):
+    """Map user-facing coin symbols to CoinGecko ids, skipping coins CoinGecko does not list."""
+    ids = [coin_id_for_symbol(s) for s in coin_symbols]
+    return list(dict.fromkeys(i for i in ids if i is not None))
+
 def get_market_data_for_coins(coin_symbols, debug_message=None):
     """
-    Fetch market data for a list of coin symbols from the CoinGecko API.
+    Fetch market data for a list of coin symbols, served from the shared price cache.
+    Only ids that are missing or expired in the cache are requested from CoinGecko, and
+    concurrent requests for the same ids share one upstream call.
 
     Args:
         coin_symbols (list): A list of coin symbols (e.g., ['btc', 'ltc']).
         debug_message (function): Optional. A callback function for debug messages.
 
     Returns:
-        dict: A dictionary with market data for the requested coins.
-    """
-    ids = [COIN_SYMBOL_TO_ID.get(str(s).lower(), str(s).lower()) for s in coin_symbols]
-    ids = [i for i in ids if i is not None]
-    ids_str = '%2C'.join(ids)
-    url = COINGECKO_SIMPLE_PRICE_API.format(ids=ids_str)
-    try:
-        print(f"[CoinGecko] Requesting URL: {url}")
-        resp = requests.get(url)
-        print(f"[CoinGecko] Status: {resp.status_code}")
-        data = resp.json()
-        print("[CoinGecko] Response:", data)
-        if not data or any('error' in v for v in data.values() if isinstance(v, dict)):
-            print("[CoinGecko] API returned error or empty data.")
+        dict: A dictionary with market data for the requested coins. Each entry carries an
+            "as_of" timestamp, plus "stale": True when the upstream call failed and the
+            last known price is being served instead.
+    """
+    ids = coin_ids_for_symbols(coin_symbols)
+
+    def fetch(missing):
+        try:
+            return _fetch_simple_prices(missing)
+        except Exception as e:
+            logger.warning(f"[CoinGecko] Exception: {e}")
             if debug_message is not None:
-                debug_message(f"CoinGecko API error or empty data. URL: {url} Response: {data}")
-        return data
-    except Exception as e:
-        print("[CoinGecko] Exception:", e)
+                debug_message(f"CoinGecko Exception: {e} IDs: {','.join(missing)}")
+            raise
+
+    data = price_cache.get_many(ids, fetch)
+    if not data:
+        logger.warning(f"[CoinGecko] No data available for: {ids}")
         if debug_message is not None:
-            debug_message(f"CoinGecko Exception: {e} URL: {url}")
-        return {}
+            debug_message(f"CoinGecko API error or empty data. IDs: {','.join(ids)}")
+    return data
+
+async def get_market_data_for_coins_async(coin_symbols, debug_message=None):
+    """
+    Non-blocking version of get_market_data_for_coins for use inside async handlers.
+    Uses the pooled HTTP client (timeouts, retry with backoff) and the shared price cache.
+
+    Args:
+        coin_symbols (list): A list of coin symbols (e.g., ['btc', 'ltc']).
+        debug_message (function): Optional. A callback function for debug messages.
+
+    Returns:
+        dict: Same shape as get_market_data_for_coins.
+    """
+    ids = coin_ids_for_symbols(coin_symbols)
+
+    async def fetch(missing):
+        try:
+            return await fetch_simple_prices_async(missing)
+        except Exception as e:
+            logger.warning(f"[CoinGecko] Exception: {e}")
+            if debug_message is not None:
+                debug_message(f"CoinGecko Exception: {e} IDs: {','.join(missing)}")
+            raise
+
+    data = await price_cache.aget_many(ids, fetch)
+    if not data and debug_message is not None:
+        debug_message(f"CoinGecko API error or empty data. IDs: {','.join(ids)}")
+    return data
+
+# --- News source (refreshed in the background by news.py) ---
+CRYPTOCOMPARE_NEWS_API = "https://min-api.cryptocompare.com/data/v2/news/?lang=EN"
 
 # --- Chart helpers ---
 
-async def send_portfolio_pie_chart(update, holdings, market_data):
+async def send_portfolio_pie_chart(update, holdings, market_data, language="en"):
     """
     Send a pie chart of the portfolio allocation to the user.
+    The chart is rendered off the event loop and reused from cache for identical inputs.
 
     Args:
         update (telegram.Update): The update object from Telegram.
         holdings (dict): The user's portfolio holdings.
         market_data (dict): The current market data for the user's coins.
+        language (str): The user's language code, used for chart titles.
 
     Returns:
         None
     """
-    # Placeholder for async chart sending logic
-    await asyncio.sleep(0)
+    message = getattr(update, 'effective_message', None)
+    if message is None:
+        return None
+    amounts = {}
+    prices = {}
+    for symbol, amount in holdings.items():
+        try:
+            amounts[symbol] = float(amount)
+        except (TypeError, ValueError):
+            continue
+        prices[symbol] = float(market_data.get(coin_id_for_symbol(symbol), {}).get('usd', 0))
+    png = await charts.chart_service.pie_chart(amounts, prices, language)
+    if png is not None:
+        await message.reply_photo(photo=io.BytesIO(png))
     return None
 
-async def send_portfolio_line_chart(update, user_id):
+LINE_CHART_POINTS = 60
+
+async def send_portfolio_line_chart(update, user_id, language="en", amounts=None):
     """
-    Send a line chart of the portfolio value over time to the user.
+    Send a line chart of the portfolio value over time to the user, drawn from the user's
+    portfolio history downsampled to LINE_CHART_POINTS points. Until the user has a history,
+    the chart shows the current holdings valued over the last 7 days from the candle store.
+    The chart is rendered off the event loop and reused from cache for identical inputs.
 
     Args:
         update (telegram.Update): The update object from Telegram.
         user_id (int): The user's Telegram ID.
+        language (str): The user's language code, used for chart titles.
+        amounts (dict): Current holdings as {coin id: amount}, used when there is no history yet.
 
     Returns:
         None
     """
-    # Placeholder for async chart sending logic
-    await asyncio.sleep(0)
+    message = getattr(update, 'effective_message', None)
+    if message is None:
+        return None
+    xs, ys = timeseries.get_timeseries_store().downsample(user_id, LINE_CHART_POINTS)
+    if len(xs) < 2 and amounts:
+        grid, values = candles.get_candle_store().portfolio_series(amounts, time.time() - 7 * 86400)
+        xs, ys = timeseries.lttb(grid.tolist(), values.tolist(), LINE_CHART_POINTS)
+    points = [(time.strftime('%m-%d %H:%M', time.gmtime(ts)), value) for ts, value in zip(xs, ys)]
+    png = await charts.chart_service.line_chart(points, language)
+    if png is not None:
+        await message.reply_photo(photo=io.BytesIO(png))
     return None
 
 # --- Add all handler logic here for modularization ---
-# (Move the rest of the handler logic from cryptiq_bot.py here, e.g. settings_command, language_command, etc.)
+# (Move the rest of the handler logic from cryptiq_bot.py here, e.g. settings_command, set_holdings, etc.)
 # For now, add stubs to resolve import errors in handlers.py
 
-async def settings_command(update, context):
-    pass
-async def language_command(update, context):
-    pass
-async def main_menu(update, context):
-    pass
-async def set_language(update, context):
-    pass
-async def language_chosen(update, context):
-    pass
 async def news(update, context):
     pass
 async def set_alert(update, context):
@@ -147,10 +249,12 @@ async def set_strategy(update, context):
     pass
 async def set_holdings(update, context):
     pass
-async def button_handler(update, context):
-    pass
 async def handle_message(update, context):
-    pass
+    """
+    AI chat for free-text messages (already validated by handlers.handle_message). The reply is
+    streamed into a message that is edited as tokens arrive; see ai_chat.py.
+    """
+    await ai_chat.stream_reply(update, context)
 async def help_command(update, context):
     pass
 async def start(update, context):
@@ -159,7 +263,5 @@ async def ask_initial_questions(update, context):
     pass
 async def handle_setup_answers(update, context):
     pass
-async def alert_checker(app):
-    pass
 
 # Add more utility functions as needed (e.g., build_prompt, chart helpers, etc.)
@@ -0,0 +1,249 @@
+"""
+valuation.py
+
+Bulk portfolio valuation for Cryptiq bot.
+Every user's holdings are loaded into flat NumPy arrays of (user, coin, amount) entries, so all
+portfolios are revalued against a single price vector in one vectorized pass: current value,
+value 24h ago (from CoinGecko's 24h change), the change, and each user's biggest gainer and loser.
+A periodic snapshot job records every user's value in the history store (timeseries.py), and a
+daily digest job also queues a short summary per user through the notifier at digest priority.
+"""
+import os
+import math
+import time
+import asyncio
+import datetime
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import database
+import metrics
+import timeseries
+import utils
+from coins import coin_registry
+from messages import catalog, user_language
+from notifier import notifier, PRIORITY_DIGEST
+
+if TYPE_CHECKING:
+    import numpy as np
+
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", "3600"))  # seconds, 0 = off
+DIGEST_TIME = os.environ.get("DIGEST_TIME", "08:00")  # HH:MM UTC, empty = off
+
+
+class PortfolioBook:
+    """
+    Holdings of every user with a portfolio, stored sparsely as parallel (row, column, amount)
+    arrays: memory grows with the number of holdings, not users x distinct coins.
+
+    Args:
+        user_ids (list): Row labels.
+        coin_ids (list): Column labels (CoinGecko ids held by at least one user).
+        rows (np.ndarray): Row of each holding, non-decreasing (a user's holdings are contiguous).
+        cols (np.ndarray): Column of each holding.
+        amounts (np.ndarray): float64 amount of each holding.
+        digest (np.ndarray): Per-user flag, False for users who opted out of the daily digest.
+        languages (list): Per-user language code, for messages.
+    """
+
+    def __init__(self, user_ids: List[str], coin_ids: List[str], rows: "np.ndarray", cols: "np.ndarray",
+                 amounts: "np.ndarray", digest: "np.ndarray", languages: Optional[List[str]] = None):
+        self.user_ids = user_ids
+        self.coin_ids = coin_ids
+        self.rows = rows
+        self.cols = cols
+        self.amounts = amounts
+        self.digest = digest
+        self.languages = languages if languages is not None else [user_language(None)] * len(user_ids)
+
+    @classmethod
+    def build(cls, users: Iterable[Tuple[str, Dict[str, Any]]]) -> "PortfolioBook":
+        """
+        Build the book from (user_id, user_data) pairs. Unknown coins and amounts that are not
+        positive numbers are skipped; two symbols for one coin ("btc", "bitcoin") are summed.
+        """
+        import numpy as np
+        user_ids: List[str] = []
+        digest: List[bool] = []
+        languages: List[str] = []
+        coin_index: Dict[str, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        values: List[float] = []
+        for uid, user_data in users:
+            entries: Dict[str, float] = {}
+            for symbol, amount in (user_data.get("holdings") or {}).items():
+                try:
+                    amount = float(amount)
+                except (TypeError, ValueError):
+                    continue
+                coin_id = coin_registry.resolve(symbol)
+                if coin_id is not None and math.isfinite(amount) and amount > 0:
+                    entries[coin_id] = entries.get(coin_id, 0.0) + amount
+            if not entries:
+                continue
+            row = len(user_ids)
+            user_ids.append(str(uid))
+            digest.append(user_data.get("digest") is not False)
+            languages.append(user_language(user_data))
+            for coin_id, amount in entries.items():
+                rows.append(row)
+                cols.append(coin_index.setdefault(coin_id, len(coin_index)))
+                values.append(amount)
+        return cls(user_ids, list(coin_index), np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp),
+                   np.asarray(values, dtype=np.float64), np.asarray(digest, dtype=bool), languages)
+
+
+def price_vectors(coin_ids: List[str], market_data: Dict[str, Any]) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    Current and 24h-ago USD price per coin, plus a mask of coins without a live price (missing or
+    stale entries, priced at 0).
+    """
+    import numpy as np
+    now = np.zeros(len(coin_ids))
+    day_ago = np.zeros(len(coin_ids))
+    missing = np.zeros(len(coin_ids), dtype=bool)
+    for j, coin_id in enumerate(coin_ids):
+        entry = market_data.get(coin_id)
+        if not entry or entry.get("stale") or "usd" not in entry:
+            missing[j] = True
+            continue
+        now[j] = float(entry["usd"])
+        change = entry.get("usd_24h_change")
+        day_ago[j] = now[j] / (1 + float(change) / 100) if change is not None and float(change) > -100 else now[j]
+    return now, day_ago, missing
+
+
+class Revaluation(NamedTuple):
+    """Result of revaluing a PortfolioBook; arrays are indexed like book.user_ids."""
+    book: PortfolioBook
+    ts: float
+    values: "np.ndarray"
+    day_ago: "np.ndarray"
+    change: "np.ndarray"
+    change_pct: "np.ndarray"
+    gainer: "np.ndarray"  # column of the holding that gained most in USD
+    gainer_usd: "np.ndarray"
+    loser: "np.ndarray"  # column of the holding that lost most in USD
+    loser_usd: "np.ndarray"
+    incomplete: "np.ndarray"  # user holds a coin without a live price
+
+
+def revalue(book: PortfolioBook, market_data: Dict[str, Any], ts: Optional[float] = None) -> Revaluation:
+    """
+    Revalue every portfolio in the book against one set of prices.
+
+    Args:
+        book (PortfolioBook): Holdings arrays.
+        market_data (dict): CoinGecko simple-price entries keyed by coin id.
+        ts (float): Timestamp of the valuation (default: now).
+
+    Returns:
+        Revaluation: Values, 24h change and movers for every user.
+    """
+    import numpy as np
+    now, day_ago_prices, missing = price_vectors(book.coin_ids, market_data)
+    n = len(book.user_ids)
+    rows, cols, amounts = book.rows, book.cols, book.amounts
+    values = np.bincount(rows, weights=amounts * now[cols], minlength=n)
+    day_ago = np.bincount(rows, weights=amounts * day_ago_prices[cols], minlength=n)
+    change = values - day_ago
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change_pct = np.where(day_ago > 0, change / day_ago * 100, 0.0)
+    gainer = np.zeros(n, dtype=np.intp)
+    loser = np.zeros(n, dtype=np.intp)
+    gainer_usd = np.zeros(n)
+    loser_usd = np.zeros(n)
+    if len(rows):
+        # Sort each user's holdings by USD move: the first is the biggest loser, the last the biggest gainer
+        contrib = amounts * (now - day_ago_prices)[cols]
+        order = np.lexsort((contrib, rows))
+        firsts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        lasts = np.r_[firsts[1:], len(rows)] - 1
+        users = rows[firsts]
+        gainer[users] = cols[order[lasts]]
+        gainer_usd[users] = contrib[order[lasts]]
+        loser[users] = cols[order[firsts]]
+        loser_usd[users] = contrib[order[firsts]]
+    incomplete = np.bincount(rows[missing[cols]], minlength=n) > 0
+    return Revaluation(book, time.time() if ts is None else ts, values, day_ago, change, change_pct,
+                       gainer, gainer_usd, loser, loser_usd, incomplete)
+
+
+def _symbol(book: PortfolioBook, col: int) -> str:
+    coin = coin_registry.get(book.coin_ids[col])
+    return coin.symbol.upper() if coin else book.coin_ids[col]
+
+
+def render_digest(rev: Revaluation, i: int) -> str:
+    """Daily digest text for row i of a revaluation, in the user's language."""
+    language = rev.book.languages[i]
+    lines = [
+        catalog.render(language, "digest.title"),
+        catalog.render(language, "digest.value", value=float(rev.values[i])),
+        catalog.render(language, "digest.change_24h", change=float(rev.change[i]), pct=float(rev.change_pct[i])),
+    ]
+    if rev.gainer_usd[i] > 0:
+        lines.append(catalog.render(language, "digest.top_gainer", symbol=_symbol(rev.book, rev.gainer[i]), usd=float(rev.gainer_usd[i])))
+    if rev.loser_usd[i] < 0:
+        lines.append(catalog.render(language, "digest.top_loser", symbol=_symbol(rev.book, rev.loser[i]), usd=float(rev.loser_usd[i])))
+    return "\n".join(lines) + catalog.render(language, "digest.footer")
+
+
+# --- Jobs ---
+
+_last_run: Dict[str, Any] = {"users": 0, "coins": 0, "revalue_seconds": 0.0, "at": 0.0}
+
+
+async def revalue_all() -> Optional[Revaluation]:
+    """Load every portfolio (off the event loop), fetch the coins' prices once and revalue."""
+    loop = asyncio.get_running_loop()
+    book = await loop.run_in_executor(None, lambda: PortfolioBook.build(database.iter_users()))
+    if not book.user_ids:
+        return None
+    market_data = await utils.get_market_data_for_coins_async(book.coin_ids)
+    start = time.perf_counter()
+    rev = revalue(book, market_data)
+    elapsed = time.perf_counter() - start
+    metrics.registry.observe("revalue_seconds", elapsed)
+    _last_run.update(users=len(book.user_ids), coins=len(book.coin_ids), revalue_seconds=elapsed, at=time.time())
+    return rev
+
+
+def record_snapshots(rev: Revaluation) -> int:
+    """Append every fully priced portfolio value to the history store. Returns the number recorded."""
+    import numpy as np
+    rows = np.flatnonzero(~rev.incomplete)
+    return timeseries.get_timeseries_store().record_many(
+        ((rev.book.user_ids[i], float(rev.values[i])) for i in rows), ts=rev.ts)
+
+
+async def snapshot_job(context) -> None:
+    """JobQueue callback recording every user's portfolio value."""
+    rev = await revalue_all()
+    if rev is not None:
+        await asyncio.get_running_loop().run_in_executor(None, record_snapshots, rev)
+
+
+async def daily_digest_job(context) -> None:
+    """JobQueue callback recording a snapshot and queueing each user's daily digest."""
+    rev = await revalue_all()
+    if rev is None:
+        return
+    await asyncio.get_running_loop().run_in_executor(None, record_snapshots, rev)
+    import numpy as np
+    notifier.ensure_started(context.bot)
+    for i in np.flatnonzero(rev.book.digest & ~rev.incomplete & (rev.values > 0)):
+        notifier.notify(int(rev.book.user_ids[i]), render_digest(rev, i), priority=PRIORITY_DIGEST, merge_key="digest")
+
+
+def digest_time() -> Optional[datetime.time]:
+    """DIGEST_TIME as a UTC time of day, or None when the digest is disabled."""
+    if not DIGEST_TIME.strip():
+        return None
+    hour, minute = (int(part) for part in DIGEST_TIME.split(":"))
+    return datetime.time(hour, minute, tzinfo=datetime.timezone.utc)
+
+
+def stats() -> Dict[str, Any]:
+    """Size and duration of the last bulk revaluation."""
+    return dict(_last_run)